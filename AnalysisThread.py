@@ -6,11 +6,21 @@
 # @Blog    ：https://blog.cuger.cn
 
 
+import os
+import time
+
 from PyQt5.QtCore import QThread, pyqtSignal
 
 from ImageTool import *
 
 
+class AnalysisCancelled(Exception):
+    '''
+    raised in the analysis when it is cancelled or out of the time budget
+    '''
+    pass
+
+
 # 所有 mask, 0 均是被遮住的部分, 不要的
 
 # basic threshold, global OTSU
@@ -18,85 +28,466 @@ class AnalysisThread(QThread):
     '''
     Analysis Thread for global OTSU
     '''
+    # the result can be updated when an ROI is added or removed, see IncrementalAnalysis
+    isIncremental = False
+
     process = pyqtSignal(int)
     finish = pyqtSignal(np.ndarray)
+    cancelled = pyqtSignal(str)  # the reason, finish is not emitted
 
     def __init__(self):
         QThread.__init__(self)
         self.grayImage = None
         self.labelImage = None
         self.edgeMask = None  # inner the polygon is True
-        self.ROIsMaskList = None  # inner the ROI is True
+        self.ROIsWindowList = None  # (window, mask) of each ROI, inner the ROI is True, see QPolygon2LocalMask
+        self.ROIsMask = None  # union of the ROIs, computed once and shared by the methods
+        self.cropHistogram = None  # histogram of the pixels in the crop polygon, shared by the methods
+        self.ROIsMeanStd = None  # mean and standard deviation of the pixels in the ROIs, shared by the methods
+        self.ROIsResult = None  # (binary image of the window, threshold) of each ROI, for the incremental methods
+        self.threshold = None  # threshold of the last analysis, list for the local methods
+        self.sweep = None  # levels, areas and marks of thresholdSweep, dropped when the ROIs change
+        self.processRange = (0, 100)
+        self.isCancelled = False
+        self.timeBudget = None  # seconds, None for no limit
+        self.startTime = None
+
+    def setTimeBudget(self, timeBudget=None):
+        '''
+        :param timeBudget: wall-clock seconds of the analysis, None for no limit
+        '''
+        self.timeBudget = timeBudget
+
+    def cancel(self):
+        # checked between the ROIs and the stages of the analysis
+        self.isCancelled = True
+
+    def checkCancelled(self):
+        if self.isCancelled:
+            raise AnalysisCancelled('The analysis is cancelled.')
+        if self.timeBudget and self.startTime and time.time() - self.startTime > self.timeBudget:
+            raise AnalysisCancelled('The analysis exceeds the time budget of %g s.' % self.timeBudget)
 
     def setParameters(self, grayImage: np.array, cropPolygon: QPolygonF = None, ROIs: list = []):
         self.grayImage = grayImage
         if not cropPolygon:
             self.edgeMask = np.zeros((self.grayImage.shape[0], self.grayImage.shape[1]), dtype=bool)
         else:
-            self.edgeMask = QPolygon2Mask(self.grayImage.shape[0], self.grayImage.shape[1], cropPolygon)
-        self.ROIsMaskList = []
-        for roi in ROIs:
-            self.ROIsMaskList.append(
-                np.logical_and(QPolygon2Mask(self.grayImage.shape[0], self.grayImage.shape[1], roi), self.edgeMask))
+            self.edgeMask = QPolygon2Mask(self.grayImage.shape[1], self.grayImage.shape[0], cropPolygon)
+        self.ROIsWindowList = [self._ROIWindow(roi) for roi in ROIs]
+        self.ROIsMask = None
+        self.cropHistogram = None
+        self.ROIsMeanStd = None
+        self.ROIsResult = None
+        self.sweep = None
+
+    def setIntermediates(self, other):
+        '''
+        share the gray image, the masks and the time budget of the other analysis instead of setParameters
+        :param other: AnalysisThread whose parameters are set
+        '''
+        self.grayImage = other.grayImage
+        self.edgeMask = other.edgeMask
+        self.ROIsWindowList = list(other.ROIsWindowList)
+        self.ROIsMask = other.ROIsMask
+        self.cropHistogram = other.cropHistogram
+        self.ROIsMeanStd = other.ROIsMeanStd
+        self.ROIsResult = None
+        self.sweep = None
+        self.timeBudget = other.timeBudget
+        self.startTime = other.startTime
+
+    def _ROIWindow(self, roi: QPolygonF):
+        window, mask = QPolygon2LocalMask(self.grayImage.shape[1], self.grayImage.shape[0], roi)
+        return window, np.logical_and(mask, self.edgeMask[window])
 
     def run(self):
         if type(self.grayImage) == np.array:
             return
-        self.labelImage = OtsuWithMask2bw(self.grayImage, self.edgeMask == 0)
-        self.process.emit(100)
+        self.startTime = time.time()
+        try:
+            self.labelImage = self.analysis()
+            # cancelled during the last stage, the result is dropped too
+            if self.isCancelled:
+                raise AnalysisCancelled('The analysis is cancelled.')
+        except AnalysisCancelled as e:
+            # discard the partial results
+            self.labelImage = None
+            self.cancelled.emit(str(e))
+            return
+        self.emitResult()
+
+    def emitResult(self):
+        # the result of the analysis not cancelled
         self.finish.emit(self.labelImage)
 
+    def analysis(self):
+        '''
+        :return: binary image, the threshold is saved in self.threshold
+        '''
+        self.threshold = OtsuThresholdByHistogram(*self.getCropHistogram())
+        self.checkCancelled()
+        bw = ThresholdWithROIMask2bw(self.grayImage, self.edgeMask, self.threshold)
+        self._updateProcess(100)
+        return bw
+
+    def getROIsMask(self):
+        if self.ROIsMask is None:
+            ROIsMask = np.zeros(self.grayImage.shape, dtype=bool)
+            for i, (window, roiMask) in enumerate(self.ROIsWindowList):
+                self.checkCancelled()
+                self._updateProcess(i / len(self.ROIsWindowList) * 100)
+                ROIsMask[window] |= roiMask
+            self.ROIsMask = ROIsMask
+        return self.ROIsMask
+
+    def getCropHistogram(self):
+        '''
+        :return: hist and bin centers of the pixels in the crop polygon, see MaskedHistogram
+        '''
+        if self.cropHistogram is None:
+            self.cropHistogram = MaskedHistogram(self.grayImage, self.edgeMask)
+        return self.cropHistogram
+
+    def getROIsMeanStd(self):
+        '''
+        :return: mean and standard deviation of the pixels in the ROIs, from the histogram for 8-bit and 16-bit images,
+        see MeanStdWithROIMask
+        '''
+        if self.ROIsMeanStd is None:
+            self.ROIsMeanStd = MeanStdWithROIMask(self.grayImage, self.getROIsMask())
+        return self.ROIsMeanStd
+
+    def thresholdSweep(self):
+        '''
+        damaged area versus threshold in the crop area, with the global OTSU and Riss thresholds marked, computed once
+        for the image and the ROIs
+        :return: levels, areas and marks, see ImageTool.ThresholdSweep
+        '''
+        if self.sweep is None:
+            marks = [('Global OTSU', OtsuThresholdByHistogram(*self.getCropHistogram()))]
+            if len(self.ROIsWindowList):
+                marks.append(('Riss', RissAnalysisThread._getRissThreshold(*self.getROIsMeanStd())))
+            levels, areas = ThresholdSweep(self.grayImage, self.edgeMask, [threshold for method, threshold in marks])
+            self.sweep = (levels, areas, marks)
+        return self.sweep
+
+    def _updateProcess(self, value):
+        # map the process of the method into processRange
+        start, end = self.processRange
+        self.process.emit(int(start + value / 100 * (end - start)))
+
+
+# the result is the union of the results of the ROIs
+class IncrementalAnalysis:
+    '''
+    mixin of the analysis threads analyzing each ROI by _analysisROI(window, roiMask), which returns the binary image of
+    the window and the threshold of the ROI, None if the ROI is empty. the result of the last analysis is updated by
+    the ROIs added or removed only.
+    '''
+    isIncremental = True
+
+    def addROI(self, roi: QPolygonF):
+        '''
+        analyze the new ROI only and merge it into the last result
+        :return: window of the changed region
+        '''
+        window, roiMask = self._ROIWindow(roi)
+        self.ROIsWindowList.append((window, roiMask))
+        self.ROIsMeanStd = None
+        self.sweep = None
+        self.ROIsResult.append(self._analysisROI(window, roiMask))
+        roiBw, threshold = self.ROIsResult[-1]
+        if roiBw is not None:
+            self.labelImage[window] |= roiBw
+        self._updateROIsResult()
+        return window
+
+    def removeROIs(self, indices: list):
+        '''
+        remove the ROIs and merge the results of the other ROIs in their windows
+        :param indices: indices of the ROIs in the order of setParameters and addROI
+        :return: windows of the changed regions
+        '''
+        windows = []
+        self.ROIsMeanStd = None
+        self.sweep = None
+        for i in sorted(indices, reverse=True):
+            windows.append(self.ROIsWindowList.pop(i)[0])
+            self.ROIsResult.pop(i)
+        for window in windows:
+            bw = np.zeros(self.labelImage[window].shape, dtype=bool)
+            for (roiWindow, roiMask), (roiBw, threshold) in zip(self.ROIsWindowList, self.ROIsResult):
+                intersection = IntersectWindow(window, roiWindow)
+                if roiBw is not None and intersection:
+                    bw[intersection[1]] |= roiBw[intersection[2]]
+            self.labelImage[window] = bw
+        self._updateROIsResult()
+        return windows
+
+    def _updateROIsResult(self):
+        self.ROIsMask = None
+        self.threshold = [threshold for roiBw, threshold in self.ROIsResult if roiBw is not None]
+
+
 # manual, ROIs to Zones
-class ROIsToZonesAnalysisThread(AnalysisThread):
+class ROIsToZonesAnalysisThread(IncrementalAnalysis, AnalysisThread):
     def __init__(self):
         AnalysisThread.__init__(self)
 
-    def run(self):
-        bw = np.zeros(self.grayImage.shape, dtype=bool)
-        for i, roiMask in enumerate(self.ROIsMaskList):
-            self.process.emit(i / len(self.ROIsMaskList) * 100)
-            bw = np.logical_or(roiMask, bw)
-        self.finish.emit(bw)
+    def analysis(self):
+        self.ROIsResult = [self._analysisROI(window, roiMask) for window, roiMask in self.ROIsWindowList]
+        self.threshold = None
+        return self.getROIsMask().copy()
+
+    def _analysisROI(self, window, roiMask):
+        return (roiMask, None) if roiMask.any() else (None, None)
+
+    def _updateROIsResult(self):
+        self.ROIsMask = None
+
 
 # SDZM, local binarization for each ROIs
-class ROIsOTSUAnalysisThread(AnalysisThread):
+class ROIsOTSUAnalysisThread(IncrementalAnalysis, AnalysisThread):
     def __init__(self):
         AnalysisThread.__init__(self)
+        self.workers = 1  # 1 for analyzing the ROIs one by one
+        self.executorType = 'thread'
 
-    def run(self):
+    def setWorkers(self, workers=None, executorType='thread'):
+        '''
+        analyze the ROIs in parallel
+        :param workers: number of workers, None for the number of CPUs
+        :param executorType: 'thread' or 'process'
+        '''
+        if executorType not in ['thread', 'process']:
+            raise ValueError('The executor type should be thread or process.')
+        self.workers = workers or os.cpu_count()
+        self.executorType = executorType
+
+    def analysis(self):
         bw = np.zeros(self.grayImage.shape, dtype=bool)
-        for i, roiMask in enumerate(self.ROIsMaskList):
-            self.process.emit(i / len(self.ROIsMaskList) * 100)
-            roiBw = OtsuWithMask2bw(self.grayImage, roiMask == 0)
-            bw = np.logical_or(roiBw, bw)
-        self.finish.emit(bw)
+        if self.workers > 1 and len(self.ROIsWindowList) > 1:
+            roisResult = self._runParallel()
+        else:
+            roisResult = []
+            for i, (window, roiMask) in enumerate(self.ROIsWindowList):
+                self.checkCancelled()
+                self._updateProcess(i / len(self.ROIsWindowList) * 100)
+                roisResult.append(self._analysisROI(window, roiMask))
+        # merge in the order of ROIs, only the bounding box of the ROI is written
+        for (window, roiMask), (roiBw, threshold) in zip(self.ROIsWindowList, roisResult):
+            if roiBw is not None:
+                bw[window] |= roiBw
+        self.ROIsResult = roisResult
+        self._updateROIsResult()
+        return bw
+
+    def _analysisROI(self, window, roiMask):
+        return _ROIOtsu2bw(self.grayImage[window], roiMask)
+
+    def _runParallel(self):
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+        executorClass = ThreadPoolExecutor if self.executorType == 'thread' else ProcessPoolExecutor
+        roisResult = [None] * len(self.ROIsWindowList)
+        executor = executorClass(max_workers=self.workers)
+        futures = {}
+        try:
+            for i, (window, roiMask) in enumerate(self.ROIsWindowList):
+                futures[executor.submit(_ROIOtsu2bw, self.grayImage[window], roiMask)] = i
+            for finished, future in enumerate(as_completed(futures)):
+                self.checkCancelled()
+                roisResult[futures[future]] = future.result()
+                self._updateProcess((finished + 1) / len(futures) * 100)
+        finally:
+            # the ROIs not started are dropped when cancelled, shutdown(cancel_futures=True) needs python 3.9
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+        return roisResult
+
+
+def _ROIOtsu2bw(image: np.array, roiMask: np.array):
+    '''
+    OTSU in the window of ROI
+    :param image: gray image of the window
+    :param roiMask: inner the ROI is True
+    :return: binary image of the window and the threshold, None if the ROI is empty
+    '''
+    if not roiMask.any():
+        return None, None
+    threshold = OtsuThresholdByHistogram(*MaskedHistogram(image, roiMask))
+    return ThresholdWithROIMask2bw(image, roiMask, threshold), threshold
 
 
 # Riss, the method proposed py Joëlle Riss, https://doi.org/10.1051/mmm:1996153
-class RissAnalysisThread(ROIsOTSUAnalysisThread):
+class RissAnalysisThread(AnalysisThread):
+    # not incremental, the threshold of the whole image depends on all the ROIs
+
     def __init__(self):
-        ROIsOTSUAnalysisThread.__init__(self)
+        AnalysisThread.__init__(self)
 
-    def run(self):
-        roisMask = np.zeros(self.grayImage.shape, dtype=bool)
-        for i, roiMask in enumerate(self.ROIsMaskList):
-            roisMask = np.logical_or(roiMask, roisMask)
-            self.process.emit(i / len(self.ROIsMaskList) * 100)
+    def analysis(self):
         # get threshold by riss method based on rois
-        rissThreshold = self._getRissThresholdWithROIs(self.grayImage, roisMask)
-        bw = GetBinaryImageWithThresholdWithMask(self.grayImage, self.edgeMask == 0, rissThreshold)
-        self.finish.emit(bw)
+        self.threshold = self._getRissThreshold(*self.getROIsMeanStd())
+        self.checkCancelled()
+        bw = ThresholdWithROIMask2bw(self.grayImage, self.edgeMask, self.threshold)
+        return bw
 
     @staticmethod
-    def _getRissThresholdWithROIs(image: np.array, mask: np.array):
+    def _getRissThreshold(mu, sigma):
         '''
-        :param image:
-        :param mask:
-        :return:
+        :param mu: mean of the pixels in the ROIs
+        :param sigma: standard deviation of the pixels in the ROIs
+        :return: threshold of Riss
         '''
-        masked = np.ma.masked_array(image, mask == 0)
-        # calculate the mean and std
-        mu = np.mean(masked.compressed())
-        sigma = np.std(masked.compressed())
         threshold = mu + 1.96 * sigma
         return threshold
+
+
+# local adaptive threshold in the crop polygon, Sauvola or Niblack, for the images under uneven lighting
+class AdaptiveAnalysisThread(AnalysisThread):
+    METHODS = ['sauvola', 'niblack']
+
+    def __init__(self):
+        AnalysisThread.__init__(self)
+        self.method = 'sauvola'
+        self.windowSize = 51
+        self.k = 0.2
+        self.stripSize = 512  # rows of each strip, bounds the memory of the integral images
+
+    def setAdaptiveParameters(self, method='sauvola', windowSize=51, k=0.2):
+        '''
+        :param method: sauvola or niblack
+        :param windowSize: size of the local window in pixels, made odd
+        :param k: sensitivity, the higher the fewer damage zones
+        '''
+        if method not in self.METHODS:
+            raise ValueError('The method should be one of %s.' % ', '.join(self.METHODS))
+        if windowSize < 3:
+            raise ValueError('The window size should be at least 3 pixels.')
+        self.method = method
+        self.windowSize = int(windowSize) // 2 * 2 + 1
+        self.k = k
+
+    def analysis(self):
+        '''
+        :return: binary image, the local threshold image is saved in self.threshold
+        '''
+        bw = np.zeros(self.grayImage.shape, dtype=bool)
+        self.threshold = np.zeros(self.grayImage.shape, dtype=np.float32)
+        # only the bounding box of the crop polygon is analyzed
+        rows, cols = np.flatnonzero(self.edgeMask.any(axis=1)), np.flatnonzero(self.edgeMask.any(axis=0))
+        if not len(rows):
+            return bw
+        window = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+        grayImage, edgeMask = self.grayImage[window], self.edgeMask[window]
+        maxValue = np.iinfo(grayImage.dtype).max if np.issubdtype(grayImage.dtype, np.integer) else 1.0
+        for start in range(0, grayImage.shape[0], self.stripSize):
+            self.checkCancelled()
+            self._updateProcess(start / grayImage.shape[0] * 100)
+            strip = slice(start, min(start + self.stripSize, grayImage.shape[0]))
+            mean, std = LocalMeanStdWithROIMask(grayImage, edgeMask, self.windowSize, strip)
+            threshold = AdaptiveThreshold(mean, std, self.method, self.k, maxValue)
+            bw[window][strip] = ThresholdWithROIMask2bw(grayImage[strip], edgeMask[strip], threshold)
+            self.threshold[window][strip] = threshold
+        self._updateProcess(100)
+        return bw
+
+
+# all the methods on the same specimen, the gray image, crop mask and ROI masks are shared
+class ComparisonAnalysisThread(AnalysisThread):
+    # list of dict with the keys: key, method, binaryImage, threshold, area, areaRatio
+    finishComparison = pyqtSignal(list)
+
+    # key, name, analysis thread of the method
+    METHODS = [
+        ('rois', 'Manual', ROIsToZonesAnalysisThread),
+        ('otsu', 'Global OTSU', AnalysisThread),
+        ('riss', 'Riss', RissAnalysisThread),
+        ('sdzm', 'SDZM', ROIsOTSUAnalysisThread),
+    ]
+
+    def __init__(self):
+        AnalysisThread.__init__(self)
+        self.methods = [key for key, name, analysisClass in self.METHODS]
+        self.results = []
+        self.workers = 1
+        self.executorType = 'thread'
+        self.methodThread = None  # analysis thread of the method running
+
+    def setWorkers(self, workers=None, executorType='thread'):
+        '''
+        analyze the ROIs of SDZM in parallel, see ROIsOTSUAnalysisThread.setWorkers
+        '''
+        if executorType not in ['thread', 'process']:
+            raise ValueError('The executor type should be thread or process.')
+        self.workers = workers or os.cpu_count()
+        self.executorType = executorType
+
+    def cancel(self):
+        AnalysisThread.cancel(self)
+        if self.methodThread is not None:
+            self.methodThread.cancel()
+
+    def setMethods(self, methods: list):
+        '''
+        :param methods: keys of the methods, rois, otsu, riss and sdzm
+        '''
+        self.methods = methods
+
+    def emitResult(self):
+        # the comparison before the result of the last method, only if not cancelled
+        self.finishComparison.emit(self.results)
+        AnalysisThread.emitResult(self)
+
+    def analysis(self):
+        self.results = self.analysisAll()
+        # show the result of the last method
+        if not len(self.results):
+            return np.zeros(self.grayImage.shape, dtype=bool)
+        return self.results[-1]['binaryImage']
+
+    def analysisAll(self):
+        methods = [method for method in self.METHODS if method[0] in self.methods]
+        edgeArea = np.sum(self.edgeMask)
+        results = []
+        for i, (key, name, analysisClass) in enumerate(methods):
+            # the method runs in this thread, on the intermediates of this thread
+            methodThread = analysisClass()
+            methodThread.setIntermediates(self)
+            if isinstance(methodThread, ROIsOTSUAnalysisThread):
+                methodThread.setWorkers(self.workers, self.executorType)
+            methodThread.processRange = (i / len(methods) * 100, (i + 1) / len(methods) * 100)
+            methodThread.process.connect(self.process.emit)
+            self.methodThread = methodThread
+            self.checkCancelled()
+            try:
+                bw = methodThread.analysis()
+            finally:
+                self.methodThread = None
+            # the union of the ROIs and the histograms are computed once for all the methods
+            self.ROIsMask = methodThread.ROIsMask
+            self.cropHistogram = methodThread.cropHistogram
+            self.ROIsMeanStd = methodThread.ROIsMeanStd
+            self.threshold = methodThread.threshold
+            area = np.sum(bw)
+            results.append({
+                'key': key,
+                'method': name,
+                'binaryImage': bw,
+                'threshold': methodThread.threshold,
+                'area': area,
+                'areaRatio': area / edgeArea if edgeArea else 0
+            })
+        return results
+
+    @staticmethod
+    def thresholdText(threshold):
+        if threshold is None:
+            return '-'
+        if isinstance(threshold, list):
+            if not len(threshold):
+                return '-'
+            return '%.4f ~ %.4f (%d ROIs)' % (np.min(threshold), np.max(threshold), len(threshold))
+        return '%.4f' % threshold
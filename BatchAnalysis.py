@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+# @FileName: BatchAnalysis.py
+# @Time    : 2026-10-18 9:30
+# @Author  : Dorad, cug.xia@gmail.com
+# @Blog    ：https://blog.cuger.cn
+
+'''
+headless batch analysis of many projects with a process pool, no Qt event loop is started.
+
+usage:
+    python BatchAnalysis.py ./projects -o ./output -m sdzm riss -j 8
+
+the input directory can contain *.pro projects saved by the SDZM toolbox, or images (*.jpg, *.png, *.tif) with an
+optional json file of the same name, e.g. SY7.jpg and SY7.json:
+    {"cropPolygon": [[x, y], ...], "ROIs": [[[x, y], ...], ...], "realScale": 0.05, "colorChannel": "RGB"}
+
+with --tile-budget, the *.npy and *.tif images are memory-mapped and analyzed tile by tile (see TiledAnalysis.py),
+the binary images are saved as *.npy, without the region tables.
+'''
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PyQt5.QtCore import QRectF
+
+from AnalysisThread import *
+from ProjectFile import ProjectFile
+
+METHODS = [key for key, name, analysisClass in ComparisonAnalysisThread.METHODS]
+# methods that need the ROIs
+ROIS_METHODS = ['rois', 'sdzm', 'riss']
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.tif', '.tiff', '.npy']
+TILED_EXTENSIONS = ['.tif', '.tiff', '.npy']
+
+
+def findProjects(inputDir):
+    '''
+    find the projects and images in the directory
+    :param inputDir: directory
+    :return: list of file path
+    '''
+    filePaths = []
+    for fileName in sorted(os.listdir(inputDir)):
+        ext = os.path.splitext(fileName)[1].lower()
+        if ext == '.pro' or ext in IMAGE_EXTENSIONS:
+            filePaths.append(os.path.join(inputDir, fileName))
+    return filePaths
+
+
+def loadProject(filePath):
+    '''
+    load the project or the image with its json file
+    :param filePath: path of *.pro or image
+    :return: project dict with the same keys as the project saved by MainWindow
+    '''
+    if os.path.splitext(filePath)[1].lower() == '.pro':
+        return ProjectFile(filePath).toDict()
+    if os.path.splitext(filePath)[1].lower() == '.npy':
+        image = np.load(filePath)
+    else:
+        from skimage import io
+        image = io.imread(filePath)
+    if len(image.shape) < 3:
+        image = np.stack([image] * 3, axis=2)
+    project = loadImageJson(filePath)
+    project['originImage'] = image[:, :, 0:3]
+    return project
+
+
+def loadImageJson(filePath):
+    '''
+    load the json file of the image
+    :return: project dict without the image
+    '''
+    project = {
+        'cropPolygon': [],
+        'colorChannel': 'RGB',
+        'ROIs': [],
+        'realScale': None,
+    }
+    jsonPath = os.path.splitext(filePath)[0] + '.json'
+    if os.path.exists(jsonPath):
+        with open(jsonPath, 'r') as f:
+            project.update(json.load(f))
+    return project
+
+
+def saveResult(binaryImage, realScale, outputPath):
+    '''
+    save the binary image as png and the regions as csv
+    '''
+    from skimage import io
+    io.imsave(outputPath + '.png', (binaryImage * 255).astype(np.uint8), check_contrast=False)
+    tableData = RegionPropsTable(binaryImage, realScale)
+    with open(outputPath + '.csv', 'w') as stream:
+        writer = csv.writer(stream, lineterminator='\n')
+        writer.writerow(REGION_TABLE_HEADERS)
+        writer.writerows(tableData[REGION_TABLE_FIELDS].tolist())
+    return tableData
+
+
+def saveSummary(summary, outputPath):
+    with open(outputPath, 'w') as stream:
+        writer = csv.writer(stream, lineterminator='\n')
+        writer.writerow(['Method', 'Threshold', 'Area(px^2)', 'Area(mm^2)', 'Area Ratio(%)'])
+        writer.writerows(summary)
+
+
+def analyseProjectTiled(filePath, methods, outputDir, tileBudget, timeBudget=None):
+    '''
+    analyse the memory-mapped image tile by tile, executed in the worker process
+    '''
+    from TiledAnalysis import TiledAnalysis, OpenImageMemmap
+    project = loadImageJson(filePath)
+    analysis = TiledAnalysis(OpenImageMemmap(filePath), project.get('colorChannel') or 'RGB', tileBudget)
+    analysis.setTimeBudget(timeBudget)
+    name = os.path.splitext(os.path.basename(filePath))[0]
+    realScale = project.get('realScale')
+    cropPolygon = project.get('cropPolygon') or None
+    ROIs = project.get('ROIs') or []
+    edgeArea = analysis.cropArea(cropPolygon)
+    results = []
+    summary = []
+    for key, method, analysisClass in ComparisonAnalysisThread.METHODS:
+        if key not in methods:
+            continue
+        if key in ROIS_METHODS and not len(ROIs):
+            results.append((key, 0, 'no ROIs'))
+            continue
+        bw = analysis.analysis(key, cropPolygon, ROIs, os.path.join(outputDir, '%s-%s.npy' % (name, key)))
+        area = np.sum(bw)
+        threshold = analysis.threshold
+        if isinstance(threshold, list):
+            threshold = [t for t in threshold if t is not None]
+        results.append((key, area, 'tiled'))
+        summary.append([
+            method,
+            ComparisonAnalysisThread.thresholdText(threshold),
+            area,
+            area * realScale * realScale if realScale else '',
+            area / edgeArea * 100 if edgeArea else 0
+        ])
+    saveSummary(summary, os.path.join(outputDir, '%s-summary.csv' % name))
+    return filePath, results
+
+
+def analyseProject(filePath, methods, outputDir, timeBudget=None, tileBudget=None):
+    '''
+    analyse one project with the methods, executed in the worker process
+    :return: file path, list of (method, damaged area in px^2, number of regions or error message)
+    '''
+    if tileBudget and os.path.splitext(filePath)[1].lower() in TILED_EXTENSIONS:
+        return analyseProjectTiled(filePath, methods, outputDir, tileBudget, timeBudget)
+    project = loadProject(filePath)
+    image = project['originImage']
+    grayImage = NAImage2GrayNArray(image, project.get('colorChannel') or 'RGB')
+    if project.get('cropPolygon'):
+        cropPolygon = list2QPolygonF(project['cropPolygon'])
+    else:
+        cropPolygon = QPolygonF(QRectF(0, 0, image.shape[1], image.shape[0]))
+    ROIs = [list2QPolygonF(roi) for roi in project.get('ROIs') or []]
+    name = os.path.splitext(os.path.basename(filePath))[0]
+    realScale = project.get('realScale')
+    results = [(method, 0, 'no ROIs') for method in methods if method in ROIS_METHODS and not len(ROIs)]
+    # the methods share the gray image and the masks
+    analysisThread = ComparisonAnalysisThread()
+    analysisThread.setMethods([method for method in methods if method not in ROIS_METHODS or len(ROIs)])
+    analysisThread.setParameters(grayImage, cropPolygon, ROIs)
+    analysisThread.setTimeBudget(timeBudget)
+    comparison = []
+    analysisThread.finishComparison.connect(comparison.append)
+    analysisThread.cancelled.connect(comparison.append)
+    analysisThread.run()
+    if isinstance(comparison[0], str):
+        raise AnalysisCancelled(comparison[0])
+    summary = []
+    for result in comparison[0]:
+        tableData = saveResult(result['binaryImage'], realScale,
+                               os.path.join(outputDir, '%s-%s' % (name, result['key'])))
+        results.append((result['key'], result['area'], '%d regions' % len(tableData)))
+        summary.append([
+            result['method'],
+            ComparisonAnalysisThread.thresholdText(result['threshold']),
+            result['area'],
+            result['area'] * realScale * realScale if realScale else '',
+            result['areaRatio'] * 100
+        ])
+    saveSummary(summary, os.path.join(outputDir, '%s-summary.csv' % name))
+    return filePath, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Batch analysis of the shear damage zones of rock joints.')
+    parser.add_argument('input', help='directory of *.pro projects or images with json files')
+    parser.add_argument('-o', '--output', default=None, help='output directory, default <input>/output')
+    parser.add_argument('-m', '--methods', nargs='+', choices=METHODS, default=['sdzm'],
+                        help='analysis methods, default sdzm')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('-t', '--time-budget', type=float, default=None,
+                        help='wall-clock seconds of the analysis of each project, the project is skipped if exceeded')
+    parser.add_argument('--tile-budget', type=float, default=None,
+                        help='MB of the working memory of each process, '
+                             'analyze the *.npy and *.tif images tile by tile')
+    args = parser.parse_args(argv)
+
+    outputDir = args.output or os.path.join(args.input, 'output')
+    os.makedirs(outputDir, exist_ok=True)
+    filePaths = findProjects(args.input)
+    if not len(filePaths):
+        print('No project or image is found in %s' % args.input)
+        return 1
+
+    tileBudget = args.tile_budget * 1024 * 1024 if args.tile_budget else None
+    failed = 0
+    startTime = time.time()
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {executor.submit(analyseProject, filePath, args.methods, outputDir, args.time_budget,
+                                   tileBudget): filePath for filePath in filePaths}
+        for i, future in enumerate(as_completed(futures)):
+            try:
+                filePath, results = future.result()
+            except Exception as e:
+                failed += 1
+                print('[%d/%d] %s failed: %s' % (i + 1, len(futures), os.path.basename(futures[future]), e))
+                continue
+            print('[%d/%d] %s: %s' % (i + 1, len(futures), os.path.basename(filePath), ', '.join(
+                ['%s %d px^2 (%s)' % result for result in results])))
+    elapsed = time.time() - startTime
+    print('Analyzed %d images in %.2f s with %d processes, throughput %.2f images/min' % (
+        len(filePaths) - failed, elapsed, args.jobs, (len(filePaths) - failed) / elapsed * 60))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+
+# @FileName: Benchmark.py
+# @Time    : 2026-10-18 17:05
+# @Author  : Dorad, cug.xia@gmail.com
+# @Blog    ：https://blog.cuger.cn
+
+'''
+benchmarks of the analysis, labeling, rendering and registration on synthetic rock joint images.
+
+usage:
+    python Benchmark.py -s 1 5 20 50 -r 10 50 -o bench-new.json
+    python Benchmark.py -s 1 5 -o bench-new.json --compare bench-old.json
+    python Benchmark.py -s 1 5 --validate
+    python Benchmark.py -s 1 5 --validate uint8
+    python Benchmark.py -s 1 5 --verify
+
+the wall time and the peak memory traced by tracemalloc of each benchmark are saved as json. the peak memory is
+measured in a second run, as tracemalloc slows down the allocations heavily, skip it with --no-memory.
+with --validate, the results of the analysis on the gray image of GRAY_DTYPE (or the dtype given, e.g. uint8) are
+compared with the ones on the float64 gray image, instead of the benchmarks.
+with --verify, the results updated incrementally are checked against the ones computed again from scratch, instead
+of the benchmarks, the exit code is 1 if any check fails.
+'''
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import QPointF, QRectF
+from PyQt5.QtWidgets import QApplication
+
+from AnalysisThread import *
+
+
+def SyntheticJointImage(megaPixels, seed=0):
+    '''
+    synthetic image of sheared rock joint, rough gray surface with bright elongated damage zones
+    :param megaPixels: size of the image
+    :return: image with the shape of (height, width, 3) as QImage2NArray
+    '''
+    rng = np.random.default_rng(seed)
+    height = int(np.sqrt(megaPixels * 1e6 * 3 / 4))
+    width = int(megaPixels * 1e6 / height)
+    # rough surface, smooth noise at two scales
+    from skimage.transform import resize
+    surface = resize(rng.random((height // 64 + 2, width // 64 + 2), dtype=np.float32), (height, width), order=1)
+    surface = surface * 60 + 60 + rng.normal(0, 8, (height, width)).astype(np.float32)
+    # damage zones, rotated ellipses along the shear direction
+    y, x = np.ogrid[0:height, 0:width]
+    for i in range(int(20 * megaPixels ** 0.5) + 5):
+        cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+        a, b = rng.uniform(0.005, 0.04) * width, rng.uniform(0.002, 0.01) * width
+        angle = rng.normal(0, 0.3)
+        x0, x1 = int(max(cx - a, 0)), int(min(cx + a + 1, width))
+        y0, y1 = int(max(cy - a, 0)), int(min(cy + a + 1, height))
+        dx, dy = x[:, x0:x1] - cx, y[y0:y1] - cy
+        u = dx * np.cos(angle) + dy * np.sin(angle)
+        v = -dx * np.sin(angle) + dy * np.cos(angle)
+        surface[y0:y1, x0:x1][(u / a) ** 2 + (v / b) ** 2 <= 1] += rng.uniform(60, 110)
+    gray = np.clip(surface, 0, 255).astype(np.uint8)
+    return np.stack([gray, (gray * 0.95).astype(np.uint8), (gray * 0.9).astype(np.uint8)], axis=2)
+
+
+def SyntheticROIs(width, height, count, seed=0):
+    '''
+    random convex ROIs, about 1% of the image each
+    '''
+    rng = np.random.default_rng(seed)
+    ROIs = []
+    for i in range(count):
+        cx, cy = rng.uniform(0.1, 0.9) * width, rng.uniform(0.1, 0.9) * height
+        r = rng.uniform(0.03, 0.08) * min(width, height)
+        angles = np.sort(rng.uniform(0, 2 * np.pi, 8))
+        ROIs.append(QPolygonF([QPointF(cx + r * np.cos(t), cy + r * np.sin(t)) for t in angles]))
+    return ROIs
+
+
+def Measure(function, traceMemory=True):
+    '''
+    :return: wall time in seconds and peak memory in MB of the function
+    '''
+    startTime = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - startTime
+    peak = 0
+    if traceMemory:
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def RunAnalysis(analysisThread, grayImage, cropPolygon, ROIs):
+    result = []
+    analysisThread.finish.connect(result.append)
+    analysisThread.setParameters(grayImage, cropPolygon, ROIs)
+    analysisThread.run()
+    return result[0]
+
+
+def Benchmarks(image, ROIs):
+    '''
+    :return: list of (name, function), the functions share the image and ROIs
+    '''
+    from ImageRegistration import ImageRegThread
+    from LabelImageDataTable import LabelDataTable
+    from View import LabelImageView
+
+    height, width = image.shape[0], image.shape[1]
+    cropPolygon = QPolygonF(QRectF(0, 0, width, height))
+    grayImage = NAImage2GrayNArray(image)
+    # the result of SDZM for labeling and rendering
+    binaryImage = RunAnalysis(ROIsOTSUAnalysisThread(), grayImage, cropPolygon, ROIs)
+
+    def labelImageView():
+        view = LabelImageView()
+        view.setImage(binaryImage)
+        return view
+
+    def labelDataTable():
+        table = LabelDataTable()
+        table.setData(binaryImage, 0.05, cropPolygon)
+        return table
+
+    def imageReg():
+        # the post-shear image, shifted and rotated
+        import cv2
+        imageRef = image
+        M = cv2.getRotationMatrix2D((width / 2, height / 2), 2, 1.0)
+        M[:, 2] += [width * 0.01, height * 0.02]
+        moved = cv2.warpAffine(imageRef, M, (width, height))
+        regThread = ImageRegThread()
+        regThread.setParameters(moved, imageRef, 'ORB')
+        result = []
+        regThread.finish.connect(lambda imageWarped, matchesImage: result.append(imageWarped))
+        regThread.error.connect(result.append)
+        regThread.run()
+        return result
+
+    return [
+        ('AnalysisThread', lambda: RunAnalysis(AnalysisThread(), grayImage, cropPolygon, ROIs)),
+        ('ROIsToZonesAnalysisThread', lambda: RunAnalysis(ROIsToZonesAnalysisThread(), grayImage, cropPolygon, ROIs)),
+        ('ROIsOTSUAnalysisThread', lambda: RunAnalysis(ROIsOTSUAnalysisThread(), grayImage, cropPolygon, ROIs)),
+        ('RissAnalysisThread', lambda: RunAnalysis(RissAnalysisThread(), grayImage, cropPolygon, ROIs)),
+        ('ComparisonAnalysisThread', lambda: RunAnalysis(ComparisonAnalysisThread(), grayImage, cropPolygon, ROIs)),
+        ('QPolygon2Mask', lambda: [QPolygon2Mask(width, height, roi) for roi in ROIs]),
+        ('NAImage2GrayNArray', lambda: NAImage2GrayNArray(image)),
+        ('NAImage2GrayNArray.float64', lambda: NAImage2GrayNArray(image, dtype=np.float64)),
+        ('LabelDataTable.setData', labelDataTable),
+        ('LabelImageView.updateDrawnItems', labelImageView),
+        ('medianFilter', lambda: medianFilter(NAImage2GrayNArray(image, dtype=np.uint8), 4)),
+        ('imAdjust', lambda: imAdjust(grayImage)),
+        ('ImageRegThread.run', imageReg),
+    ]
+
+
+def Validate(image, ROIs, dtype=GRAY_DTYPE):
+    '''
+    compare the analysis on the gray image of the dtype with the one on the float64 gray image
+    :return: list of dict, the thresholds are in [0, 1]
+    '''
+    height, width = image.shape[0], image.shape[1]
+    cropPolygon = QPolygonF(QRectF(0, 0, width, height))
+    grayImages = [NAImage2GrayNArray(image, dtype=dtype), NAImage2GrayNArray(image, dtype=np.float64)]
+    results = []
+    methods = ComparisonAnalysisThread.METHODS + [('adaptive', 'Sauvola', AdaptiveAnalysisThread)]
+    for key, name, analysisClass in methods:
+        binaryImages, thresholds = [], []
+        for grayImage in grayImages:
+            analysisThread = analysisClass()
+            binaryImages.append(RunAnalysis(analysisThread, grayImage, cropPolygon, ROIs))
+            threshold = analysisThread.threshold
+            scale = 255 if grayImage.dtype == np.uint8 else 1
+            if isinstance(threshold, np.ndarray):
+                threshold = float(np.mean(threshold)) / scale
+            elif isinstance(threshold, list):
+                threshold = float(np.mean(threshold)) / scale if len(threshold) else None
+            elif threshold is not None:
+                threshold = float(threshold) / scale
+            thresholds.append(threshold)
+        area, area64 = int(np.sum(binaryImages[0])), int(np.sum(binaryImages[1]))
+        union = np.sum(binaryImages[0] | binaryImages[1])
+        results.append({'method': name, 'dtype': np.dtype(dtype).name, 'area': area, 'area64': area64,
+                        'areaDiff': (area - area64) / area64 if area64 else 0,
+                        'IoU': float(np.sum(binaryImages[0] & binaryImages[1]) / union) if union else 1.0,
+                        'threshold': thresholds[0], 'threshold64': thresholds[1]})
+    return results
+
+
+def VerifyIncremental(analysisClass, grayImage, cropPolygon, ROIs):
+    '''
+    the result updated by addROI and removeROIs is the same as the analysis of all the ROIs again
+    :param ROIs: at least one ROI
+    '''
+    analysisThread = analysisClass()
+    RunAnalysis(analysisThread, grayImage, cropPolygon, ROIs[:-1])
+    analysisThread.addROI(ROIs[-1])
+    expected = analysisClass()
+    assert np.array_equal(analysisThread.labelImage, RunAnalysis(expected, grayImage, cropPolygon, ROIs)), \
+        'the result after addROI differs from the full analysis'
+    assert analysisThread.threshold == expected.threshold, 'the thresholds after addROI differ from the full analysis'
+    removed = sorted({0, len(ROIs) // 2})
+    analysisThread.removeROIs(removed)
+    rest = [roi for i, roi in enumerate(ROIs) if i not in removed]
+    expected = analysisClass()
+    assert np.array_equal(analysisThread.labelImage, RunAnalysis(expected, grayImage, cropPolygon, rest)), \
+        'the result after removeROIs differs from the full analysis'
+    assert analysisThread.threshold == expected.threshold, \
+        'the thresholds after removeROIs differ from the full analysis'
+
+
+def RegionPropsReference(binaryImage: np.array, realScale=None):
+    '''
+    the region table measured by measure.regionprops, one region after another
+    :return: structured array of REGION_TABLE_DTYPE, see RegionPropsTable
+    '''
+    from skimage import measure
+    regions = measure.regionprops(measure.label(binaryImage))
+    tableData = np.zeros(len(regions), dtype=REGION_TABLE_DTYPE)
+    for i, region in enumerate(regions):
+        tableData[i] = (region.label, region.centroid[1], region.centroid[0],
+                        region.area * realScale * realScale if realScale else 0,
+                        region.perimeter * realScale if realScale else 0, region.area, region.perimeter)
+    return tableData
+
+
+def AssertSameTable(tableData, expected, message):
+    # the labels of the updated regions are not in the order of measure.label, the rows are sorted by the centers
+    assert len(tableData) == len(expected), '%s: %d regions instead of %d' % (message, len(tableData), len(expected))
+    tableData = tableData[np.lexsort((tableData['centerX'], tableData['centerY']))]
+    expected = expected[np.lexsort((expected['centerX'], expected['centerY']))]
+    for field in REGION_TABLE_FIELDS:
+        assert np.allclose(tableData[field], expected[field], rtol=1e-8, atol=1e-8), \
+            '%s: the %s differs from regionprops' % (message, field)
+
+
+def VerifyRegionTable(binaryImage, realScale=0.05):
+    '''
+    RegionAnalysis.table is the same as measure.regionprops
+    '''
+    tableData = RegionAnalysis(binaryImage).table(realScale)
+    expected = RegionPropsReference(binaryImage, realScale)
+    assert np.array_equal(tableData['label'], expected['label']), 'the labels differ from measure.label'
+    AssertSameTable(tableData, expected, 'RegionAnalysis.table')
+
+
+def VerifyRegionUpdate(grayImage, cropPolygon, ROIs, realScale=0.05):
+    '''
+    the regions updated by RegionAnalysis.updateRegion after addROI and removeROIs are the same as the regions of
+    the result labeled again
+    :param ROIs: at least one ROI
+    '''
+    analysisThread = ROIsOTSUAnalysisThread()
+    RunAnalysis(analysisThread, grayImage, cropPolygon, ROIs[:-1])
+    regions = RegionAnalysis(analysisThread.labelImage)
+    regions.table(realScale)
+    windows = [analysisThread.addROI(ROIs[-1])] + analysisThread.removeROIs(sorted({0, len(ROIs) // 2}))
+    for window in windows:
+        regions.updateRegion(analysisThread.labelImage, window)
+    assert np.array_equal(regions.labelImage > 0, analysisThread.labelImage), \
+        'the updated labels differ from the binary image'
+    AssertSameTable(regions.table(realScale), RegionPropsReference(analysisThread.labelImage, realScale),
+                    'RegionAnalysis.updateRegion')
+
+
+def VerifyTotalRowSelection(binaryImage):
+    '''
+    selecting the total row of LabelDataTable, alone or with a region, selects the regions only
+    '''
+    from PyQt5.QtCore import QItemSelection
+    from LabelImageDataTable import LabelDataTable
+    table = LabelDataTable()
+    table.setData(binaryImage, 0.05)
+    emitted = []
+    table.labelSelectedSignal.connect(emitted.append)
+    model = table.table.model()
+    totalRow = len(table.tableData)
+
+    def rowSelection(row):
+        return QItemSelection(model.index(row, 0), model.index(row, model.columnCount() - 1))
+
+    table.itemClickedAction(rowSelection(totalRow), QItemSelection())
+    assert np.array_equal(emitted[-1], table.tableData['label']), 'the total row does not select every region'
+    if totalRow:
+        table.itemClickedAction(rowSelection(0), QItemSelection())
+        assert np.array_equal(emitted[-1], table.tableData['label'][:1]), \
+            'the total row is selected as a region along with the first region'
+
+
+def Verify(image, ROIs):
+    '''
+    check the incremental results and the region table against the ones computed again from scratch
+    :return: list of dict, the error is None if the check passes
+    '''
+    height, width = image.shape[0], image.shape[1]
+    cropPolygon = QPolygonF(QRectF(0, 0, width, height))
+    grayImage = NAImage2GrayNArray(image)
+    binaryImage = RunAnalysis(ROIsOTSUAnalysisThread(), grayImage, cropPolygon, ROIs)
+    checks = [
+        ('RegionAnalysis.table', lambda: VerifyRegionTable(binaryImage)),
+        ('LabelDataTable.totalRowSelection', lambda: VerifyTotalRowSelection(binaryImage)),
+    ]
+    if ROIs:
+        checks += [
+            ('ROIsToZonesAnalysisThread.incremental',
+             lambda: VerifyIncremental(ROIsToZonesAnalysisThread, grayImage, cropPolygon, ROIs)),
+            ('ROIsOTSUAnalysisThread.incremental',
+             lambda: VerifyIncremental(ROIsOTSUAnalysisThread, grayImage, cropPolygon, ROIs)),
+            ('RegionAnalysis.updateRegion', lambda: VerifyRegionUpdate(grayImage, cropPolygon, ROIs)),
+        ]
+    results = []
+    for name, check in checks:
+        try:
+            check()
+            error = None
+        except AssertionError as e:
+            error = str(e)
+        results.append({'check': name, 'error': error})
+    return results
+
+
+def GitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def Compare(results, baseline):
+    '''
+    print the ratio of the time and memory to the baseline
+    '''
+    baselineResults = {(r['name'], r['megaPixels'], r['ROIs']): r for r in baseline['results']}
+    print('\n%-36s %6s %5s %10s %10s %8s %8s' % ('benchmark', 'MP', 'ROIs', 'time(s)', 'base(s)', 'speedup',
+                                                  'memory'))
+    for r in results:
+        base = baselineResults.get((r['name'], r['megaPixels'], r['ROIs']))
+        if not base:
+            continue
+        print('%-36s %6g %5d %10.3f %10.3f %7.2fx %7.2fx' % (
+            r['name'], r['megaPixels'], r['ROIs'], r['seconds'], base['seconds'],
+            base['seconds'] / r['seconds'] if r['seconds'] else 0,
+            r['peakMB'] / base['peakMB'] if base['peakMB'] else 0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the SDZM toolbox.')
+    parser.add_argument('-s', '--sizes', nargs='+', type=float, default=[1, 5, 20, 50], help='image sizes in MP')
+    parser.add_argument('-r', '--rois', nargs='+', type=int, default=[10, 50], help='numbers of ROIs')
+    parser.add_argument('-b', '--benchmarks', nargs='+', default=None, help='names of the benchmarks to run')
+    parser.add_argument('-o', '--output', default='bench-%s.json' % (GitCommit() or 'local'), help='json output')
+    parser.add_argument('--compare', default=None, help='json output of another commit to compare with')
+    parser.add_argument('--no-memory', action='store_true', help='do not trace the peak memory')
+    parser.add_argument('--validate', nargs='?', const=np.dtype(GRAY_DTYPE).name, default=None,
+                        choices=['float32', 'uint8'],
+                        help='compare the analysis on the gray image of the dtype, default %s, with the float64 one' %
+                             np.dtype(GRAY_DTYPE).name)
+    parser.add_argument('--verify', action='store_true',
+                        help='check the incremental results against the ones computed again from scratch')
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    app.setApplicationName('Benchmark')
+    results = []
+    for megaPixels in args.sizes:
+        image = SyntheticJointImage(megaPixels)
+        for count in args.rois:
+            ROIs = SyntheticROIs(image.shape[1], image.shape[0], count)
+            if args.validate:
+                for result in Validate(image, ROIs, args.validate):
+                    result.update({'megaPixels': megaPixels, 'ROIs': count})
+                    results.append(result)
+                    print('%-12s %6g MP %5d ROIs  area %10d / %10d (%+.3f%%)  IoU %.4f  threshold %s / %s' % (
+                        result['method'], megaPixels, count, result['area'], result['area64'],
+                        result['areaDiff'] * 100, result['IoU'], _format(result['threshold']),
+                        _format(result['threshold64'])))
+                    sys.stdout.flush()
+                continue
+            if args.verify:
+                for result in Verify(image, ROIs):
+                    result.update({'megaPixels': megaPixels, 'ROIs': count})
+                    results.append(result)
+                    print('%-44s %6g MP %5d ROIs  %s' % (result['check'], megaPixels, count,
+                                                         result['error'] or 'passed'))
+                    sys.stdout.flush()
+                continue
+            for name, function in Benchmarks(image, ROIs):
+                if args.benchmarks and name not in args.benchmarks:
+                    continue
+                # the benchmarks independent of the ROIs run only once for each size
+                if count != args.rois[0] and name in ['NAImage2GrayNArray', 'NAImage2GrayNArray.float64',
+                                                      'medianFilter', 'imAdjust', 'ImageRegThread.run']:
+                    continue
+                seconds, peak = Measure(function, not args.no_memory)
+                results.append({'name': name, 'megaPixels': megaPixels, 'ROIs': count, 'seconds': seconds,
+                                'peakMB': peak})
+                print('%-36s %6g MP %5d ROIs %10.3f s %10.1f MB' % (name, megaPixels, count, seconds, peak))
+                sys.stdout.flush()
+
+    report = {
+        'commit': GitCommit(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Results are saved in %s' % args.output)
+    if args.compare and not (args.validate or args.verify):
+        with open(args.compare, 'r') as f:
+            Compare(results, json.load(f))
+    if args.verify:
+        return 1 if any(result['error'] for result in results) else 0
+    return 0
+
+
+def _format(threshold):
+    return '-' if threshold is None else '%.4f' % threshold
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+# @FileName: ImageBridge.py
+# @Time    : 2026-10-18 19:40
+# @Author  : Dorad, cug.xia@gmail.com
+# @Blog    ：https://blog.cuger.cn
+
+'''
+the bridge between QImage and ndarray.
+the arrays are in the layout of skimage and OpenCV, (rows, cols) or (rows, cols, channels), so the pixel (x, y) of
+the QImage is array[y, x] and the memory of the QImage can be shared without copying:
+    QImage2NArray: view of the QImage buffer, the array keeps the QImage alive
+    NewQImage: QImage allocated by Qt and the view of its buffer, filled in place without copying
+    NArray2QImage: QImage allocated by Qt, the array is copied once into its buffer
+the buffers of the QImages are always allocated and owned by Qt, never borrowed from an array: the QImages may be
+copied shallowly on the C++ side, e.g. by QImage(qimage), a queued signal or a Qt container, and outlive any Python
+reference. PyQt5 has no constructor of QImage with a cleanup function to release a borrowed array.
+'''
+
+import numpy as np
+from PyQt5.QtGui import QImage, QPixmap
+
+# the 32-bit formats viewed as (rows, cols, 3) without copying
+RGB32_FORMATS = [QImage.Format_RGB32, QImage.Format_ARGB32, QImage.Format_ARGB32_Premultiplied]
+
+# the layout of the arrays in the project, the projects without it were saved as (width, height)
+PROJECT_ARRAY_LAYOUT = 'rows-cols'
+
+
+def QImage2NArray(qimage: QImage):
+    '''
+    convert QImage to NArray, without copying for the 32-bit formats
+    :param qimage: QImage
+    :return: RGB image with the shape of (rows, cols, 3), a view of the QImage buffer
+    '''
+    from qimage2ndarray import rgb_view
+    if qimage.format() not in RGB32_FORMATS:
+        qimage = qimage.convertToFormat(QImage.Format_RGB32)
+    return rgb_view(qimage)
+
+
+def QPixmap2NArray(qpixmap: QPixmap):
+    return QImage2NArray(qpixmap.toImage())
+
+
+def NewQImage(rows, cols, imageFormat=QImage.Format_ARGB32):
+    '''
+    QImage allocated and owned by Qt, with the view of its buffer to fill it in place
+    :param imageFormat: format of 8 or 32 bits per pixel
+    :return: QImage; array with the shape of (rows, cols), uint32 for the 32-bit formats, e.g. the ARGB32 colors, and
+    uint8 for the 8-bit formats. the array keeps the QImage alive
+    '''
+    from qimage2ndarray import raw_view
+    qimage = QImage(cols, rows, imageFormat)
+    return qimage, raw_view(qimage)
+
+
+def NArray2QImage(image: np.ndarray):
+    '''
+    convert ndarray to QImage allocated by Qt, the array is copied once into the buffer of the QImage:
+    uint8 (rows, cols) as Grayscale8, (rows, cols, 3) as RGB888 and (rows, cols, 4) as RGBA8888, uint32 (rows, cols)
+    as ARGB32; the others are converted by qimage2ndarray.array2qimage
+    :param image: image with the shape of (rows, cols) or (rows, cols, channels)
+    :return: QImage
+    '''
+    formats = {1: QImage.Format_Grayscale8, 3: QImage.Format_RGB888, 4: QImage.Format_RGBA8888}
+    channels = image.shape[2] if image.ndim == 3 else 1
+    rows, cols = image.shape[0], image.shape[1]
+    if image.dtype == np.uint32 and image.ndim == 2:
+        qimage, view = NewQImage(rows, cols, QImage.Format_ARGB32)
+        view[...] = image
+        return qimage
+    if image.dtype == np.uint8 and image.ndim in (2, 3) and channels in formats:
+        qimage = QImage(cols, rows, formats[channels])
+        # the rows of the 8-bit and 24-bit formats are padded to 4 bytes
+        bits = qimage.bits()
+        bits.setsize(qimage.bytesPerLine() * rows)
+        buffer = np.frombuffer(bits, dtype=np.uint8).reshape(rows, qimage.bytesPerLine())
+        buffer[:, :cols * channels] = image.reshape(rows, cols * channels)
+        return qimage
+    from qimage2ndarray import array2qimage
+    return array2qimage(image)
+
+
+def NArray2QPixmap(image: np.array):
+    return QPixmap.fromImage(NArray2QImage(image))
+
+
+def UpgradeProjectLayout(project: dict):
+    '''
+    transpose the arrays of the project saved in the layout of (width, height) before
+    :param project: project dict, see MainWindow.__saveProject
+    :return: the project in PROJECT_ARRAY_LAYOUT
+    '''
+    if project.get('arrayLayout') == PROJECT_ARRAY_LAYOUT:
+        return project
+    for key in ['originImage', 'binaryImage']:
+        if isinstance(project.get(key), np.ndarray) and project[key].ndim >= 2:
+            project[key] = np.ascontiguousarray(np.swapaxes(project[key], 0, 1))
+    project['arrayLayout'] = PROJECT_ARRAY_LAYOUT
+    return project
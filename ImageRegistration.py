@@ -53,6 +53,8 @@ class ImageRegWidget(QWidget):
             'ORB',
             'SIFT',
         ])
+        self.selectModeBox = QComboBox()
+        self.selectModeBox.addItems(ImageRegThread.MODES)
         self.diskRadiusOfMedianFilterBox = QSpinBox(self)
         self.diskRadiusOfMedianFilterBox.setRange(3, 20)
         self.diskRadiusOfMedianFilterBox.setValue(3)
@@ -67,6 +69,7 @@ class ImageRegWidget(QWidget):
         vBox.addWidget(self.buttonLoadPreImage)
         formBox = QFormLayout()
         formBox.addRow('Feature Detection Algorithm', self.selectFeatureBox)
+        formBox.addRow('Registration Mode', self.selectModeBox)
         formBox.addRow('Disk Radius of Median Filter', self.diskRadiusOfMedianFilterBox)
         vBox.addLayout(formBox)
         vBox.addWidget(self.buttonAnalysis)
@@ -156,7 +159,8 @@ class ImageRegWidget(QWidget):
 
     def __analysis(self):
         IT = ImageRegThread()
-        IT.setParameters(self.preImage, self.damageImage, self.selectFeatureBox.currentText())
+        IT.setParameters(self.preImage, self.damageImage, self.selectFeatureBox.currentText(),
+                         mode=self.selectModeBox.currentText())
         IT.error.connect(self.__errorHandle)
         IT.finish.connect(self.__analysisFinished)
         IT.start()
@@ -199,24 +203,26 @@ class ImageRegWidget(QWidget):
             'Both'
         ]:
             return
-        damageImage = NAImage2GrayByChannel(self.damageImage, channel)
+        # float32 in place, the means are accumulated in float64
+        damageImage = NAImage2GrayByChannel(self.damageImage, channel).astype(np.float32)
         alignedImage = NAImage2GrayByChannel(self.alignedImage, channel)
         alignedImage = medianFilter(alignedImage.astype(np.uint8), self.diskRadiusOfMedianFilterBox.value())
         alignedImage = alignedImage.astype(np.float32)
         # generate the sub image
-        alignedImage = alignedImage - np.mean(alignedImage)
-        damageImage = damageImage - np.mean(damageImage)
+        alignedImage -= np.mean(alignedImage, dtype=np.float64)
+        damageImage -= np.mean(damageImage, dtype=np.float64)
         alignedImage[alignedImage < 0] = 0
         damageImage[damageImage < 0] = 0
         # align - damage
-        subImage = alignedImage.astype(np.float) - damageImage.astype(np.float)
+        subImage = np.subtract(alignedImage, damageImage, out=alignedImage)
         if cType == 'Pre-Damage':
             subImage[subImage < 0] = 0
         elif cType == 'Damage-Pre':
             subImage[subImage > 0] = 0
         # else:
-        subImage = np.abs(subImage)
-        subImage = np.power(subImage, 2) / 40
+        subImage = np.abs(subImage, out=subImage)
+        subImage = np.square(subImage, out=subImage)
+        subImage /= 40
         subImage[subImage > 255] = 255
         # self.subImage = imAdjust(subImage, 0, 1, 1)
         self.subImage = subImage.astype(np.uint8)
@@ -249,7 +255,7 @@ class ImageRegWidget(QWidget):
         self.__updateActionsStatus()
 
     def __exportToDZMTtoolbox(self):
-        self.finish.emit(self.subImage.transpose((1, 0)))
+        self.finish.emit(self.subImage)
         self.__updateActionsStatus()
         self.close()
 
@@ -295,48 +301,59 @@ class Canvas(FigureCanvas):
 
 # 图像对齐
 class ImageRegThread(QThread):
+    '''
+    align the image to the reference image by the affine transform estimated from the matched features.
+    modes:
+        Full: the features are detected on the full resolution images
+        Pyramid: the transform is estimated on the images downscaled to coarseSize, refined by the features of the
+                 patches at the finer levels, and the image is warped once at the full resolution
+    '''
     finish = pyqtSignal([np.ndarray, np.ndarray], name='analysis finished')
-    error = pyqtSignal([int], name='error')
+    error = pyqtSignal([str], name='error')
+
+    MODES = ['Full', 'Pyramid']
+    MIN_MATCH_COUNT = 10
 
     def __init__(self):
         QThread.__init__(self)
 
-    def setParameters(self, image, imageRef, algorithm='ORB', maxFeatures=1000):
+    def setParameters(self, image, imageRef, algorithm='ORB', maxFeatures=1000, mode='Full', coarseSize=1024,
+                      patchSize=256, patchGrid=4):
+        '''
+        :param mode: one of MODES
+        :param coarseSize: max size of the images at the coarse level of the pyramid
+        :param patchSize: size of the patches to refine the transform at the finer levels
+        :param patchGrid: the patches are patchGrid x patchGrid, evenly distributed over the reference image
+        '''
         self.imageRef = imageRef
         self.image = image
         self.algorithm = algorithm
         self.maxFeatures = maxFeatures
+        self.mode = mode
+        self.coarseSize = coarseSize
+        self.patchSize = patchSize
+        self.patchGrid = patchGrid
 
     def run(self):
         self.algorithm = self.algorithm.upper()
         if self.algorithm not in ['ORB', 'SIFT']:
             self.error.emit('The algorithm not exist.')
             return
-        # select detector
-        if self.algorithm == 'SIFT':
-            descExtractor = cv2.SIFT_create()
-        elif self.algorithm == 'ORB':
-            descExtractor = cv2.ORB_create(self.maxFeatures)
+        if self.mode not in self.MODES:
+            self.error.emit('The registration mode not exist.')
+            return
+        if self.mode == 'Pyramid':
+            self.__runPyramid()
+            return
         # check the cropPolygon and
         # find keypoints with detector
-        kpRef, desRef = descExtractor.detectAndCompute(self.imageRef, None)
-        kp, des = descExtractor.detectAndCompute(self.image, None)
-        # match features
-        bf = cv2.BFMatcher(cv2.NORM_L2, crossCheck=True)
-        matches = bf.match(desRef, des)
-        matches = sorted(matches, key=lambda x: x.distance)
-        matches = matches[0:100]
-        MIN_MATCH_COUNT = 10
+        kpRef, kp, matches = self.__match(self.imageRef, self.image)
         # ransac
-        if len(matches) > MIN_MATCH_COUNT:
-            dst_pts = np.float32([kpRef[m.queryIdx].pt for m in matches]).reshape(-1, 1, 2)
-            src_pts = np.float32([kp[m.trainIdx].pt for m in matches]).reshape(-1, 1, 2)
-            # M, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
-            # M, mask = cv2.estimateRigidTransform(src_pts, dst_pts, False)
-            M, mask = cv2.estimateAffine2D(src_pts, dst_pts, cv2.RANSAC)
+        if len(matches) > self.MIN_MATCH_COUNT:
+            M, mask = self.__estimate(kpRef, kp, matches)
             matchesMask = mask.ravel().tolist()
         else:
-            self.error.emit("Not enough matches are found - {}/{}".format(len(matches), MIN_MATCH_COUNT))
+            self.error.emit("Not enough matches are found - {}/{}".format(len(matches), self.MIN_MATCH_COUNT))
             return
         draw_params = dict(matchColor=(0, 255, 0),  # draw matches in green color
                            singlePointColor=None,
@@ -347,6 +364,135 @@ class ImageRegThread(QThread):
         imageWarped = cv2.warpAffine(self.image, M, (self.imageRef.shape[1], self.imageRef.shape[0]))
         self.finish.emit(imageWarped, matchesImage)
 
+    def __descExtractor(self):
+        # select detector
+        if self.algorithm == 'SIFT':
+            return cv2.SIFT_create()
+        return cv2.ORB_create(self.maxFeatures)
+
+    def __match(self, imageRef, image, count=100):
+        '''
+        detect and match the features of the images
+        :return: keypoints of imageRef, keypoints of image, the best matches
+        '''
+        descExtractor = self.__descExtractor()
+        kpRef, desRef = descExtractor.detectAndCompute(imageRef, None)
+        kp, des = descExtractor.detectAndCompute(image, None)
+        if desRef is None or des is None:
+            return kpRef, kp, []
+        # match features, the descriptors of ORB are binary
+        bf = cv2.BFMatcher(cv2.NORM_HAMMING if self.algorithm == 'ORB' else cv2.NORM_L2, crossCheck=True)
+        matches = bf.match(desRef, des)
+        matches = sorted(matches, key=lambda x: x.distance)
+        return kpRef, kp, matches[0:count]
+
+    @staticmethod
+    def __estimate(kpRef, kp, matches, scale=1.0):
+        '''
+        estimate the affine transform from the image to imageRef by ransac
+        :param scale: scale of the images of the keypoints
+        :return: affine matrix at the full resolution, inliers mask
+        '''
+        dst_pts = (np.float32([kpRef[m.queryIdx].pt for m in matches]) / scale).reshape(-1, 1, 2)
+        src_pts = (np.float32([kp[m.trainIdx].pt for m in matches]) / scale).reshape(-1, 1, 2)
+        # M, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
+        # M, mask = cv2.estimateRigidTransform(src_pts, dst_pts, False)
+        return cv2.estimateAffine2D(src_pts, dst_pts, cv2.RANSAC, ransacReprojThreshold=3 / scale)
+
+    @staticmethod
+    def __gray(image):
+        if image.ndim == 2:
+            return image
+        return cv2.cvtColor(image, cv2.COLOR_RGBA2GRAY if image.shape[2] == 4 else cv2.COLOR_RGB2GRAY)
+
+    @staticmethod
+    def __patch(grayImage, rect, scale):
+        '''
+        crop the rect (x0, y0, x1, y1) of the full resolution image, resized by the scale
+        '''
+        x0, y0, x1, y1 = rect
+        patch = grayImage[y0:y1, x0:x1]
+        if scale == 1:
+            return patch
+        return cv2.resize(patch, (max(round((x1 - x0) * scale), 1), max(round((y1 - y0) * scale), 1)),
+                          interpolation=cv2.INTER_AREA)
+
+    def __refine(self, grayRef, gray, M, scale):
+        '''
+        refine the transform by the features of the patches at the level of the scale
+        :return: the refined affine matrix, None if not enough matches
+        '''
+        # the patches of the level at the full resolution
+        size = self.patchSize / scale
+        rows, cols = grayRef.shape
+        inverseM = cv2.invertAffineTransform(M)
+        points, pointsRef = [], []
+        for i in range(self.patchGrid):
+            for j in range(self.patchGrid):
+                cx, cy = cols * (j + 0.5) / self.patchGrid, rows * (i + 0.5) / self.patchGrid
+                rectRef = np.int32([max(cx - size / 2, 0), max(cy - size / 2, 0),
+                                    min(cx + size / 2, cols), min(cy + size / 2, rows)])
+                # the patch of the image predicted by the transform, with the margin for the error of the coarse level
+                corners = np.float32([[rectRef[0], rectRef[1]], [rectRef[2], rectRef[1]],
+                                      [rectRef[0], rectRef[3]], [rectRef[2], rectRef[3]]])
+                corners = corners @ inverseM[:, 0:2].T + inverseM[:, 2]
+                margin = size / 8
+                rect = np.int32([max(corners[:, 0].min() - margin, 0), max(corners[:, 1].min() - margin, 0),
+                                 min(corners[:, 0].max() + margin, gray.shape[1]),
+                                 min(corners[:, 1].max() + margin, gray.shape[0])])
+                if rect[2] - rect[0] < size / 4 or rect[3] - rect[1] < size / 4:
+                    continue
+                kpRef, kp, matches = self.__match(self.__patch(grayRef, rectRef, scale),
+                                                  self.__patch(gray, rect, scale))
+                for m in matches:
+                    pointsRef.append(np.float32(kpRef[m.queryIdx].pt) / scale + rectRef[0:2])
+                    points.append(np.float32(kp[m.trainIdx].pt) / scale + rect[0:2])
+        if len(points) <= self.MIN_MATCH_COUNT:
+            return None
+        # the matches far from the prediction of the transform of the coarser level are wrong
+        points, pointsRef = np.float32(points), np.float32(pointsRef)
+        error = np.linalg.norm(points @ M[:, 0:2].T + M[:, 2] - pointsRef, axis=1)
+        isNear = error < 16 / scale
+        if np.sum(isNear) <= self.MIN_MATCH_COUNT:
+            return None
+        points, pointsRef = points[isNear], pointsRef[isNear]
+        refinedM, mask = cv2.estimateAffine2D(points.reshape(-1, 1, 2), pointsRef.reshape(-1, 1, 2), cv2.RANSAC,
+                                              ransacReprojThreshold=3 / scale)
+        if refinedM is None or np.sum(mask) <= self.MIN_MATCH_COUNT:
+            return None
+        # the inliers in few patches can not constrain the corners, the refined transform is limited to the error of
+        # the coarser level
+        corners = np.float32([[0, 0], [gray.shape[1], 0], [0, gray.shape[0]], [gray.shape[1], gray.shape[0]]])
+        if np.abs(corners @ refinedM[:, 0:2].T + refinedM[:, 2] - corners @ M[:, 0:2].T - M[:, 2]).max() > 16 / scale:
+            return None
+        return refinedM
+
+    def __runPyramid(self):
+        grayRef = self.__gray(self.imageRef)
+        gray = self.__gray(self.image)
+        # the coarse level
+        scale = min(self.coarseSize / max(grayRef.shape[0:2] + gray.shape[0:2]), 1)
+        coarseRef = self.__patch(grayRef, (0, 0, grayRef.shape[1], grayRef.shape[0]), scale)
+        coarse = self.__patch(gray, (0, 0, gray.shape[1], gray.shape[0]), scale)
+        kpRef, kp, matches = self.__match(coarseRef, coarse)
+        if len(matches) <= self.MIN_MATCH_COUNT:
+            self.error.emit("Not enough matches are found - {}/{}".format(len(matches), self.MIN_MATCH_COUNT))
+            return
+        M, mask = self.__estimate(kpRef, kp, matches, scale=scale)
+        if M is None:
+            self.error.emit('The transform is not found.')
+            return
+        matchesImage = cv2.drawMatches(coarseRef, kpRef, coarse, kp, matches, None, matchColor=(0, 255, 0),
+                                       singlePointColor=None, matchesMask=mask.ravel().tolist(), flags=2)
+        # refine by the patches, the levels are doubled up to the full resolution
+        while scale < 1:
+            scale = min(scale * 2, 1)
+            refinedM = self.__refine(grayRef, gray, M, scale)
+            if refinedM is not None:
+                M = refinedM
+        imageWarped = cv2.warpAffine(self.image, M, (self.imageRef.shape[1], self.imageRef.shape[0]))
+        self.finish.emit(imageWarped, matchesImage)
+
 
 import sys
 
@@ -10,11 +10,19 @@
 this file provide some function for image transform
 '''
 
+from collections import OrderedDict
+
 import numpy as np
 from PyQt5.QtCore import QPointF
 from PyQt5.QtGui import QImage, QPolygonF, QPixmap
 from skimage import color
 
+from ImageBridge import QImage2NArray, NArray2QImage
+
+# dtype of the gray image for the analysis, float32 in [0, 1] gives the same results as float64 with half of the
+# memory. np.uint8 for the gray levels in [0, 255], the thresholds are in the same unit, see NAImage2GrayNArray
+GRAY_DTYPE = np.float32
+
 
 def QImageToGrayByChannel(qimage: QImage, channel, isNdarray=False):
     if not channel in ['RGB', 'Gray', 'Red', 'Green', 'Blue']:
@@ -22,19 +30,51 @@ def QImageToGrayByChannel(qimage: QImage, channel, isNdarray=False):
     if channel == 'RGB':
         return qimage
     imageArray = QImage2NArray(qimage)
-    imageArray = NAImage2GrayByChannel(imageArray, channel)
-    imageArray = np.squeeze(imageArray)
+    # truncated to uint8 as array2qimage does, and shown without copying
+    imageArray = NAImage2GrayByChannel(imageArray, channel).astype(np.uint8)
     if isNdarray:
         return imageArray
     return NArray2QImage(imageArray)
 
 
+class ChannelImageCache:
+    '''
+    LRU cache of the pixmaps of the color channels, keyed by the identity of the image (QImage.cacheKey) and the
+    channel, so switching the channels back and forth converts the image only once
+    '''
+
+    def __init__(self, maxSize=5):
+        '''
+        :param maxSize: number of the pixmaps kept, 5 for all the channels of an image
+        '''
+        self.maxSize = maxSize
+        self.pixmaps = OrderedDict()
+
+    def pixmap(self, qimage: QImage, channel):
+        '''
+        :return: QPixmap of the channel of the image, see QImageToGrayByChannel
+        '''
+        key = (qimage.cacheKey(), channel)
+        if key in self.pixmaps:
+            self.pixmaps.move_to_end(key)
+            return self.pixmaps[key]
+        pixmap = QPixmap.fromImage(QImageToGrayByChannel(qimage, channel))
+        self.pixmaps[key] = pixmap
+        while len(self.pixmaps) > self.maxSize:
+            self.pixmaps.popitem(last=False)
+        return pixmap
+
+    def clear(self):
+        # the image is replaced or filtered
+        self.pixmaps.clear()
+
+
 def NAImage2GrayByChannel(image, channel='Gray'):
     channel = channel.upper()
     if not channel in ['GRAY', 'RED', 'GREEN', 'BLUE']:
         return False
     if channel == 'GRAY':
-        imageArray = np.mean(image, axis=2)
+        imageArray = np.mean(image, axis=2, dtype=np.float32)
     elif channel == 'RED':
         imageArray = image[:, :, 0]
     elif channel == 'GREEN':
@@ -44,8 +84,29 @@ def NAImage2GrayByChannel(image, channel='Gray'):
     return np.squeeze(imageArray)
 
 
-def QImage2GrayNArray(qimage: QImage):
-    return color.rgb2gray(QImage2NArray(qimage))
+def QImage2GrayNArray(qimage: QImage, dtype=GRAY_DTYPE):
+    return NAImage2GrayNArray(QImage2NArray(qimage), dtype=dtype)
+
+
+def NAImage2GrayNArray(image: np.ndarray, channel='RGB', dtype=GRAY_DTYPE, stripSize=1024):
+    '''
+    convert the image array to the gray image used for analysis, the same as the analysis of the image shown in
+    the view with the channel selected. computed strip by strip in float64, so only the output is full-frame.
+    :param image: image array with the shape of (rows, cols, 3)
+    :param channel: RGB, Gray, Red, Green or Blue
+    :param dtype: a float dtype for the values in [0, 1], uint8 for the gray levels in [0, 255]
+    :return: gray image
+    '''
+    gray = np.empty(image.shape[:2], dtype=dtype)
+    for start in range(0, image.shape[0], stripSize):
+        strip = image[start:start + stripSize]
+        if channel.upper() == 'RGB':
+            value = color.rgb2gray(strip[:, :, 0:3])
+            gray[start:start + stripSize] = np.round(value * 255) if gray.dtype == np.uint8 else value
+        else:
+            value = NAImage2GrayByChannel(strip, channel).astype(np.uint8)
+            gray[start:start + stripSize] = value if gray.dtype == np.uint8 else value / 255
+    return gray
 
 
 def QPolygon2Mask(width, height, polygon: QPolygonF):
@@ -54,74 +115,472 @@ def QPolygon2Mask(width, height, polygon: QPolygonF):
     :param width: image width
     :param height: image height
     :param polygon: QPolygon
-    :return: binary image with the pixels in polygon marked as True
+    :return: binary image of (height, width) with the pixels in polygon marked as True
     test pass at 2021.03.08
     '''
     poa = np.empty([len(polygon), 2])
     for i, p in enumerate(polygon):
-        poa[i, :] = [p.x(), p.y()]
+        poa[i, :] = [p.y(), p.x()]
     from skimage import draw
-    mask = draw.polygon2mask((width, height), poa)
+    mask = draw.polygon2mask((height, width), poa)
     return mask
 
 
-def NArray2QImage(img: np.ndarray):
+def QPolygon2LocalMask(width, height, polygon: QPolygonF):
     '''
-    convert ndarray to QImage
-    :param img:
-    :return:
+    convert QPolygon to the mask of its bounding box, the cost is proportional to the area of the polygon instead of
+    the image.
+    :param width: image width
+    :param height: image height
+    :param polygon: QPolygon
+    :return: window, the slices of the rows and cols of the bounding box in the image, and the binary image of the
+    window with the pixels in polygon marked as True, image[window][mask] are the pixels in polygon
     '''
-    from qimage2ndarray import array2qimage
-    if (len(img.shape) > 2):
-        img = img.transpose((1, 0, 2))
-    else:
-        img = img.transpose((1, 0))
-    return array2qimage(img)
+    rect = polygon.boundingRect()
+    x0 = min(max(int(np.floor(rect.left())), 0), width)
+    y0 = min(max(int(np.floor(rect.top())), 0), height)
+    x1 = min(max(int(np.ceil(rect.right())) + 1, x0), width)
+    y1 = min(max(int(np.ceil(rect.bottom())) + 1, y0), height)
+    window = (slice(y0, y1), slice(x0, x1))
+    poa = np.empty([len(polygon), 2])
+    for i, p in enumerate(polygon):
+        poa[i, :] = [p.y() - y0, p.x() - x0]
+    from skimage import draw
+    mask = draw.polygon2mask((y1 - y0, x1 - x0), poa)
+    return window, mask
 
 
-def NArray2QPixmap(image: np.array):
-    return QPixmap.fromImage(NArray2QImage(image))
+def MaskedHistogram(image: np.array, roiMask: np.array, valueRange=None, stripSize=1024):
+    '''
+    histogram of the pixels in roiMask, accumulated strip by strip, so only the pixels of a strip are selected at a
+    time instead of copying all the pixels in roiMask.
+    8-bit and 16-bit images are counted for each gray level, other images are divided into 256 bins like
+    skimage.filters.threshold_otsu.
+    :param image: gray image
+    :param roiMask: inner the ROI is True
+    :param valueRange: (min, max) of all the pixels for the other images, to count the tiles of an image in the bins
+    of the whole image, see TiledAnalysis
+    :return: hist, the number of pixels in each bin; binCenters, the gray level of each bin
+    '''
+    strips = [(image[start:start + stripSize], roiMask[start:start + stripSize])
+              for start in range(0, image.shape[0], stripSize)]
+    if image.dtype in (np.uint8, np.uint16):
+        hist = np.zeros(256 if image.dtype == np.uint8 else 65536, dtype=np.int64)
+        for strip, stripMask in strips:
+            hist += np.bincount(strip[stripMask], minlength=len(hist))
+        return hist, np.arange(len(hist))
+    if valueRange is None:
+        count, low, high = 0, None, None
+        for strip, stripMask in strips:
+            selected = strip[stripMask]
+            if selected.size:
+                count += selected.size
+                low = selected.min() if low is None else min(low, selected.min())
+                high = selected.max() if high is None else max(high, selected.max())
+        if not count or low == high:
+            return np.array([count]), np.array([low], dtype=image.dtype)[:count]
+        valueRange = (low, high)
+    hist = np.zeros(256, dtype=np.int64)
+    binEdges = np.histogram_bin_edges(image[:0, :0].ravel(), bins=256, range=valueRange)
+    for strip, stripMask in strips:
+        hist += np.histogram(strip[stripMask], bins=256, range=valueRange)[0]
+    return hist, (binEdges[:-1] + binEdges[1:]) / 2
+
+
+def OtsuThresholdByHistogram(hist: np.array, binCenters: np.array):
+    '''
+    OTSU threshold of the histogram, the same as skimage.filters.threshold_otsu
+    '''
+    # remove the empty bins at both ends
+    nonzero = np.flatnonzero(hist)
+    if len(nonzero) < 2:
+        return binCenters[nonzero[0]] if len(nonzero) else 0
+    hist = hist[nonzero[0]:nonzero[-1] + 1].astype(np.float64)
+    binCenters = binCenters[nonzero[0]:nonzero[-1] + 1]
+    weight1 = np.cumsum(hist)
+    weight2 = np.cumsum(hist[::-1])[::-1]
+    mean1 = np.cumsum(hist * binCenters) / weight1
+    mean2 = (np.cumsum((hist * binCenters)[::-1]) / weight2[::-1])[::-1]
+    variance12 = weight1[:-1] * weight2[1:] * (mean1[:-1] - mean2[1:]) ** 2
+    return binCenters[np.argmax(variance12)]
+
+
+def MeanStdByHistogram(hist: np.array, binCenters: np.array):
+    '''
+    mean and standard deviation of the histogram
+    '''
+    count = np.sum(hist)
+    mu = np.dot(hist, binCenters) / count
+    sigma = np.sqrt(np.dot(hist, (binCenters - mu) ** 2) / count)
+    return mu, sigma
 
 
-def QImage2NArray(qimage: QImage):
+def MeanStdWithROIMask(image: np.array, roiMask: np.array):
     '''
-    convert QImage to NArray
-    :param qimage: QImage
-    :return: image with the format of ndarray
-    test pass at 2021.03.08
+    mean and standard deviation of the pixels in roiMask, computed from the histogram for 8-bit and 16-bit images
     '''
-    from qimage2ndarray import rgb_view
-    img = rgb_view(qimage=qimage)
-    if (len(img.shape) > 2):
-        img = img.transpose((1, 0, 2))
-    else:
-        img = img.transpose((1, 0))
-    return img
+    if image.dtype in (np.uint8, np.uint16):
+        return MeanStdByHistogram(*MaskedHistogram(image, roiMask))
+    selected = image[roiMask]
+    return np.mean(selected, dtype=np.float64), np.std(selected, dtype=np.float64)
+
+
+def ThresholdWithROIMask2bw(image: np.array, roiMask: np.array, threshold):
+    '''
+    binary image of the pixels in roiMask with the value >= threshold, in a single pass
+    :param roiMask: inner the ROI is True
+    '''
+    bw = np.zeros(image.shape, dtype=bool)
+    np.greater_equal(image, threshold, out=bw, where=roiMask)
+    return bw
 
 
-def QPixmap2NArray(qpixmap: QPixmap):
+def OtsuWithROIMask2bw(image: np.array, roiMask: np.array):
     '''
-    convert QPixmap to NArray
-    :param qpixmap:
-    :return:
+    OTSU of the pixels in roiMask
+    :param roiMask: inner the ROI is True
     '''
-    return QImage2NArray(qpixmap.toImage())
+    threshold = OtsuThresholdByHistogram(*MaskedHistogram(image, roiMask))
+    return ThresholdWithROIMask2bw(image, roiMask, threshold)
+
+
+def ThresholdSweep(image: np.array, roiMask: np.array, extraLevels=()):
+    '''
+    the damaged area versus the threshold, from the reverse cumulative sum of the masked histogram, so all the levels
+    cost a single pass over the image.
+    8-bit and 16-bit images are swept at each gray level, other images at 256 levels in [0, 1] (or the range of the
+    pixels if out of [0, 1]).
+    :param roiMask: inner the ROI is True
+    :param extraLevels: thresholds added to the levels, e.g. the OTSU and Riss thresholds
+    :return: levels, the thresholds in ascending order; areas, the number of pixels in roiMask >= each level
+    '''
+    extraLevels = np.asarray(extraLevels, dtype=np.float64)
+    if image.dtype in (np.uint8, np.uint16):
+        hist, binCenters = MaskedHistogram(image, roiMask)
+        # areas[i] is the number of pixels >= i, with 0 after the last level
+        areas = np.append(np.cumsum(hist[::-1])[::-1], 0)
+        levels = np.union1d(binCenters, extraLevels)
+        return levels, areas[np.clip(np.ceil(levels), 0, len(hist)).astype(int)]
+    selected = image[roiMask]
+    low, high = 0.0, 1.0
+    if selected.size and (selected.min() < 0 or selected.max() > 1):
+        low, high = selected.min(), selected.max()
+    levels = np.union1d(np.linspace(low, high, 256), extraLevels)
+    # the pixels in [levels[i], levels[i + 1]) are counted in the bin i
+    hist, binEdges = np.histogram(selected, bins=np.append(levels, np.inf))
+    return levels, np.cumsum(hist[::-1])[::-1]
+
+
+def IntegralImage(image: np.array):
+    '''
+    integral image with a zero row and column in front, ii[i, j] is the sum of image[:i, :j]
+    '''
+    ii = np.zeros((image.shape[0] + 1, image.shape[1] + 1), dtype=np.float64)
+    np.cumsum(image, axis=0, dtype=np.float64, out=ii[1:, 1:])
+    np.cumsum(ii[1:, 1:], axis=1, out=ii[1:, 1:])
+    return ii
+
+
+def _windowSum(ii: np.array, rows: tuple, cols: tuple):
+    # sum in the windows by 4 lookups of the integral image for each pixel
+    (r0, r1), (c0, c1) = rows, cols
+    return ii[np.ix_(r1, c1)] - ii[np.ix_(r0, c1)] - ii[np.ix_(r1, c0)] + ii[np.ix_(r0, c0)]
+
+
+def LocalMeanStdWithROIMask(image: np.array, roiMask: np.array, windowSize: int, rows: slice = None):
+    '''
+    mean and standard deviation of the pixels in roiMask in the window around each pixel, by the integral images of
+    the sum and the sum of squares, so the cost of each pixel is independent of the window size.
+    :param image: gray image
+    :param roiMask: inner the ROI is True, the pixels outside are not counted
+    :param windowSize: odd size of the square window in pixels
+    :param rows: the rows along axis 0 to compute, None for all; the windows still see the rows around them
+    :return: mean and std of the rows, 0 if no pixel of roiMask in the window
+    '''
+    half = windowSize // 2
+    start, stop, step = (rows or slice(None)).indices(image.shape[0])
+    # the rows seen by the windows
+    top, bottom = max(start - half, 0), min(stop + half, image.shape[0])
+    values = np.where(roiMask[top:bottom], image[top:bottom], 0).astype(np.float64)
+    indices = _windowIndices(values.shape, start - top, stop - top, half)
+    count = _windowSum(IntegralImage(roiMask[top:bottom]), *indices)
+    total = _windowSum(IntegralImage(values), *indices)
+    np.square(values, out=values)
+    squareTotal = _windowSum(IntegralImage(values), *indices)
+    np.maximum(count, 1, out=count)
+    mean = total / count
+    variance = squareTotal / count - mean ** 2
+    return mean, np.sqrt(np.maximum(variance, 0, out=variance), out=variance)
+
+
+def _windowIndices(shape, start, stop, half):
+    # bounds of the windows in the integral image, clipped at the borders
+    rows = np.arange(start, stop)
+    cols = np.arange(shape[1])
+    return ((np.clip(rows - half, 0, shape[0]), np.clip(rows + half + 1, 0, shape[0])),
+            (np.clip(cols - half, 0, shape[1]), np.clip(cols + half + 1, 0, shape[1])))
+
+
+def AdaptiveThreshold(mean: np.array, std: np.array, method='sauvola', k=0.2, maxValue=1.0):
+    '''
+    local threshold of the bright damage zones from the local mean and std
+    niblack: T = m + k * s
+    sauvola: applied to the inverted image as the zones are brighter than the background,
+             T = maxValue - (maxValue - m) * (1 + k * (s / R - 1)), with R = maxValue / 2
+    :param maxValue: the white level of the image, 1.0 for float images, 255 for 8-bit images
+    '''
+    if method == 'niblack':
+        return mean + k * std
+    if method == 'sauvola':
+        return maxValue - (maxValue - mean) * (1 + k * (std / (maxValue / 2) - 1))
+    raise ValueError('The method should be sauvola or niblack.')
 
 
 def GetBinaryImageWithThresholdWithMask(image: np.array, mask: np.array, threshold: int):
-    masked = np.ma.masked_array(image, mask)
-    maskedImage = masked.filled(fill_value=0)
-    bw = maskedImage >= threshold
-    return bw
+    return ThresholdWithROIMask2bw(image, mask == 0, threshold)
 
 
-# 分析 mask == 1 的区域的 OTSU
+# 分析 mask == 0 的区域的 OTSU
 def OtsuWithMask2bw(image: np.array, mask: np.array):
-    from skimage import filters
-    masked = np.ma.masked_array(image, mask)
-    otsuThreshold = filters.threshold_otsu(masked.compressed())
-    bw = GetBinaryImageWithThresholdWithMask(image, mask, otsuThreshold)
-    return bw
+    return OtsuWithROIMask2bw(image, mask == 0)
+
+
+REGION_TABLE_HEADERS = [
+    'Center X(px)', 'Center Y(px)', 'Area(mm^2)', 'Perimeter(mm)', 'Area(px^2)', 'Perimeter(px)'
+]
+# one row for each region, the fields after the label are the columns of REGION_TABLE_HEADERS
+REGION_TABLE_DTYPE = np.dtype([
+    ('label', np.int64),
+    ('centerX', np.float64),
+    ('centerY', np.float64),
+    ('areaMM', np.float64),
+    ('perimeterMM', np.float64),
+    ('area', np.float64),
+    ('perimeter', np.float64),
+])
+REGION_TABLE_FIELDS = list(REGION_TABLE_DTYPE.names[1:])
+
+
+def RegionPropsTable(binaryImage: np.array, realScale=None):
+    '''
+    measure the connected regions of the binary image
+    :param binaryImage: binary image
+    :param realScale: mm per pixel, None if the scale is not set
+    :return: structured array of REGION_TABLE_DTYPE, one row for each region
+    '''
+    return RegionAnalysis(binaryImage).table(realScale)
+
+
+def LabelPropsTable(labelImage: np.array, realScale=None, offset=(0, 0)):
+    '''
+    measure all the regions of the label image at once, the same as measure.regionprops, the area and center by
+    bincount of the pixels, the perimeter by LabelPerimeters
+    :param labelImage: label image, the labels are not necessarily consecutive
+    :param offset: (row, col) of the label image in the whole image, added to the centers
+    :return: structured array of REGION_TABLE_DTYPE, one row for each region in the order of the labels
+    '''
+    flatLabels = labelImage.ravel()
+    pixels = np.flatnonzero(flatLabels)
+    pixelLabels = flatLabels[pixels]
+    count = pixelLabels.max() + 1 if len(pixels) else 1
+    areas = np.bincount(pixelLabels, minlength=count)
+    labels = np.flatnonzero(areas)
+    tableData = np.zeros(len(labels), dtype=REGION_TABLE_DTYPE)
+    tableData['label'] = labels
+    tableData['area'] = areas[labels]
+    y, x = np.divmod(pixels, labelImage.shape[1])
+    tableData['centerX'] = np.bincount(pixelLabels, weights=x, minlength=count)[labels] / tableData['area'] + offset[1]
+    tableData['centerY'] = np.bincount(pixelLabels, weights=y, minlength=count)[labels] / tableData['area'] + offset[0]
+    tableData['perimeter'] = LabelPerimeters(labelImage, count)[labels]
+    if realScale:
+        tableData['areaMM'] = tableData['area'] * realScale * realScale
+        tableData['perimeterMM'] = tableData['perimeter'] * realScale
+    return tableData
+
+
+def LabelPerimeters(labelImage: np.array, count=None):
+    '''
+    perimeters of all the labels at once, the same as skimage.measure.perimeter with the 4-neighborhood of each
+    region: the border pixels are weighted by the pattern of the border pixels of the same label around them.
+    only the border pixels are visited.
+    :param count: the largest label + 1
+    :return: perimeter of each label, perimeters[0] is 0
+    '''
+    padded = np.pad(labelImage, 1)
+    width = padded.shape[1]
+    flatLabels = padded.ravel()
+    pixels = np.flatnonzero(flatLabels)
+    pixelLabels = flatLabels[pixels]
+    if count is None:
+        count = pixelLabels.max() + 1 if len(pixels) else 1
+    straight, diagonal = [-width, -1, 1, width], [-width - 1, -width + 1, width - 1, width + 1]
+    # the pixels with any 4-neighbour of another label or the background
+    isBorder = np.zeros(len(pixels), dtype=bool)
+    for step in straight:
+        isBorder |= flatLabels[pixels + step] != pixelLabels
+    pixels, pixelLabels = pixels[isBorder], pixelLabels[isBorder]
+    borderLabels = np.zeros_like(flatLabels)
+    borderLabels[pixels] = pixelLabels
+    # the code of skimage, 1 for the pixel, 2 for each 4-neighbour and 10 for each diagonal one on the border
+    code = np.ones(len(pixels), dtype=np.int64)
+    for step in straight:
+        code += 2 * (borderLabels[pixels + step] == pixelLabels)
+    for step in diagonal:
+        code += 10 * (borderLabels[pixels + step] == pixelLabels)
+    weights = np.zeros(50, dtype=np.float64)
+    weights[[5, 7, 15, 17, 25, 27]] = 1
+    weights[[21, 33]] = np.sqrt(2)
+    weights[[13, 23]] = (1 + np.sqrt(2)) / 2
+    return np.bincount(pixelLabels, weights=weights[code], minlength=count)
+
+
+def LabelShapes(labelImage: np.array, count=None):
+    '''
+    orientation and axis ratio of all the labels at once from the central moments by bincount, the same as the
+    orientation, minor_axis_length / major_axis_length of measure.regionprops of the transposed label image, i.e.
+    the orientation is measured from the x axis
+    :param count: the largest label + 1
+    :return: orientation in rad and the ratio of the minor axis to the major axis of each label, 0 if the major axis
+    is 0
+    '''
+    flatLabels = labelImage.ravel()
+    pixels = np.flatnonzero(flatLabels)
+    pixelLabels = flatLabels[pixels]
+    if count is None:
+        count = pixelLabels.max() + 1 if len(pixels) else 1
+    y, x = np.divmod(pixels, labelImage.shape[1])
+    areas = np.maximum(np.bincount(pixelLabels, minlength=count), 1)
+    # two passes, the coordinates are centered before squared for the precision
+    x = x - (np.bincount(pixelLabels, weights=x, minlength=count) / areas)[pixelLabels]
+    y = y - (np.bincount(pixelLabels, weights=y, minlength=count) / areas)[pixelLabels]
+    # inertia tensor [[a, b], [b, c]] of skimage with x as the axis 0
+    a = np.bincount(pixelLabels, weights=y * y, minlength=count) / areas
+    b = -np.bincount(pixelLabels, weights=x * y, minlength=count) / areas
+    c = np.bincount(pixelLabels, weights=x * x, minlength=count) / areas
+    orientation = np.where(a - c == 0, np.where(b < 0, np.pi / 4, -np.pi / 4), 0.5 * np.arctan2(-2 * b, c - a))
+    # eigenvalues of the inertia tensor, the axis lengths are 4 * sqrt(eigenvalue)
+    delta = np.sqrt(((a - c) / 2) ** 2 + b ** 2)
+    major = np.maximum((a + c) / 2 + delta, 0)
+    minor = np.maximum((a + c) / 2 - delta, 0)
+    ratio = np.sqrt(np.divide(minor, major, out=np.zeros(count), where=major > 0))
+    return orientation, ratio
+
+
+class RegionAnalysis:
+    '''
+    connected regions (8-connectivity) of the binary image, labeled once and shared by LabelImageView,
+    LabelDataTable and the filters. a new object is created when the binary image is replaced, updateRegion keeps
+    it in line with the changes in a window. the labels are not necessarily consecutive after updateRegion and
+    filterSmallRegions.
+    '''
+
+    def __init__(self, binaryImage: np.array, labelImage: np.array = None):
+        from scipy import ndimage
+        from skimage import measure
+        self.binaryImage = binaryImage
+        self.labelImage = measure.label(binaryImage) if labelImage is None else labelImage
+        self.labelSlices = ndimage.find_objects(self.labelImage)  # bounding box of each label, None if removed
+        self._areas = None
+        self._shapes = None
+        self._tables = {}
+
+    @property
+    def areas(self):
+        '''
+        number of pixels of each label, areas[0] is the background
+        '''
+        if self._areas is None:
+            self._areas = np.bincount(self.labelImage.ravel(), minlength=len(self.labelSlices) + 1)
+        return self._areas
+
+    @property
+    def shapes(self):
+        '''
+        orientation and axis ratio of each label, see LabelShapes
+        '''
+        if self._shapes is None:
+            self._shapes = LabelShapes(self.labelImage, len(self.labelSlices) + 1)
+        return self._shapes
+
+    def table(self, realScale=None):
+        '''
+        :return: structured array of REGION_TABLE_DTYPE, see LabelPropsTable
+        '''
+        if realScale not in self._tables:
+            self._tables[realScale] = LabelPropsTable(self.labelImage, realScale)
+        return self._tables[realScale]
+
+    def filterSmallRegions(self, minArea):
+        '''
+        remove the regions smaller than minArea pixels, without labeling again
+        :return: new RegionAnalysis of the filtered binary image
+        '''
+        keep = self.areas >= minArea
+        keep[0] = False
+        labelImage = np.where(keep[self.labelImage], self.labelImage, 0)
+        regions = RegionAnalysis.__new__(RegionAnalysis)
+        regions.binaryImage = labelImage > 0
+        regions.labelImage = labelImage
+        regions.labelSlices = [labelSlice if kept else None for labelSlice, kept in zip(self.labelSlices, keep[1:])]
+        regions._areas = np.where(keep, self.areas, 0)
+        regions._shapes = self._shapes
+        regions._tables = {}
+        return regions
+
+    def updateRegion(self, binaryImage: np.array, window: tuple):
+        '''
+        relabel only the regions touching the changed window of the binary image
+        :param binaryImage: the binary image changed in the window only
+        :param window: slices of the changed region, see QPolygon2LocalMask
+        :return: labels removed, label image of the new regions with the new labels and its offset in the image
+        '''
+        from scipy import ndimage
+        from skimage import measure
+        self.binaryImage = binaryImage
+        # the labels in the window and its neighbour pixels are removed, the rest regions are not changed
+        window = tuple(slice(max(w.start - 1, 0), min(w.stop + 1, size)) for w, size in zip(window, binaryImage.shape))
+        removedLabels = np.unique(self.labelImage[window])
+        removedLabels = removedLabels[removedLabels > 0]
+        starts, stops = [w.start for w in window], [w.stop for w in window]
+        for label in removedLabels:
+            for axis, labelSlice in enumerate(self.labelSlices[label - 1]):
+                starts[axis], stops[axis] = min(starts[axis], labelSlice.start), max(stops[axis], labelSlice.stop)
+            self.labelSlices[label - 1] = None
+        region = tuple(slice(start, stop) for start, stop in zip(starts, stops))
+        offset = tuple(starts)
+        labelImage = self.labelImage[region]
+        removedMask = np.isin(labelImage, removedLabels)
+        localLabelImage = measure.label(binaryImage[region] & (removedMask | (labelImage == 0)))
+        # the new labels follow the largest label ever used
+        localLabelImage[localLabelImage > 0] += len(self.labelSlices)
+        for localSlice in ndimage.find_objects(localLabelImage)[len(self.labelSlices):]:
+            self.labelSlices.append(tuple(slice(s.start + o, s.stop + o) for s, o in zip(localSlice, offset)))
+        labelImage[removedMask] = 0
+        labelImage += localLabelImage
+        if self._shapes is not None:
+            # the shapes of the rest regions are not changed
+            count = len(self.labelSlices) + 1
+            self._shapes = tuple(np.concatenate([old, new[len(old):]]) for old, new in
+                                 zip(self._shapes, LabelShapes(localLabelImage, count)))
+        self._areas = None
+        self._tables = {}
+        return removedLabels, localLabelImage, offset
+
+
+def IntersectWindow(window1: tuple, window2: tuple):
+    '''
+    intersection of two windows of slices, see QPolygon2LocalMask
+    :return: the intersection in the image, in window1 and in window2, None if they do not overlap
+    '''
+    window, local1, local2 = [], [], []
+    for s1, s2 in zip(window1, window2):
+        start, stop = max(s1.start, s2.start), min(s1.stop, s2.stop)
+        if stop <= start:
+            return None
+        window.append(slice(start, stop))
+        local1.append(slice(start - s1.start, stop - s1.start))
+        local2.append(slice(start - s2.start, stop - s2.start))
+    return tuple(window), tuple(local1), tuple(local2)
 
 
 def QPolygonF2list(polygon: QPolygonF):
@@ -160,6 +619,16 @@ def medianFilter(image, size=4):
     return median(image, disk(size))
 
 
+def QImageMedianFilter(qimage: QImage, diskRadius, channel='RGB'):
+    '''
+    median filter of the 8-bit gray image of the channel, as the filter in the main window and its replay from the
+    project journal
+    :return: QImage of Grayscale8
+    '''
+    grayImage = QImage2GrayNArray(QImageToGrayByChannel(qimage, channel), np.uint8)
+    return NArray2QImage(medianFilter(grayImage, diskRadius))
+
+
 if __name__ == '__main__':
     import matplotlib.pyplot as plt
 
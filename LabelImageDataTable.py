@@ -19,6 +19,9 @@ from PyQt5.QtWidgets import QWidget, QToolBar, QAction, QTableWidget, QAbstractI
     QTableWidgetItem, \
     QFileDialog, QMessageBox, QApplication, QGroupBox, QLabel, QLineEdit, QSpacerItem, QSizePolicy
 
+from ImageTool import REGION_TABLE_HEADERS, REGION_TABLE_DTYPE, REGION_TABLE_FIELDS, RegionAnalysis, \
+    LabelPropsTable
+
 
 class LabelDataTable(QWidget):
     labelSelectedSignal = pyqtSignal([object], name='Table selected label changed')
@@ -28,12 +31,11 @@ class LabelDataTable(QWidget):
         self.selectedRows = np.array([], dtype=int)
         self.realScale = None
         self.polygon = None
+        self.sweep = None  # levels, areas and marks of the threshold sweep
 
     def initUi(self):
-        self.tableHeaders = [
-            'Center X(px)', 'Center Y(px)', 'Area(mm^2)', 'Perimeter(mm)', 'Area(px^2)', 'Perimeter(px)'
-        ]
-        self.tableData = np.array([])
+        self.tableHeaders = REGION_TABLE_HEADERS
+        self.tableData = np.zeros(0, dtype=REGION_TABLE_DTYPE)
 
         # add action
         self.toolbarHBox = QHBoxLayout()
@@ -47,8 +49,14 @@ class LabelDataTable(QWidget):
         self.saveAction = QAction(QIcon('./res/icons/CSV.png'), 'Export table as csv')
         self.saveAction.triggered.connect(self.saveAsCsv)
 
+        # threshold sweep action
+        self.saveSweepAction = QAction(QIcon('./res/icons/CSV.png'), 'Export threshold sweep as csv')
+        self.saveSweepAction.triggered.connect(self.saveSweepAsCsv)
+        self.saveSweepAction.setEnabled(False)
+
         self.toolbar.addAction(self.showAllAction)
         self.toolbar.addAction(self.saveAction)
+        self.toolbar.addAction(self.saveSweepAction)
         self.toolbarHBox.addSpacerItem(QSpacerItem(20, 5, QSizePolicy.Expanding, QSizePolicy.Minimum))
         self.toolbarHBox.addWidget(self.toolbar)
 
@@ -108,53 +116,69 @@ class LabelDataTable(QWidget):
         self.mainLayout.addWidget(self.table)
         self.mainLayout.addLayout(self.toolbarHBox)
         self.setLayout(self.mainLayout)
-        self.labelData = []
         self.resize(self.table.size().width(), self.size().height())
 
-    def setData(self, binaryImage, realScale, cropPolygon: QPolygonF = None):
+    def setData(self, binaryImage, realScale, cropPolygon: QPolygonF = None, regions: RegionAnalysis = None):
+        '''
+        :param regions: RegionAnalysis of the binary image shared with LabelImageView, labeled here if None
+        '''
         self.initUi()
         self.realScale = realScale
         if not cropPolygon:
-            cropPolygon = QPolygonF(QRectF(0, 0, binaryImage.shape[0], binaryImage.shape[1]))
-        from skimage import measure
-        labelImage = measure.label(binaryImage)
-        self.labelData = measure.regionprops(labelImage)
-        self.tableData = np.zeros([len(self.labelData), 6])
-        for i, row in enumerate(self.labelData):
-            self.tableData[i, 0:6] = [
-                row.centroid[0],
-                row.centroid[1],
-                row.area * realScale * realScale if realScale else 0,
-                row.perimeter * realScale if realScale else 0,
-                row.area,
-                row.perimeter
-            ]
+            cropPolygon = QPolygonF(QRectF(0, 0, binaryImage.shape[1], binaryImage.shape[0]))
+        if regions is None:
+            regions = RegionAnalysis(binaryImage)
+        self.tableData = regions.table(realScale)
         # shapely
         from shapely.geometry import Polygon
         data = []
         for point in cropPolygon:
             data.append([point.x(), point.y()])
         self.polygon = Polygon(data)
-        if not realScale:
+        self.updateSummary()
+        self.updateTable()
+
+    def updateRegions(self, removedLabels: np.array, localLabelImage: np.array, offset=(0, 0)):
+        '''
+        replace the rows of the removed labels with the rows of the new labels, see LabelImageView.updateRegion
+        '''
+        keep = ~np.isin(self.tableData['label'], removedLabels)
+        self.tableData = np.concatenate([self.tableData[keep],
+                                         LabelPropsTable(localLabelImage, self.realScale, offset)])
+        self.selectedRows = np.array([], dtype=int)
+        self.updateSummary()
+        self.updateTable()
+
+    def updateSummary(self):
+        if not self.realScale:
             self.shearPerimeterValue.setText(
                 '%.2f px' % (self.polygon.length))
             self.shearAreaValue.setText('%.2f px^2' % (self.polygon.area))
             self.totalShearFailureRegionAreaValue.setText(
-                '%.2f px^2' % (np.sum(self.tableData[:, 4])))
+                '%.2f px^2' % (np.sum(self.tableData['area'])))
         else:
             self.shearPerimeterValue.setText(
                 '%.2f px / %.2f mm' % (self.polygon.length, self.polygon.length * self.realScale))
             self.shearAreaValue.setText(
                 '%.2f px^2 / %.2f mm^2' % (self.polygon.area, self.polygon.area * self.realScale * self.realScale))
             self.totalShearFailureRegionAreaValue.setText(
-                '%.2f px^2 / %.2f mm^2' % (np.sum(self.tableData[:, 4]), np.sum(self.tableData[:, 2])))
-        self.updateTable()
+                '%.2f px^2 / %.2f mm^2' % (np.sum(self.tableData['area']), np.sum(self.tableData['areaMM'])))
+
+    def setSweepData(self, levels: np.array, areas: np.array, marks: list = []):
+        '''
+        :param levels: thresholds, see ImageTool.ThresholdSweep
+        :param areas: damaged area in px^2 of each threshold
+        :param marks: list of (method, threshold), e.g. the OTSU and Riss thresholds
+        '''
+        self.sweep = (levels, areas, marks)
+        self.saveSweepAction.setEnabled(True)
 
     def updateTable(self):
-        self.table.setRowCount(len(self.labelData) + 1)
-        for r in range(self.tableData.shape[0]):
-            for c in range(self.tableData.shape[1]):
-                item = QTableWidgetItem('%.2f' % self.tableData[r, c])
+        self.table.clearSpans()
+        self.table.setRowCount(len(self.tableData) + 1)
+        for c, field in enumerate(REGION_TABLE_FIELDS):
+            for r, value in enumerate(self.tableData[field]):
+                item = QTableWidgetItem('%.2f' % value)
                 item.setTextAlignment(Qt.AlignCenter | Qt.AlignVCenter)
                 self.table.setItem(r, c, item)
         totalRow = len(self.tableData)
@@ -164,7 +188,7 @@ class LabelDataTable(QWidget):
         self.table.setItem(totalRow, 0, item)
         self.table.setSpan(totalRow, 0, 1, 2)
         for i in range(2, 6):
-            item = QTableWidgetItem('%.2f' % np.sum(self.tableData[:, i]))
+            item = QTableWidgetItem('%.2f' % np.sum(self.tableData[REGION_TABLE_FIELDS[i]]))
             item.setTextAlignment(Qt.AlignCenter | Qt.AlignVCenter)
             item.setBackground(QColor(240, 240, 240))
             self.table.setItem(totalRow, i, item)
@@ -205,7 +229,7 @@ class LabelDataTable(QWidget):
                         self.realScale
                     ])
                 writer.writerow(self.tableHeaders)
-                writer.writerows(list(self.tableData))
+                writer.writerows(self.tableData[REGION_TABLE_FIELDS].tolist())
                 writer.writerow([
                     'Total',
                     '',
@@ -215,17 +239,131 @@ class LabelDataTable(QWidget):
                     self.table.item(self.table.rowCount() - 1, 5).text(),
                 ])
 
+    def saveSweepAsCsv(self):
+        import datetime
+        if self.sweep is None:
+            return
+        filePath, fileType = QFileDialog.getSaveFileName(self, 'Save File',
+                                                         './ThresholdSweep-%s.csv' % (
+                                                             datetime.datetime.now().strftime('%Y%m%d%H%M%S')),
+                                                         'CSV(*.csv)')
+        if not filePath:
+            QMessageBox.warning(self, 'No Path Selected', 'No Path is selected.')
+            return
+        levels, areas, marks = self.sweep
+        totalArea = areas[0] if len(areas) else 0
+        marked = {threshold: method for method, threshold in marks}
+        with open(filePath, 'w') as stream:
+            writer = csv.writer(stream, lineterminator='\n')
+            writer.writerow(['Damaged Area versus Threshold'])
+            for method, threshold in marks:
+                writer.writerow(['%s Threshold' % method, '%.4f' % threshold])
+            writer.writerow(['Threshold', 'Area(px^2)', 'Area(mm^2)', 'Area Ratio(%)', 'Method'])
+            for level, area in zip(levels, areas):
+                writer.writerow([
+                    '%.4f' % level,
+                    area,
+                    '%.2f' % (area * self.realScale * self.realScale) if self.realScale else '',
+                    '%.2f' % (area / totalArea * 100) if totalArea else 0,
+                    marked.get(level, '')
+                ])
+
     def itemClickedAction(self, selected, deselected):
         selectedRows = np.unique(np.array(list(map(lambda x: x.row() + 1, selected.indexes()))))
         deselectedRows = np.unique(np.array(list(map(lambda x: x.row() + 1, deselected.indexes()))))
         print("selected add: %s; deselected: %s" % (selectedRows, deselectedRows))
-        self.selectedRows = np.unique(np.append(self.selectedRows, selectedRows)).astype(np.int)
-        self.selectedRows = np.setdiff1d(self.selectedRows, deselectedRows).astype(np.int)
-        selectedRows = self.selectedRows
-        if not len(self.selectedRows):
-            selectedRows = np.arange(1, self.table.rowCount())
+        self.selectedRows = np.unique(np.append(self.selectedRows, selectedRows)).astype(int)
+        self.selectedRows = np.setdiff1d(self.selectedRows, deselectedRows).astype(int)
+        # the last row is the total, not a region
+        selectedRows = self.selectedRows[self.selectedRows <= len(self.tableData)]
+        if not len(selectedRows):
+            selectedRows = np.arange(1, len(self.tableData) + 1)
         print("selected: %s" % selectedRows)
-        self.labelSelectedSignal.emit(selectedRows)
+        self.labelSelectedSignal.emit(self.tableData['label'][selectedRows - 1])
+
+
+class MethodComparisonTable(QWidget):
+    # binary image of the selected method
+    methodSelectedSignal = pyqtSignal([object], name='Table selected method changed')
+
+    def __init__(self):
+        super(MethodComparisonTable, self).__init__()
+        self.results = []
+        self.realScale = None
+        self.initUi()
+
+    def initUi(self):
+        self.tableHeaders = [
+            'Method', 'Threshold', 'Area(px^2)', 'Area(mm^2)', 'Area Ratio(%)'
+        ]
+        self.toolbarHBox = QHBoxLayout()
+        self.toolbar = QToolBar()
+        self.saveAction = QAction(QIcon('./res/icons/CSV.png'), 'Export table as csv')
+        self.saveAction.triggered.connect(self.saveAsCsv)
+        self.toolbar.addAction(self.saveAction)
+        self.toolbarHBox.addSpacerItem(QSpacerItem(20, 5, QSizePolicy.Expanding, QSizePolicy.Minimum))
+        self.toolbarHBox.addWidget(self.toolbar)
+
+        self.table = QTableWidget(0, len(self.tableHeaders))
+        self.table.setHorizontalHeaderLabels(self.tableHeaders)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.selectionModel().selectionChanged.connect(self.itemClickedAction)
+
+        self.setWindowTitle('Comparison of Methods')
+        self.setWindowIcon(QIcon('./res/icons/table-white.png'))
+
+        self.mainLayout = QVBoxLayout()
+        self.mainLayout.addWidget(self.table)
+        self.mainLayout.addLayout(self.toolbarHBox)
+        self.setLayout(self.mainLayout)
+        self.resize(700, 250)
+
+    def setData(self, results: list, realScale):
+        '''
+        :param results: results of ComparisonAnalysisThread
+        :param realScale: mm per pixel
+        '''
+        from AnalysisThread import ComparisonAnalysisThread
+        self.results = results
+        self.realScale = realScale
+        self.tableData = []
+        for result in results:
+            self.tableData.append([
+                result['method'],
+                ComparisonAnalysisThread.thresholdText(result['threshold']),
+                '%d' % result['area'],
+                '%.2f' % (result['area'] * realScale * realScale) if realScale else '-',
+                '%.2f' % (result['areaRatio'] * 100)
+            ])
+        self.table.setRowCount(len(self.tableData))
+        for r, row in enumerate(self.tableData):
+            for c, value in enumerate(row):
+                item = QTableWidgetItem(value)
+                item.setTextAlignment(Qt.AlignCenter | Qt.AlignVCenter)
+                self.table.setItem(r, c, item)
+        self.table.resizeColumnsToContents()
+        self.update()
+
+    def saveAsCsv(self):
+        import datetime
+        filePath, fileType = QFileDialog.getSaveFileName(self, 'Save File',
+                                                         './MethodComparison-%s.csv' % (
+                                                             datetime.datetime.now().strftime('%Y%m%d%H%M%S')),
+                                                         'CSV(*.csv)')
+        if not filePath:
+            QMessageBox.warning(self, 'No Path Selected', 'No Path is selected.')
+            return
+        with open(filePath, 'w') as stream:
+            writer = csv.writer(stream, lineterminator='\n')
+            writer.writerow(self.tableHeaders)
+            writer.writerows(self.tableData)
+
+    def itemClickedAction(self, selected, deselected):
+        rows = np.unique(np.array(list(map(lambda x: x.row(), selected.indexes()))))
+        if len(rows):
+            self.methodSelectedSignal.emit(self.results[rows[0]]['binaryImage'])
 
 
 if __name__ == '__main__':
@@ -8,8 +8,7 @@
 import datetime
 import os
 
-import pickle5 as pickle
-from PyQt5.QtCore import Qt, QUrl
+from PyQt5.QtCore import Qt, QUrl, QTimer, QSettings, QSize
 from PyQt5.QtGui import QIcon, QKeySequence, QCloseEvent, QDesktopServices
 from PyQt5.QtWidgets import QMainWindow, QAction, QActionGroup, QLabel, QProgressBar, QSplitter, QFileDialog, \
     QMessageBox, QInputDialog, QProgressDialog, QApplication
@@ -17,7 +16,14 @@ from PyQt5.QtWidgets import QMainWindow, QAction, QActionGroup, QLabel, QProgres
 from AnalysisThread import *
 from ImageRegistration import ImageRegWidget
 from ImageTool import *
-from LabelImageDataTable import LabelDataTable
+from LabelImageDataTable import LabelDataTable, MethodComparisonTable
+from ProjectFile import ProjectFile, ProjectJournal, ProjectLoadThread, ImageSource, HEADER_KEYS, HasBinaryImage
+from View import DrawType
+
+# the edits are autosaved to the journal of the project every 30 s
+AUTOSAVE_INTERVAL = 30 * 1000
+# the project opened, to be recovered if the program is not closed properly
+RECOVERY_KEY = 'recovery/project'
 
 
 class MainWindow(QMainWindow):
@@ -46,6 +52,9 @@ class MainWindow(QMainWindow):
         # connect originView and labelView
         self.originView.MousePosChanged.connect(self.__updateMosuePositionShownInStatusBar)
         self.originView.PolygonDrawFinishedSignal.connect(self.__updateActionsStatus)
+        self.originView.PolygonDrawFinishedSignal.connect(self.__polygonDrawFinished)
+        self.originView.ROIsDeletedSignal.connect(self.__ROIsDeleted)
+        self.originView.ROIsSelectedSignal.connect(self.__updateActionsStatus)
         self.labelView.MousePosChanged.connect(self.__updateMosuePositionShownInStatusBar)
         self.originView.RealScaleChangedSignal.connect(self.__updateRealScale)
 
@@ -107,6 +116,12 @@ class MainWindow(QMainWindow):
         self.actionAnalysisRiss = QAction(QIcon('res/icons/run.png'),
                                           'Riss method - Riss method based on ROIs',
                                           self)
+        self.actionAnalysisAdaptive = QAction(QIcon('res/icons/run.png'),
+                                              'Adaptive method - Local Sauvola or Niblack threshold in the crop area',
+                                              self)
+        self.actionAnalysisComparison = QAction(QIcon('res/icons/table.png'),
+                                                'Compare methods - Manual, Global OTSU, Riss and SDZM method',
+                                                self)
         # post-processing
         self.actionFilterSmallZones = QAction(QIcon('res/icons/filter-small-zones.png'),
                                               'Filter Small Shear Damage Zones',
@@ -153,6 +168,8 @@ class MainWindow(QMainWindow):
         self.actionAnalysisROIs.triggered.connect(self.__analysisROIs)
         self.actionAnalysisOTSU.triggered.connect(self.__analysisOTSU)
         self.actionAnalysisRiss.triggered.connect(self.__analysisRiss)
+        self.actionAnalysisAdaptive.triggered.connect(self.__analysisAdaptive)
+        self.actionAnalysisComparison.triggered.connect(self.__analysisComparison)
         # # post
         self.actionFilterSmallZones.triggered.connect(self.labelView.filterSmallZones)
         self.actionFilterSmallHoles.triggered.connect(self.labelView.filterSmallHoles)
@@ -213,7 +230,10 @@ class MainWindow(QMainWindow):
             analysisMenu.addSeparator(),
             self.actionAnalysisROIs,
             self.actionAnalysisOTSU,
-            self.actionAnalysisRiss
+            self.actionAnalysisRiss,
+            self.actionAnalysisAdaptive,
+            analysisMenu.addSeparator(),
+            self.actionAnalysisComparison
         ])
 
         # postprocessing
@@ -282,6 +302,18 @@ class MainWindow(QMainWindow):
         self.statusBar().addWidget(self.processBar)
         self.statusBar().addPermanentWidget(self.labelCopyright)
 
+        # the project loading threads cancelled, kept until finished
+        self.cancelledLoadThreads = []
+        # the analysis threads cancelled, kept until finished
+        self.cancelledAnalysisThreads = []
+
+        # autosave
+        self.settings = QSettings('SDZM', 'SDZM toolbox')
+        self.autosaveTimer = QTimer(self)
+        self.autosaveTimer.setInterval(AUTOSAVE_INTERVAL)
+        self.autosaveTimer.timeout.connect(self.__autosave)
+        self.autosaveTimer.start()
+
         # initUi
         self.initUi()
 
@@ -291,12 +323,19 @@ class MainWindow(QMainWindow):
         :return:
         '''
 
+        self.__stopProjectLoading()
         if not (hasattr(self, 'projectWorkPath') and self.projectWorkPath):
             self.projectWorkPath = os.getcwd()
         self.projectFileName = None
         self.imageFileName = None
         self.originImage = None
+        self.imageSource = None  # (bytes, format) of the image file, saved in the project without encoding
+        self.filters = []  # the median filters since the snapshot of the project, replayed from the journal
+        self.journal = None  # the journal of the project, None if the image is replaced after the snapshot
         self.__mouseDrapNoticeEnable = True
+        self.lastAnalysis = None  # the last analysis of the ROIs, updated incrementally when the ROIs change
+        self.sweepAnalysis = None  # parameters and threshold sweep of the image and ROIs if lastAnalysis is None
+        self.channelCache = ChannelImageCache()  # pixmaps of the color channels of originImage
 
         self.colorChannel = 'RGB'
         self.__setColorChannelByName(self.colorChannel)
@@ -318,11 +357,21 @@ class MainWindow(QMainWindow):
             image = QImage(filePath)
             if initUi:
                 self.initUi()
+                self.settings.remove(RECOVERY_KEY)
             self.projectWorkPath, self.imageFileName = os.path.split(filePath)
+            imageSource = ImageSource(filePath)
         else:
             image = NArray2QImage(image)
+            imageSource = None
             # self.initUi()
         self.originImage = image
+        self.imageSource = imageSource
+        # not in the journal, the project is saved as a new snapshot
+        self.filters = []
+        self.journal = None
+        self.lastAnalysis = None
+        self.sweepAnalysis = None
+        self.channelCache.clear()
         self.originView.setImage(self.originImage)
         self.__updateActionsStatus()
 
@@ -336,29 +385,156 @@ class MainWindow(QMainWindow):
         if not filePath:
             QMessageBox.warning(self, 'No Project File Selected', 'No project file is selected.')
             return
+        self.__loadProject(filePath)
+
+    def __loadProject(self, filePath, recover=False):
+        '''
+        :param recover: replay the edits autosaved but not saved, after a crash
+        '''
         self.initUi()
         self.projectWorkPath, self.projectFileName = os.path.split(filePath)
         try:
-            with open(filePath, mode='rb') as f:
-                project = pickle.load(f)
-            # decode
-            self.originImage = NArray2QImage(project['originImage'])
+            projectFile = ProjectFile(filePath, recover)
+            project = projectFile.header
+            preview = projectFile.preview(
+                max(self.originView.width(), self.originView.height()) * self.devicePixelRatioF())
+        except Exception as e:
+            QMessageBox.warning(self, 'Illegal Project Document',
+                                'Illegal project document, please select a legal one: %s' % e)
+            return
+        if preview is None:
+            self.__projectLoaded(projectFile)
+            return
+        # show the previews at once, then the image in full resolution when decoded
+        originPreview, overlayPreview = preview
+        imageSize = QSize(project['imageShape'][1], project['imageShape'][0])
+        self.originView.setPreview(originPreview, imageSize)
+        if overlayPreview is not None:
+            self.labelView.setPreview(overlayPreview, imageSize)
+        self.__setProjectHeader(project)
+        self.statusBar().showMessage('Loading the project...')
+        self.PLT = ProjectLoadThread(projectFile)
+        self.PLT.finish.connect(self.__projectLoadFinished)
+        self.PLT.failed.connect(self.__projectLoadFailed)
+        self.PLT.start()
+        self.__updateActionsStatus()
+
+    def __setProjectHeader(self, project):
+        for roi in project['ROIs']:
+            self.originView.addRoiPolygon(list2QPolygonF(roi))
+        self.originView.realScale = project['realScale']
+        self.labelView.realScale = project['realScale']
+        if project['cropPolygon']:
+            self.originView.setCropPolygon(list2QPolygonF(project['cropPolygon']))
+
+    def __projectLoadFinished(self, projectFile):
+        if not hasattr(self, 'PLT') or self.sender() is not self.PLT:
+            return
+        self.__closeProjectLoading()
+        self.__projectLoaded(projectFile, isPreviewed=True)
+
+    def __projectLoaded(self, projectFile, isPreviewed=False):
+        '''
+        :param isPreviewed: the previews and the header are shown before
+        '''
+        project = projectFile.header
+        try:
+            self.originImage = projectFile.originImage
+            self.filters = projectFile.filters
+            # the source bytes are the image before the filters
+            self.imageSource = None if self.filters else projectFile.imageSource
             self.__setColorChannelByName(project['colorChannel'])
-            for roi in project['ROIs']:
-                self.originView.addRoiPolygon(list2QPolygonF(roi))
-            self.originView.realScale = project['realScale']
-            self.labelView.realScale = project['realScale']
-            if project['binaryImage'].max() > 0:
-                self.labelView.setImage(project['binaryImage'])
+            if not isPreviewed:
+                self.__setProjectHeader(project)
             if project['cropPolygon']:
-                self.originView.setCropPolygon(list2QPolygonF(project['cropPolygon']))
                 self.labelView.setCropPolygon(self.originView.cropPolygon)
+            if projectFile.binaryImage is not None:
+                self.labelView.setImage(projectFile.binaryImage, projectFile.regions)
+            if project.get('snapshotId'):
+                self.journal = ProjectJournal(projectFile.filePath)
+                self.journal.attach(project['snapshotId'], self.__projectState(), projectFile.recover)
+                self.settings.setValue(RECOVERY_KEY, projectFile.filePath)
             self.__updateActionsStatus()
         except Exception as e:
             QMessageBox.warning(self, 'Illegal Project Document',
                                 'Illegal project document, please select a legal one: %s' % e)
             return
 
+    def __projectLoadFailed(self, reason):
+        if not hasattr(self, 'PLT') or self.sender() is not self.PLT:
+            return
+        self.__closeProjectLoading()
+        QMessageBox.warning(self, 'Illegal Project Document',
+                            'Illegal project document, please select a legal one: %s' % reason)
+        self.initUi()
+
+    def __stopProjectLoading(self):
+        # cancel the project loading without waiting, e.g. another project is opened
+        if not hasattr(self, 'PLT'):
+            return
+        thread = self.PLT
+        thread.cancel()
+        self.__closeProjectLoading()
+        if thread.isRunning():
+            # the QThread is not destroyed while running
+            self.cancelledLoadThreads.append(thread)
+            thread.finished.connect(self.__cancelledProjectLoadingFinished)
+
+    def __cancelledProjectLoadingFinished(self):
+        if self.sender() in self.cancelledLoadThreads:
+            self.cancelledLoadThreads.remove(self.sender())
+
+    def __closeProjectLoading(self):
+        for signal in [self.PLT.finish, self.PLT.failed]:
+            signal.disconnect()
+        self.statusBar().clearMessage()
+        delattr(self, 'PLT')
+
+    def recoverProject(self):
+        '''
+        open the project with the edits autosaved, if the program was not closed properly last time
+        '''
+        filePath = self.settings.value(RECOVERY_KEY)
+        if not filePath or not os.path.exists(filePath):
+            return
+        try:
+            snapshotId = ProjectFile(filePath).header.get('snapshotId')
+            hasUnsaved = ProjectJournal(filePath).hasUnsaved(snapshotId)
+        except Exception:
+            hasUnsaved = False
+        if not hasUnsaved:
+            self.settings.remove(RECOVERY_KEY)
+            return
+        reply = QMessageBox.question(self, 'Recover Project',
+                                     'The project %s was not closed properly, recover the edits not saved?' % filePath,
+                                     QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+        if reply == QMessageBox.Yes:
+            self.__loadProject(filePath, recover=True)
+        else:
+            self.settings.remove(RECOVERY_KEY)
+
+    def __projectState(self):
+        '''
+        the state of the project written to the journal, see ProjectJournal
+        '''
+        return {
+            'cropPolygon': QPolygonF2list(self.originView.cropPolygon),
+            'colorChannel': self.colorChannel,
+            'ROIs': [QPolygonF2list(roi) for roi in self.originView.getROIsPolygon()],
+            'realScale': self.originView.realScale,
+            'filters': list(self.filters),
+            'binaryImage': self.labelView.binaryImage,
+        }
+
+    def __autosave(self):
+        # the edits not saved, replayed if the program crashes
+        if self.journal is None:
+            return
+        try:
+            self.journal.write(self.__projectState())
+        except Exception as e:
+            self.statusBar().showMessage('Failed to autosave the project. %s' % e, 5000)
+
     def __importOldProject(self):
         filePath, fileType = QFileDialog.getOpenFileName(self, 'Choose the project file',
                                                          directory=self.projectWorkPath,
@@ -411,7 +587,7 @@ class MainWindow(QMainWindow):
                 self.originView.realScale = project['real_scale']
                 self.labelView.realScale = project['real_scale']
             if project['label_image'].max() > 0:
-                self.labelView.setImage(project['label_image'].T > 0)
+                self.labelView.setImage(project['label_image'] > 0)
             self.__updateActionsStatus()
         except Exception as e:
             QMessageBox.warning(self, 'Illegal Project Document',
@@ -422,23 +598,23 @@ class MainWindow(QMainWindow):
         if not self.projectFileName:
             self.__saveProjectAs()
             return
-        ROIs = []
-        for roi in self.originView.getROIsPolygon():
-            ROIs.append(QPolygonF2list(roi))
-
-        project = {
-            'originImage': QImage2NArray(self.originImage),  # QPixmap
-            'cropPolygon': QPolygonF2list(self.originView.cropPolygon),  # QPolygonF
-            'colorChannel': self.colorChannel,
-            'ROIs': ROIs,  # list of QPolygonF
-            'realScale': self.originView.realScale,  # float
-            'binaryImage': self.labelView.binaryImage  # ndarray
-        }
         filePath = os.path.join(self.projectWorkPath, self.projectFileName)
         try:
-            with open(filePath, mode='wb') as f:
-                pickle.dump(project, f, pickle.HIGHEST_PROTOCOL)
-                QMessageBox.information(self, 'Success', 'Project file has been saved successfully.')
+            if self.journal is not None and self.journal.projectPath == filePath and not self.journal.needsCompaction():
+                # only the edits since the last save
+                self.journal.write(self.__projectState(), save=True)
+            else:
+                # the image after the median filter or the registration is encoded as png, the filters are cleared
+                # once the snapshot is written
+                state = dict(self.__projectState(), filters=[])
+                overlayImage = self.labelView.getImage() if HasBinaryImage(state['binaryImage']) else None
+                header = ProjectFile.save(filePath, {key: state[key] for key in HEADER_KEYS}, self.originImage,
+                                          state['binaryImage'], self.imageSource, overlayImage or None)
+                self.journal = ProjectJournal(filePath)
+                self.journal.reset(header['snapshotId'], state)
+                self.filters = []
+            self.settings.setValue(RECOVERY_KEY, filePath)
+            QMessageBox.information(self, 'Success', 'Project file has been saved successfully.')
             self.__updateActionsStatus()
         except Exception as e:
             QMessageBox.warning(self, 'Error', 'Failed to write project file. %s' % e)
@@ -462,6 +638,7 @@ class MainWindow(QMainWindow):
                                     QMessageBox.No)
         if reply == QMessageBox.Yes:
             self.initUi()
+            self.settings.remove(RECOVERY_KEY)
         self.__updateActionsStatus()
 
     def __setColorChannelByName(self, channel='RGB'):
@@ -474,7 +651,9 @@ class MainWindow(QMainWindow):
         # change the image in origin view
         if not self.originImage:
             return
-        self.originView.setImage(QImageToGrayByChannel(self.originImage, self.colorChannel))
+        self.lastAnalysis = None
+        self.sweepAnalysis = None
+        self.originView.setImage(self.channelCache.pixmap(self.originImage, self.colorChannel))
         self.__updateActionsStatus()
 
     # pretreatment
@@ -484,7 +663,7 @@ class MainWindow(QMainWindow):
     def __imageRegistration(self):
         self.imageRegWidget = ImageRegWidget()
         if self.originImage is not None:
-            self.imageRegWidget.loadDamageImage(QImage2NArray(self.originImage).transpose((1, 0, 2)))
+            self.imageRegWidget.loadDamageImage(QImage2NArray(self.originImage))
         self.imageRegWidget.finish.connect(self.__updateImage)
         self.imageRegWidget.show()
         self.__updateActionsStatus()
@@ -495,8 +674,12 @@ class MainWindow(QMainWindow):
                                              3, 100, 2)
         if not ok:
             return
-        grayImage = QImage2GrayNArray(self.originView.getImage())
-        self.originImage = NArray2QImage(medianFilter(grayImage, diskRadius))
+        self.originImage = QImageMedianFilter(self.originImage, diskRadius, self.colorChannel)
+        self.imageSource = None
+        self.filters.append({'diskRadius': diskRadius, 'channel': self.colorChannel})
+        self.lastAnalysis = None
+        self.sweepAnalysis = None
+        self.channelCache.clear()
         self.originView.setImage(self.originImage)
         self.__updateActionsStatus()
 
@@ -515,7 +698,9 @@ class MainWindow(QMainWindow):
 
     # analysis
     def __analysisOtsuBasedOnROIs(self):
+        self.__stopAnalysis()
         self.AT = ROIsOTSUAnalysisThread()
+        self.AT.setWorkers(os.cpu_count())
         self.__analysisRun()
 
     def __analysisROIs(self) -> None:
@@ -523,26 +708,62 @@ class MainWindow(QMainWindow):
         generate the labelImage based on the ROIs
         :return:
         '''
+        self.__stopAnalysis()
         self.AT = ROIsToZonesAnalysisThread()
         self.__analysisRun()
 
     def __analysisOTSU(self):
+        self.__stopAnalysis()
         self.AT = AnalysisThread()
         self.__analysisRun()
 
     def __analysisRiss(self):
+        self.__stopAnalysis()
         self.AT = RissAnalysisThread()
         self.__analysisRun()
 
+    def __analysisAdaptive(self):
+        method, ok = QInputDialog.getItem(self, 'Adaptive method', 'Method', ['Sauvola', 'Niblack'], 0, False)
+        if not ok:
+            return
+        windowSize, ok = QInputDialog.getInt(self, 'Adaptive method', 'Window size(px)', 51, 3, 10001, 2)
+        if not ok:
+            return
+        k, ok = QInputDialog.getDouble(self, 'Adaptive method', 'k, the higher the fewer zones', 0.2, -5, 5, 2)
+        if not ok:
+            return
+        self.__stopAnalysis()
+        self.AT = AdaptiveAnalysisThread()
+        self.AT.setAdaptiveParameters(method.lower(), windowSize, k)
+        self.__analysisRun()
+
+    def __analysisComparison(self):
+        self.__stopAnalysis()
+        self.AT = ComparisonAnalysisThread()
+        self.AT.setWorkers(os.cpu_count())
+        self.AT.finishComparison.connect(self.__comparisonFinished)
+        self.__analysisRun()
+
+    def __comparisonFinished(self, results):
+        if not hasattr(self, 'AT') or self.sender() is not self.AT:
+            return
+        self.AT.finishComparison.disconnect()
+        self.comparisonTable = MethodComparisonTable()
+        self.comparisonTable.setData(results, self.originView.realScale)
+        self.comparisonTable.methodSelectedSignal.connect(self.labelView.setImage)
+        self.comparisonTable.show()
+
     def __analysisRun(self):
         if not hasattr(self, 'AT'):
             return
+        self.lastAnalysis = None
         progress = QProgressDialog(self)
         progress.setWindowTitle("Analyzing")
         progress.setLabelText("Analyzing...")
         progress.setCancelButtonText("cancel")
         progress.setMinimumDuration(5)
         progress.setWindowModality(Qt.WindowModal)
+        progress.canceled.connect(self.__cancelAnalysis)
         progress.show()
         self.processDialog = progress
         self.processDialog.setMaximum(100)
@@ -557,20 +778,97 @@ class MainWindow(QMainWindow):
         self.AT.process.connect(self.__updateProcessBarValue)
         self.AT.process.connect(self.processDialog.setValue)
         self.AT.finish.connect(self.__analysisFinished)
+        self.AT.cancelled.connect(self.__analysisCancelled)
         self.AT.start()
         self.__updateActionsStatus()
 
     def __analysisFinished(self, binaryImage):
+        if not hasattr(self, 'AT') or self.sender() is not self.AT:
+            return
         self.labelView.setImage(binaryImage)
-        self.AT.process.disconnect()
-        self.AT.finish.disconnect()
+        if self.AT.isIncremental:
+            self.lastAnalysis = self.AT
+        self.__closeAnalysis()
+        QMessageBox.information(self, 'Finished', 'Analysis is Finished.')
+        self.__updateActionsStatus()
+
+    def __polygonDrawFinished(self, drawType, polygon):
+        self.sweepAnalysis = None
+        if drawType == DrawType.CROPPOLYGON:
+            self.lastAnalysis = None
+        elif drawType == DrawType.ROIPOLYGON and self.__isIncremental():
+            self.__updateLabelRegions([self.lastAnalysis.addROI(polygon)])
+        elif drawType == DrawType.ROIPOLYGON:
+            # the ROIs of the last analysis are out of date
+            self.lastAnalysis = None
+
+    def __ROIsDeleted(self, indices):
+        self.sweepAnalysis = None
+        if self.__isIncremental():
+            self.__updateLabelRegions(self.lastAnalysis.removeROIs(indices))
+        else:
+            self.lastAnalysis = None
+        self.__updateActionsStatus()
+
+    def __isIncremental(self):
+        # the result shown is still the one of the last analysis, e.g. not filtered or replaced
+        return self.lastAnalysis is not None and self.labelView.binaryImage is self.lastAnalysis.labelImage
+
+    def __updateLabelRegions(self, windows):
+        '''
+        update the label view and the table in the windows changed by the ROIs
+        '''
+        if self.journal is not None:
+            # changed in place
+            self.journal.binaryImageChanged()
+        tableShown = hasattr(self, 'resultTable') and self.resultTable.isVisible()
+        for window in windows:
+            updated = self.labelView.updateRegion(self.lastAnalysis.labelImage, window)
+            if updated is None:
+                # rendered again as a whole
+                if tableShown:
+                    self.__damageZonesTable()
+                return
+            if tableShown:
+                self.resultTable.updateRegions(*updated)
+
+    def __cancelAnalysis(self):
+        # the thread stops at the next check, then the cancelled signal is emitted
+        if hasattr(self, 'AT'):
+            self.AT.cancel()
+
+    def __analysisCancelled(self, reason):
+        if not hasattr(self, 'AT') or self.sender() is not self.AT:
+            return
+        self.__closeAnalysis()
+        QMessageBox.warning(self, 'Cancelled', reason)
+        self.__updateActionsStatus()
+
+    def __stopAnalysis(self):
+        # cancel the running analysis without waiting before starting a new one, it finishes in the background
+        if not hasattr(self, 'AT'):
+            return
+        thread = self.AT
+        thread.cancel()
+        self.__closeAnalysis()
+        if thread.isRunning():
+            # the QThread is not destroyed while running
+            self.cancelledAnalysisThreads.append(thread)
+            thread.finished.connect(self.__cancelledAnalysisFinished)
+
+    def __cancelledAnalysisFinished(self):
+        if self.sender() in self.cancelledAnalysisThreads:
+            self.cancelledAnalysisThreads.remove(self.sender())
+
+    def __closeAnalysis(self):
+        for signal in [self.AT.process, self.AT.finish, self.AT.cancelled]:
+            signal.disconnect()
         self.processBar.setVisible(False)
         if hasattr(self, 'processDialog'):
+            self.processDialog.canceled.disconnect()
             self.processDialog.close()
             delattr(self, 'processDialog')
-        QMessageBox.information(self, 'Finished', 'Analysis is Finished.')
         delattr(self, 'AT')
-        self.__updateActionsStatus()
 
     # post
     def __exportImageWithROIs(self):
@@ -586,10 +884,6 @@ class MainWindow(QMainWindow):
             # eps format
             # get image and cropPolygon
             image = QImage2NArray(self.originView.getImage())
-            if len(image.shape) > 2:
-                image = image.transpose((1, 0, 2))
-            else:
-                image = image.transpose((1, 0))
             from shapely.geometry import Polygon
             cropPolygon = self.originView.getCropPolygon()
             ROIs = self.originView.getROIsPolygon()
@@ -639,10 +933,25 @@ class MainWindow(QMainWindow):
 
     def __damageZonesTable(self):
         self.resultTable = LabelDataTable()
-        self.resultTable.setData(self.labelView.binaryImage, self.originView.realScale, self.originView.cropPolygon)
+        self.resultTable.setData(self.labelView.binaryImage, self.originView.realScale, self.originView.cropPolygon,
+                                 self.labelView.regions)
+        self.resultTable.setSweepData(*self.__thresholdSweep())
         self.resultTable.show()
         self.__updateActionsStatus()
 
+    def __thresholdSweep(self):
+        '''
+        damaged area versus threshold in the crop area, see AnalysisThread.thresholdSweep. the sweep is kept on the
+        last analysis, which follows the ROIs, or on sweepAnalysis until the image or the ROIs change
+        '''
+        analysis = self.lastAnalysis if self.lastAnalysis is not None else self.sweepAnalysis
+        if analysis is None:
+            analysis = AnalysisThread()
+            analysis.setParameters(QImage2GrayNArray(self.originView.getImage()), self.originView.getCropPolygon(),
+                                   self.originView.getROIsPolygon())
+            self.sweepAnalysis = analysis
+        return analysis.thresholdSweep()
+
     # help
     def __tutorials(self):
         QDesktopServices.openUrl(QUrl('https://blog.cuger.cn'))
@@ -665,7 +974,8 @@ class MainWindow(QMainWindow):
     # change the button status according to the parameters
     def __updateActionsStatus(self) -> None:
         image = self.originView.getImage()
-        hasOriginImage = not (image is None or image is False)
+        # the preview is shown while the project is loading
+        hasOriginImage = self.originImage is not None and not (image is None or image is False)
         self.actionReplaceImage.setEnabled(hasOriginImage)
         self.actionSaveProject.setEnabled(hasOriginImage)
         self.actionSaveProjectAs.setEnabled(hasOriginImage)
@@ -674,11 +984,13 @@ class MainWindow(QMainWindow):
         self.actionSetScale.setEnabled(hasOriginImage)
         self.actionCropImage.setEnabled(hasOriginImage)
         self.actionCreateNewROI.setEnabled(hasOriginImage)
-        self.actionDeleteSelectedROIs.setEnabled(hasOriginImage and len(self.originView.scene.selectedItems()))
+        self.actionDeleteSelectedROIs.setEnabled(hasOriginImage and len(self.originView.getSelectedROIs()))
         self.actionAnalysisOtsuBasedOnROIs.setEnabled(hasOriginImage and len(self.originView.getROIsPolygon()))
         self.actionAnalysisROIs.setEnabled(hasOriginImage and len(self.originView.getROIsPolygon()))
         self.actionAnalysisOTSU.setEnabled(hasOriginImage)
         self.actionAnalysisRiss.setEnabled(hasOriginImage and len(self.originView.getROIsPolygon()))
+        self.actionAnalysisAdaptive.setEnabled(hasOriginImage)
+        self.actionAnalysisComparison.setEnabled(hasOriginImage and len(self.originView.getROIsPolygon()))
         self.actionFilterSmallZones.setEnabled(len(self.labelView.binaryImage.shape))
         self.actionFilterSmallHoles.setEnabled(len(self.labelView.binaryImage.shape))
         self.actionExportImageWithROIs.setEnabled(hasOriginImage)
@@ -699,6 +1011,13 @@ class MainWindow(QMainWindow):
                                     QMessageBox.Yes | QMessageBox.No,
                                     QMessageBox.No)
         if reply == QMessageBox.Yes:
+            # the edits not saved are dropped
+            self.settings.remove(RECOVERY_KEY)
+            # the loading is cancelled between its stages, only the stage running is waited for
+            self.__stopProjectLoading()
+            self.__stopAnalysis()
+            for thread in self.cancelledLoadThreads + self.cancelledAnalysisThreads:
+                thread.wait()
             event.accept()
         else:
             event.ignore()
@@ -713,4 +1032,5 @@ if __name__ == '__main__':
     # mainWindow.originView.setImage(imagePath)
     # mainWindow.originView.setImageCenter()
     mainWindow.show()
+    mainWindow.recoverProject()
     sys.exit(app.exec_())
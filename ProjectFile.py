@@ -0,0 +1,514 @@
+# -*- coding: utf-8 -*-
+
+# @FileName: ProjectFile.py
+# @Time    : 2026-10-18 21:10
+# @Author  : Dorad, cug.xia@gmail.com
+# @Blog    ：https://blog.cuger.cn
+
+'''
+the project file (*.pro), a zip container:
+    header.json: ROIs, crop polygon, scale, color channel and the shapes, read without decoding the arrays
+    image.<jpg|png|tif>: the compressed source bytes of the origin image, e.g. the jpg taken by the mobile phone
+    binaryImage.bin: the binary image, bit-packed by np.packbits and compressed by zlib
+    preview/origin-<size>.jpg, preview/overlay-<size>.png: the pyramid of the image and the rendered damage zones
+        downscaled to PREVIEW_SIZES, shown at once when the project is opened, see ProjectLoadThread
+the entries are stored without the compression of zip, so the time to open and save is proportional to the size of
+the file. the arrays are decoded lazily on the first use.
+
+the edits after the snapshot are appended to the journal next to it, <project>.pro.journal, see ProjectJournal.
+
+the projects pickled before are still opened, see UpgradeProjectLayout.
+'''
+
+import base64
+import json
+import os
+import uuid
+import zipfile
+import zlib
+
+import numpy as np
+from PyQt5.QtCore import Qt, QBuffer, QByteArray, QIODevice, QThread, pyqtSignal
+from PyQt5.QtGui import QImage
+
+from ImageBridge import PROJECT_ARRAY_LAYOUT, UpgradeProjectLayout, NArray2QImage, QImage2NArray
+
+PROJECT_VERSION = 2
+HEADER_NAME = 'header.json'
+BINARY_NAME = 'binaryImage.bin'
+# formats of the source bytes stored as they are, the others are encoded as png
+IMAGE_FORMATS = ['jpg', 'jpeg', 'png', 'tif', 'tiff', 'bmp']
+# the longest sides of the previews
+PREVIEW_SIZES = [2048, 1024, 512, 256]
+# keys of the header edited in the main window
+HEADER_KEYS = ['cropPolygon', 'colorChannel', 'ROIs', 'realScale']
+# the snapshot is saved again when the journal is larger than the ratio of the snapshot or has too many entries
+JOURNAL_COMPACT_RATIO = 0.5
+JOURNAL_COMPACT_ENTRIES = 1000
+
+
+def ImageSource(filePath):
+    '''
+    read the compressed bytes of the image file to be stored in the project
+    :return: (bytes, format)
+    '''
+    imageFormat = os.path.splitext(filePath)[1][1:].lower()
+    if imageFormat not in IMAGE_FORMATS:
+        return None
+    with open(filePath, mode='rb') as f:
+        return f.read(), imageFormat
+
+
+def EncodeQImage(qimage: QImage, imageFormat='png'):
+    '''
+    encode the image, e.g. the image after the median filter which has no source file
+    :return: (bytes, format)
+    '''
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+    if not qimage.save(buffer, imageFormat.upper()):
+        raise IOError('Failed to encode the image as %s.' % imageFormat)
+    buffer.close()
+    return bytes(data), imageFormat
+
+
+def PackBinaryImage(binaryImage: np.ndarray):
+    '''
+    :return: the binary image bit-packed by np.packbits and compressed by zlib
+    '''
+    return zlib.compress(np.packbits(binaryImage.astype(bool, copy=False)).data, 1)
+
+
+def UnpackBinaryImage(data, shape):
+    bits = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+    return np.unpackbits(bits, count=shape[0] * shape[1]).reshape(shape).view(bool)
+
+
+def HasBinaryImage(binaryImage):
+    return isinstance(binaryImage, np.ndarray) and binaryImage.size > 0 and binaryImage.any()
+
+
+def PreviewPyramid(image: QImage, sizes=PREVIEW_SIZES):
+    '''
+    downscale the image to the longest sides, each level from the larger one
+    :return: list of (size, QImage), the sizes not smaller than the image are skipped
+    '''
+    levels = []
+    for size in sorted(sizes, reverse=True):
+        if max(image.width(), image.height()) <= size:
+            continue
+        image = image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        levels.append((size, image))
+    return levels
+
+
+class ProjectFile:
+    '''
+    the project file, the header is read when opened and the images are decoded on the first use:
+        project = ProjectFile(filePath)
+        project.header['ROIs']
+        project.originImage  # QImage
+        project.binaryImage  # ndarray of bool or None
+    '''
+
+    def __init__(self, filePath, recover=False):
+        '''
+        :param recover: replay the autosaved edits not saved, after a crash
+        '''
+        self.filePath = filePath
+        self.recover = recover
+        self.isLegacy = not zipfile.is_zipfile(filePath)
+        self.__originImage = None
+        self.__binaryImage = None
+        # the edits of the image and the binary image replayed from the journal
+        self.filters = []
+        self.__binaryEdit = None
+        self.__regions = None
+        if self.isLegacy:
+            self.__loadLegacy()
+        else:
+            with zipfile.ZipFile(filePath, mode='r') as f:
+                self.header = json.loads(f.read(HEADER_NAME).decode('utf-8'))
+            if self.header.get('version', 0) > PROJECT_VERSION:
+                raise ValueError('The project is saved by a newer version (%s).' % self.header['version'])
+            for edit in ProjectJournal(filePath).read(self.header.get('snapshotId'), recover):
+                self.__replay(edit)
+
+    def __replay(self, edit):
+        op = edit['op']
+        if op == 'set':
+            self.header[edit['key']] = edit['value']
+        elif op == 'addROI':
+            self.header['ROIs'].append(edit['roi'])
+        elif op == 'removeROIs':
+            self.header['ROIs'] = [roi for i, roi in enumerate(self.header['ROIs']) if i not in edit['indices']]
+        elif op == 'medianFilter':
+            self.filters.append({'diskRadius': edit['diskRadius'], 'channel': edit['channel']})
+        elif op == 'binaryImage':
+            self.__binaryEdit = edit
+
+    def __loadLegacy(self):
+        import pickle5 as pickle
+        with open(self.filePath, mode='rb') as f:
+            project = UpgradeProjectLayout(pickle.load(f))
+        self.__originImage = NArray2QImage(project.pop('originImage'))
+        binaryImage = project.pop('binaryImage', None)
+        self.__binaryImage = binaryImage if isinstance(binaryImage, np.ndarray) and binaryImage.any() else None
+        self.header = project
+        self.header['imageShape'] = [self.__originImage.height(), self.__originImage.width()]
+
+    def __read(self, name):
+        with zipfile.ZipFile(self.filePath, mode='r') as f:
+            return f.read(name)
+
+    @property
+    def imageSource(self):
+        '''
+        the compressed bytes of the origin image, (bytes, format), None for the legacy project
+        '''
+        if self.isLegacy:
+            return None
+        return self.__read(self.header['image']), self.header['imageFormat']
+
+    @property
+    def originImage(self) -> QImage:
+        '''
+        the image with the filters of the journal applied
+        '''
+        if self.__originImage is None:
+            data, imageFormat = self.imageSource
+            image = QImage.fromData(data, imageFormat.upper())
+            if image.isNull():
+                raise ValueError('Failed to decode the image of the project.')
+            from ImageTool import QImageMedianFilter
+            for edit in self.filters:
+                image = QImageMedianFilter(image, edit['diskRadius'], edit['channel'])
+            self.__originImage = image
+        return self.__originImage
+
+    @property
+    def binaryImage(self):
+        if self.__binaryImage is not None or self.isLegacy:
+            return self.__binaryImage
+        if self.__binaryEdit is not None:
+            if self.__binaryEdit['data'] is not None:
+                self.__binaryImage = UnpackBinaryImage(base64.b64decode(self.__binaryEdit['data']),
+                                                       self.__binaryEdit['shape'])
+        elif self.header.get('binaryShape'):
+            self.__binaryImage = UnpackBinaryImage(self.__read(BINARY_NAME), self.header['binaryShape'])
+        return self.__binaryImage
+
+    @property
+    def regions(self):
+        '''
+        RegionAnalysis of the binary image, None if not analysed
+        '''
+        if self.__regions is None and self.binaryImage is not None:
+            from ImageTool import RegionAnalysis
+            self.__regions = RegionAnalysis(self.binaryImage)
+        return self.__regions
+
+    def preview(self, size):
+        '''
+        the smallest preview not smaller than the size, the preview of the damage zones is None if it is changed in
+        the journal
+        :param size: the longest side in pixels
+        :return: (QImage of the image, QImage of the damage zones or None), None if no preview is saved
+        '''
+        previews = [] if self.isLegacy or self.filters else self.header.get('previews') or []
+        if not len(previews):
+            return None
+        larger = [preview for preview in previews if max(preview['size']) >= size]
+        preview = min(larger, key=lambda p: max(p['size'])) if larger else max(previews, key=lambda p: max(p['size']))
+        originImage = QImage.fromData(self.__read(preview['origin']), 'JPG')
+        overlayImage = None
+        if preview['overlay'] and self.__binaryEdit is None:
+            overlayImage = QImage.fromData(self.__read(preview['overlay']), 'PNG')
+        return originImage, overlayImage
+
+    def toDict(self):
+        '''
+        the project dict with the arrays in (rows, cols), e.g. for BatchAnalysis
+        '''
+        project = dict(self.header)
+        project['originImage'] = QImage2NArray(self.originImage)
+        project['binaryImage'] = self.binaryImage
+        return project
+
+    @staticmethod
+    def save(filePath, header: dict, originImage: QImage, binaryImage=None, imageSource=None, overlayImage=None):
+        '''
+        save the snapshot of the project, written to a temporary file first so the project is not broken if failed.
+        the journal of the project is started again with the snapshotId of the header returned, see ProjectJournal
+        :param header: cropPolygon, colorChannel, ROIs and realScale
+        :param originImage: QImage, encoded as png if no imageSource
+        :param binaryImage: ndarray of bool in (rows, cols), None or empty if not analysed
+        :param imageSource: (bytes, format) of the source image file, see ImageSource
+        :param overlayImage: QImage of the damage zones rendered, the same size as the image
+        :return: header saved
+        '''
+        if imageSource is None:
+            imageSource = EncodeQImage(originImage)
+        data, imageFormat = imageSource
+        header = dict(header)
+        header.update({
+            'version': PROJECT_VERSION,
+            'arrayLayout': PROJECT_ARRAY_LAYOUT,
+            'image': 'image.%s' % imageFormat,
+            'imageFormat': imageFormat,
+            'imageShape': [originImage.height(), originImage.width()],
+            'binaryShape': None,
+            'snapshotId': uuid.uuid4().hex,
+        })
+        hasBinary = HasBinaryImage(binaryImage)
+        if hasBinary:
+            header['binaryShape'] = list(binaryImage.shape)
+        # previews, name and bytes of the entries
+        header['previews'] = []
+        previewEntries = []
+        overlays = dict(PreviewPyramid(overlayImage)) if hasBinary and overlayImage is not None else {}
+        for size, preview in PreviewPyramid(originImage):
+            originName = 'preview/origin-%d.jpg' % size
+            previewEntries.append((originName, EncodeQImage(preview.convertToFormat(QImage.Format_RGB32), 'jpg')[0]))
+            overlayName = None
+            if size in overlays:
+                overlayName = 'preview/overlay-%d.png' % size
+                previewEntries.append((overlayName, EncodeQImage(overlays[size])[0]))
+            header['previews'].append({'size': [preview.width(), preview.height()], 'origin': originName,
+                                       'overlay': overlayName})
+        tempPath = filePath + '.tmp'
+        try:
+            with zipfile.ZipFile(tempPath, mode='w', compression=zipfile.ZIP_STORED) as f:
+                f.writestr(HEADER_NAME, json.dumps(header))
+                f.writestr(header['image'], data)
+                if hasBinary:
+                    f.writestr(BINARY_NAME, PackBinaryImage(binaryImage))
+                for name, previewData in previewEntries:
+                    f.writestr(name, previewData)
+            os.replace(tempPath, filePath)
+        finally:
+            if os.path.exists(tempPath):
+                os.remove(tempPath)
+        return header
+
+
+class ProjectLoadThread(QThread):
+    '''
+    decode the image and the binary image of the project and label the regions in the background, while the
+    previews are shown
+    '''
+    finish = pyqtSignal(object)  # ProjectFile
+    failed = pyqtSignal(str)
+
+    def __init__(self, projectFile: ProjectFile):
+        QThread.__init__(self)
+        self.projectFile = projectFile
+        self.isCancelled = False
+
+    def cancel(self):
+        # checked between decoding the image, unpacking the binary image and labeling the regions, neither finish
+        # nor failed is emitted when cancelled
+        self.isCancelled = True
+
+    def run(self):
+        try:
+            self.projectFile.originImage
+            if self.isCancelled:
+                return
+            binaryImage = self.projectFile.binaryImage
+            if self.isCancelled:
+                return
+            if binaryImage is not None:
+                # labeled, then the shapes are measured
+                regions = self.projectFile.regions
+                if self.isCancelled:
+                    return
+                regions.shapes
+        except Exception as e:
+            if not self.isCancelled:
+                self.failed.emit(str(e))
+            return
+        if not self.isCancelled:
+            self.finish.emit(self.projectFile)
+
+
+class ProjectJournal:
+    '''
+    append-only journal of the edits after the snapshot of the project, <project>.pro.journal, one json per line:
+        {"op": "snapshot", "id": ...}                      the snapshot the journal belongs to, the first line
+        {"op": "set", "key": "realScale", "value": ...}    crop polygon, color channel or scale set
+        {"op": "addROI", "roi": [[x, y], ...]}
+        {"op": "removeROIs", "indices": [...]}
+        {"op": "medianFilter", "diskRadius": ..., "channel": ...}
+        {"op": "binaryImage", "shape": [rows, cols], "data": ...}  the result of analysis, see PackBinaryImage
+        {"op": "save"}                                     the edits before are saved
+    the edits after the last save are autosaved, they are only replayed to recover the project after a crash.
+
+    the state of the project written is kept, so only the differences are appended:
+        state = {'cropPolygon': ..., 'colorChannel': ..., 'ROIs': ..., 'realScale': ...,
+                 'filters': [{'diskRadius': ..., 'channel': ...}, ...], 'binaryImage': ndarray or None}
+    the checksum of the binary image is computed again only if the binary image is replaced or marked changed in
+    place by binaryImageChanged.
+    '''
+
+    def __init__(self, projectPath):
+        self.projectPath = projectPath
+        self.path = projectPath + '.journal'
+        self.snapshotId = None
+        self.entries = 0  # number of the edits in the journal
+        self.state = None
+        self.binaryImage = None  # the binary image of the state
+        self.isBinaryImageChanged = False  # the binary image of the state is changed in place
+
+    def __readLines(self, snapshotId):
+        '''
+        :return: the entries after the snapshot line, empty if the journal belongs to another snapshot
+        '''
+        if not snapshotId or not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, mode='r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # the last line written when crashed
+                    break
+        if not entries or entries[0].get('op') != 'snapshot' or entries[0].get('id') != snapshotId:
+            return []
+        return entries[1:]
+
+    def __entries(self, snapshotId, recover):
+        entries = self.__readLines(snapshotId)
+        if not recover:
+            saved = [i for i, entry in enumerate(entries) if entry['op'] == 'save']
+            entries = entries[:saved[-1] + 1] if saved else []
+        return entries
+
+    def read(self, snapshotId, recover=False):
+        '''
+        :param recover: the edits not saved are included
+        :return: list of the edits
+        '''
+        return [entry for entry in self.__entries(snapshotId, recover) if entry['op'] != 'save']
+
+    def hasUnsaved(self, snapshotId):
+        entries = self.__readLines(snapshotId)
+        return bool(entries) and entries[-1]['op'] != 'save'
+
+    def attach(self, snapshotId, state, recover=False):
+        '''
+        continue the journal of the snapshot opened, the edits not saved are dropped unless recovered
+        :param state: the state of the project opened
+        '''
+        entries = self.__entries(snapshotId, recover)
+        self.snapshotId = snapshotId
+        self.__setState(self.__digest(state), state)
+        self.entries = len([entry for entry in entries if entry['op'] != 'save'])
+        self.__rewrite([{'op': 'snapshot', 'id': snapshotId}] + entries)
+
+    def reset(self, snapshotId, state):
+        '''
+        start the journal of the snapshot just saved
+        '''
+        self.snapshotId = snapshotId
+        self.__setState(self.__digest(state), state)
+        self.entries = 0
+        self.__rewrite([{'op': 'snapshot', 'id': snapshotId}])
+
+    def write(self, state, save=False):
+        '''
+        append the edits from the state written last time
+        :param save: the edits are saved, or autosaved to recover after a crash
+        :return: number of the edits appended
+        '''
+        digest = self.__digest(state)
+        edits = self.__diff(self.state, digest, state)
+        lines = edits + ([{'op': 'save'}] if save else [])
+        if lines:
+            with open(self.path, mode='a', encoding='utf-8') as f:
+                for line in lines:
+                    f.write(json.dumps(line) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        self.__setState(digest, state)
+        self.entries += len(edits)
+        return len(edits)
+
+    def binaryImageChanged(self):
+        '''
+        the binary image written last time is changed in place, e.g. by the incremental analysis
+        '''
+        self.isBinaryImageChanged = True
+
+    def needsCompaction(self):
+        if self.entries > JOURNAL_COMPACT_ENTRIES:
+            return True
+        if not os.path.exists(self.path) or not os.path.exists(self.projectPath):
+            return False
+        return os.path.getsize(self.path) > JOURNAL_COMPACT_RATIO * os.path.getsize(self.projectPath)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __rewrite(self, lines):
+        tempPath = self.path + '.tmp'
+        with open(tempPath, mode='w', encoding='utf-8') as f:
+            for line in lines:
+                f.write(json.dumps(line) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tempPath, self.path)
+
+    def __setState(self, digest, state):
+        self.state = digest
+        self.binaryImage = state['binaryImage']
+        self.isBinaryImageChanged = False
+
+    def __digest(self, state):
+        '''
+        the state kept to find the differences, the binary image by its checksum
+        '''
+        digest = {key: state[key] for key in HEADER_KEYS}
+        digest['filters'] = list(state['filters'])
+        binaryImage = state['binaryImage']
+        if self.state is not None and binaryImage is self.binaryImage and not self.isBinaryImageChanged:
+            # not changed since written last time
+            digest['binaryImage'] = self.state['binaryImage']
+        elif HasBinaryImage(binaryImage):
+            digest['binaryImage'] = (binaryImage.shape, zlib.crc32(np.packbits(binaryImage.astype(bool, copy=False))))
+        else:
+            digest['binaryImage'] = None
+        return digest
+
+    @staticmethod
+    def __diff(old, new, state):
+        edits = []
+        for key in ['cropPolygon', 'colorChannel', 'realScale']:
+            if old[key] != new[key]:
+                edits.append({'op': 'set', 'key': key, 'value': new[key]})
+        # the ROIs are appended or deleted, the others are set as a whole
+        oldROIs, newROIs = old['ROIs'], new['ROIs']
+        removed = []
+        j = 0
+        for i, roi in enumerate(oldROIs):
+            if j < len(newROIs) and newROIs[j] == roi:
+                j += 1
+            else:
+                removed.append(i)
+        if removed:
+            edits.append({'op': 'removeROIs', 'indices': removed})
+        edits.extend([{'op': 'addROI', 'roi': roi} for roi in newROIs[j:]])
+        if old['filters'] != new['filters'][:len(old['filters'])]:
+            raise ValueError('The image is changed, the snapshot must be saved.')
+        edits.extend([dict(edit, op='medianFilter') for edit in new['filters'][len(old['filters']):]])
+        if old['binaryImage'] != new['binaryImage']:
+            binaryImage = state['binaryImage']
+            if new['binaryImage'] is None:
+                edits.append({'op': 'binaryImage', 'shape': None, 'data': None})
+            else:
+                edits.append({'op': 'binaryImage', 'shape': list(binaryImage.shape),
+                              'data': base64.b64encode(PackBinaryImage(binaryImage)).decode('ascii')})
+        return edits
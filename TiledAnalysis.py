@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+# @FileName: TiledAnalysis.py
+# @Time    : 2026-10-18 15:20
+# @Author  : Dorad, cug.xia@gmail.com
+# @Blog    ：https://blog.cuger.cn
+
+'''
+tiled analysis for the images too large for the memory, e.g. the stitched scans of rock joint.
+the image is memory-mapped (*.npy, uncompressed *.tif) and analyzed strip by strip, the statistics such as the
+histogram for OTSU are gathered in the first passes and the binary image is written in the last pass, so the peak
+memory is bounded by the tile budget instead of the image size. the gray image and the bins of the histograms are the
+same as the analysis in memory, see NAImage2GrayNArray and MaskedHistogram, so are the thresholds and the results.
+
+the arrays here are in the layout of the image file, (rows, cols), the polygons are [[x, y], ...] as in the project.
+'''
+
+import os
+import time
+
+import numpy as np
+
+from AnalysisThread import AnalysisCancelled
+from ImageTool import GRAY_DTYPE, MaskedHistogram, NAImage2GrayNArray, OtsuThresholdByHistogram
+
+METHODS = ['otsu', 'rois', 'riss', 'sdzm']
+
+
+def OpenImageMemmap(filePath):
+    '''
+    open the image as memory-mapped array without reading it
+    :param filePath: *.npy or uncompressed *.tif
+    :return: array with the shape of (rows, cols) or (rows, cols, channels)
+    '''
+    ext = os.path.splitext(filePath)[1].lower()
+    if ext == '.npy':
+        return np.load(filePath, mmap_mode='r')
+    if ext in ['.tif', '.tiff']:
+        import tifffile
+        try:
+            return tifffile.memmap(filePath, mode='r')
+        except ValueError as e:
+            raise ValueError('%s can not be memory-mapped, save it as uncompressed tif or npy: %s' % (filePath, e))
+    raise ValueError('Only *.npy and *.tif can be memory-mapped: %s' % filePath)
+
+
+def _polygonMask(polygon: np.array, rowStart, rowStop, width):
+    '''
+    mask of the polygon in the strip of rows
+    :param polygon: [[x, y], ...]
+    :return: slice of the columns of the polygon bounding box, mask of the strip in the columns, None if not overlap
+    '''
+    x0 = max(int(np.floor(polygon[:, 0].min())), 0)
+    x1 = min(int(np.ceil(polygon[:, 0].max())) + 1, width)
+    y0 = max(int(np.floor(polygon[:, 1].min())), rowStart)
+    y1 = min(int(np.ceil(polygon[:, 1].max())) + 1, rowStop)
+    if x1 <= x0 or y1 <= y0:
+        return None, None
+    from skimage import draw
+    mask = np.zeros((rowStop - rowStart, x1 - x0), dtype=bool)
+    mask[y0 - rowStart:y1 - rowStart] = draw.polygon2mask((y1 - y0, x1 - x0), polygon[:, ::-1] - [y0, x0])
+    return slice(x0, x1), mask
+
+
+class TiledAnalysis:
+    '''
+    analysis of the memory-mapped image strip by strip
+    '''
+
+    def __init__(self, image: np.array, channel='RGB', tileBudget=256 * 1024 * 1024):
+        '''
+        :param image: memory-mapped image, see OpenImageMemmap
+        :param channel: RGB, Gray, Red, Green or Blue
+        :param tileBudget: bytes of the working memory of a strip
+        '''
+        if image.dtype not in (np.uint8, np.uint16):
+            raise ValueError('Only 8-bit and 16-bit images are supported, not %s.' % image.dtype)
+        self.image = image
+        self.channel = channel.upper()
+        self.height, self.width = image.shape[0], image.shape[1]
+        # source, RGB of the gray source, float64 RGB and gray of rgb2gray, gray, crop mask, ROI mask and output of
+        # each pixel
+        channels = image.shape[2] if len(image.shape) > 2 else 1
+        bytesPerPixel = channels * image.itemsize + 3 * image.itemsize + 24 + 8 + np.dtype(GRAY_DTYPE).itemsize + 3
+        self.tileRows = int(max(1, min(self.height, tileBudget // (self.width * bytesPerPixel))))
+        self.threshold = None
+        self.timeBudget = None
+        self.startTime = None
+
+    def setTimeBudget(self, timeBudget=None):
+        '''
+        :param timeBudget: wall-clock seconds from now of all the analyses, None for no limit
+        '''
+        self.timeBudget = timeBudget
+        self.startTime = time.time()
+
+    def checkCancelled(self):
+        if self.timeBudget and time.time() - self.startTime > self.timeBudget:
+            raise AnalysisCancelled('The analysis exceeds the time budget of %g s.' % self.timeBudget)
+
+    def tiles(self):
+        for rowStart in range(0, self.height, self.tileRows):
+            yield rowStart, min(rowStart + self.tileRows, self.height)
+
+    def grayTile(self, rowStart, rowStop):
+        '''
+        gray image of the strip in [0, 1], the same as the image loaded in memory, see BatchAnalysis.loadProject
+        '''
+        tile = np.asarray(self.image[rowStart:rowStop])
+        if len(tile.shape) < 3:
+            tile = np.stack([tile] * 3, axis=2)
+        return NAImage2GrayNArray(tile[:, :, 0:3], self.channel, dtype=GRAY_DTYPE, stripSize=tile.shape[0])
+
+    def cropTile(self, cropPolygon, rowStart, rowStop):
+        if cropPolygon is None:
+            return np.ones((rowStop - rowStart, self.width), dtype=bool)
+        mask = np.zeros((rowStop - rowStart, self.width), dtype=bool)
+        cols, cropMask = _polygonMask(cropPolygon, rowStart, rowStop, self.width)
+        if cropMask is not None:
+            mask[:, cols] = cropMask
+        return mask
+
+    def cropArea(self, cropPolygon=None):
+        '''
+        number of pixels in the crop polygon
+        '''
+        if cropPolygon is not None:
+            cropPolygon = np.asarray(cropPolygon, dtype=float)
+        return sum([np.sum(self.cropTile(cropPolygon, rowStart, rowStop)) for rowStart, rowStop in self.tiles()])
+
+    def analysis(self, method, cropPolygon=None, ROIs=[], outputPath=None, process=None):
+        '''
+        :param method: otsu, rois, riss or sdzm
+        :param cropPolygon: [[x, y], ...], None for the whole image
+        :param ROIs: list of [[x, y], ...]
+        :param outputPath: *.npy of the binary image, None for a temporary memmap
+        :param process: callback of the process in percent
+        :return: memory-mapped binary image, the threshold is saved in self.threshold
+        '''
+        if method not in METHODS:
+            raise ValueError('The method should be one of %s.' % ', '.join(METHODS))
+        if cropPolygon is not None:
+            cropPolygon = np.asarray(cropPolygon, dtype=float)
+        ROIs = [np.asarray(roi, dtype=float) for roi in ROIs]
+        if method != 'otsu' and not len(ROIs):
+            raise ValueError('The ROIs should be set for the method %s.' % method)
+        tiles = list(self.tiles())
+        passes = 1 if method == 'rois' else 3
+
+        def updateProcess(passIndex, tileIndex):
+            self.checkCancelled()
+            if process:
+                process(int((passIndex * len(tiles) + tileIndex + 1) / (passes * len(tiles)) * 100))
+
+        def strips(withGray=True):
+            # gray image, crop mask and [(index, cols, mask)] of the ROIs overlapping each strip
+            for rowStart, rowStop in tiles:
+                edgeMask = self.cropTile(cropPolygon, rowStart, rowStop)
+                roiMasks = []
+                for j, roi in enumerate(ROIs):
+                    cols, roiMask = _polygonMask(roi, rowStart, rowStop, self.width)
+                    if roiMask is not None:
+                        roiMask &= edgeMask[:, cols]
+                        roiMasks.append((j, cols, roiMask))
+                yield self.grayTile(rowStart, rowStop) if withGray else None, edgeMask, roiMasks
+
+        def selections(gray, edgeMask, roiMasks):
+            # (index of the statistics, image, mask) in the strip, in the crop polygon for otsu, in the union of
+            # the ROIs for riss and in each ROI for sdzm
+            if method == 'otsu':
+                yield 0, gray, edgeMask
+            elif method == 'riss':
+                roisMask = np.zeros(gray.shape, dtype=bool)
+                for j, cols, roiMask in roiMasks:
+                    roisMask[:, cols] |= roiMask
+                yield 0, gray, roisMask
+            else:
+                for j, cols, roiMask in roiMasks:
+                    yield j, gray[:, cols], roiMask
+
+        if method != 'rois':
+            count = 1 if method != 'sdzm' else len(ROIs)
+            # first pass, the range of the pixels for the bins of the histograms, the sum for the mean
+            sizes, sums = np.zeros(count, dtype=np.int64), np.zeros(count, dtype=np.float64)
+            minValues, maxValues = [None] * count, [None] * count
+            for i, (gray, edgeMask, roiMasks) in enumerate(strips()):
+                for j, image, mask in selections(gray, edgeMask, roiMasks):
+                    selected = image[mask]
+                    if not selected.size:
+                        continue
+                    sizes[j] += selected.size
+                    sums[j] += np.sum(selected, dtype=np.float64)
+                    minValue, maxValue = selected.min(), selected.max()
+                    minValues[j] = minValue if minValues[j] is None else min(minValues[j], minValue)
+                    maxValues[j] = maxValue if maxValues[j] is None else max(maxValues[j], maxValue)
+                updateProcess(0, i)
+            # second pass, the histograms in the bins of the whole image, the deviations for the std
+            hists, deviations = [None] * count, np.zeros(count, dtype=np.float64)
+            means = sums / np.maximum(sizes, 1)
+            for i, (gray, edgeMask, roiMasks) in enumerate(strips()):
+                for j, image, mask in selections(gray, edgeMask, roiMasks):
+                    if not sizes[j]:
+                        continue
+                    if method == 'riss':
+                        deviations[j] += np.sum((image[mask] - means[j]) ** 2, dtype=np.float64)
+                    elif minValues[j] != maxValues[j]:
+                        hist, binCenters = MaskedHistogram(image, mask, (minValues[j], maxValues[j]))
+                        hists[j] = (hist, binCenters) if hists[j] is None else (hists[j][0] + hist, binCenters)
+                updateProcess(1, i)
+            thresholds = []
+            for j in range(count):
+                if method == 'riss':
+                    # nan for no pixel in the ROIs, as the mean of the empty array in memory
+                    thresholds.append(means[j] + 1.96 * np.sqrt(deviations[j] / sizes[j]) if sizes[j] else np.nan)
+                elif not sizes[j]:
+                    thresholds.append(0 if method == 'otsu' else None)
+                elif minValues[j] == maxValues[j]:
+                    thresholds.append(minValues[j])
+                else:
+                    thresholds.append(OtsuThresholdByHistogram(*hists[j]))
+            self.threshold = thresholds if method == 'sdzm' else thresholds[0]
+        else:
+            self.threshold = None
+
+        # last pass, threshold each strip and write it into the output
+        if outputPath:
+            bw = np.lib.format.open_memmap(outputPath, mode='w+', dtype=bool, shape=(self.height, self.width))
+        else:
+            import tempfile
+            bw = np.memmap(tempfile.TemporaryFile(), dtype=bool, mode='w+', shape=(self.height, self.width))
+        for i, ((rowStart, rowStop), (gray, edgeMask, roiMasks)) in enumerate(zip(tiles, strips(method != 'rois'))):
+            tileBw = np.zeros(edgeMask.shape, dtype=bool)
+            if method in ['otsu', 'riss']:
+                np.greater_equal(gray, self.threshold, out=tileBw, where=edgeMask)
+            else:
+                for j, cols, roiMask in roiMasks:
+                    if method == 'rois':
+                        tileBw[:, cols] |= roiMask
+                    elif self.threshold[j] is not None:
+                        tileBw[:, cols] |= roiMask & (gray[:, cols] >= self.threshold[j])
+            bw[rowStart:rowStop] = tileBw
+            updateProcess(passes - 1, i)
+        bw.flush()
+        return bw
+
+
+def AnalyseTiled(sourcePath, method, cropPolygon=None, ROIs=[], outputPath=None, channel='RGB',
+                 tileBudget=256 * 1024 * 1024):
+    '''
+    analyse the memory-mapped image, see TiledAnalysis.analysis
+    :return: memory-mapped binary image and the threshold
+    '''
+    analysis = TiledAnalysis(OpenImageMemmap(sourcePath), channel, tileBudget)
+    bw = analysis.analysis(method, cropPolygon, ROIs, outputPath)
+    return bw, analysis.threshold
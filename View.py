@@ -6,14 +6,16 @@
 # @Blog    ：https://blog.cuger.cn
 
 
+import math
 from enum import Enum
 
-from PyQt5.QtCore import pyqtSignal, Qt, QRect, QPoint, QRectF, QLineF
-from PyQt5.QtGui import QIcon, QWheelEvent, QPainter, QPainterPath, QMouseEvent, QPen, QColor, QKeyEvent, QPolygon
+from PyQt5.QtCore import pyqtSignal, Qt, QRect, QPoint, QPointF, QRectF, QLineF, QSize, QSizeF, QTimer
+from PyQt5.QtGui import QIcon, QWheelEvent, QPainter, QPainterPath, QMouseEvent, QPen, QColor, QKeyEvent, QTransform
 from PyQt5.QtWidgets import QGraphicsView, QGraphicsScene, QPushButton, QVBoxLayout, QHBoxLayout, QGraphicsItem, \
-    QInputDialog, QMessageBox, QWidget, QApplication, QSplitter
+    QInputDialog, QMessageBox, QWidget, QApplication, QSplitter, QGraphicsPixmapItem, QStyleOptionGraphicsItem
 from skimage import morphology
 
+from ImageBridge import NewQImage, NArray2QImage
 from ImageTool import *
 
 
@@ -32,6 +34,241 @@ class DrawType(Enum):
     SCALELINE = 3
 
 
+class TiledImageItem(QGraphicsPixmapItem):
+    '''
+    pixmap item painted tile by tile from a mipmap pyramid: only the tiles exposed are painted, from the level
+    matching the scale of the view, so the cost of a frame depends on the size of the view instead of the image.
+    the level n is the pixmap downscaled by 2^n, each tile built from the 4 tiles of the level below on the first
+    use. the tiles are dropped when the pixmap is changed, only in the rect for updatePixmap.
+    '''
+    TILE_SIZE = 512
+
+    def __init__(self, pixmap: QPixmap):
+        QGraphicsPixmapItem.__init__(self, pixmap)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)  # the exposed rect
+        self.tiles = {}  # (level, row, col) -> QPixmap, the levels from 1
+        self.smooth = True
+
+    def setPixmap(self, pixmap: QPixmap):
+        QGraphicsPixmapItem.setPixmap(self, pixmap)
+        self.tiles.clear()
+
+    def takePixmap(self):
+        '''
+        release the pixmap for painting into it, otherwise the painter copies the whole pixmap shared with the item.
+        the item shows nothing until updatePixmap
+        :return: QPixmap
+        '''
+        pixmap = self.pixmap()
+        QGraphicsPixmapItem.setPixmap(self, QPixmap())
+        return pixmap
+
+    def updatePixmap(self, pixmap: QPixmap, rect: QRect):
+        '''
+        set the pixmap changed in the rect only, e.g. the one of takePixmap
+        '''
+        QGraphicsPixmapItem.setPixmap(self, pixmap)
+        for key in list(self.tiles):
+            level, row, col = key
+            size = self.TILE_SIZE << level
+            if rect.intersects(QRect(col * size, row * size, size, size)):
+                del self.tiles[key]
+
+    def setSmooth(self, smooth):
+        '''
+        :param smooth: bilinear filtering when zoomed out, or the nearest pixel while zooming or panning. the pixels
+        are always the nearest when zoomed in, as QGraphicsPixmapItem
+        '''
+        if self.smooth != smooth:
+            self.smooth = smooth
+            self.update()
+
+    def maxLevel(self):
+        size = max(self.pixmap().width(), self.pixmap().height(), 1)
+        return max(0, math.ceil(math.log2(size / self.TILE_SIZE)))
+
+    def tile(self, level, row, col):
+        '''
+        :return: QPixmap of the tile, up to TILE_SIZE, None if out of the pixmap
+        '''
+        size = self.TILE_SIZE << level
+        x, y = col * size, row * size
+        pixmap = self.pixmap()
+        if x >= pixmap.width() or y >= pixmap.height():
+            return None
+        if level == 0:
+            return pixmap.copy(x, y, min(size, pixmap.width() - x), min(size, pixmap.height() - y))
+        key = (level, row, col)
+        if key not in self.tiles:
+            width = math.ceil(min(size, pixmap.width() - x) / (1 << level))
+            height = math.ceil(min(size, pixmap.height() - y) / (1 << level))
+            tile = QPixmap(width, height)
+            tile.fill(Qt.transparent)
+            painter = QPainter(tile)
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+            painter.setRenderHint(QPainter.SmoothPixmapTransform, True)
+            half = self.TILE_SIZE // 2
+            for i in range(2):
+                for j in range(2):
+                    child = self.tile(level - 1, row * 2 + i, col * 2 + j)
+                    if child is not None:
+                        painter.drawPixmap(QRectF(j * half, i * half, child.width() / 2, child.height() / 2),
+                                           child, QRectF(child.rect()))
+            painter.end()
+            self.tiles[key] = tile
+        return self.tiles[key]
+
+    def paint(self, painter: QPainter, option: QStyleOptionGraphicsItem, widget=None):
+        pixmap = self.pixmap()
+        if pixmap.isNull():
+            return
+        levelOfDetail = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        level = min(self.maxLevel(), max(0, int(math.floor(math.log2(1 / levelOfDetail))))) if levelOfDetail > 0 else 0
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, self.smooth and levelOfDetail < 1)
+        exposed = option.exposedRect.intersected(QRectF(pixmap.rect()))
+        size = self.TILE_SIZE << level
+        for row in range(int(exposed.top()) // size, int(math.ceil(exposed.bottom())) // size + 1):
+            for col in range(int(exposed.left()) // size, int(math.ceil(exposed.right())) // size + 1):
+                x, y = col * size, row * size
+                if x >= pixmap.width() or y >= pixmap.height():
+                    continue
+                target = QRectF(x, y, min(size, pixmap.width() - x), min(size, pixmap.height() - y))
+                if level == 0:
+                    painter.drawPixmap(target, pixmap, target)
+                    continue
+                tile = self.tile(level, row, col)
+                painter.drawPixmap(target, tile, QRectF(tile.rect()))
+
+
+class ROILayerItem(QGraphicsItem):
+    '''
+    all the ROIs in one item. the ROIs are indexed by a grid over their bounding rects: the outlines of the ROIs are
+    batched into one path for the cell of their top left corner, only the exposed cells are painted, and the cost of
+    picking does not grow with the number of ROIs. the ROIs are referred by their indices, in the order added.
+    '''
+
+    def __init__(self, pen: QPen, brush: QColor, cellSize=256):
+        QGraphicsItem.__init__(self)
+        self.setAcceptedMouseButtons(Qt.NoButton)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)
+        self.pen = pen
+        self.brush = brush
+        self.cellSize = cellSize
+        self.polygons = []
+        self.rects = []  # bounding rects of the ROIs
+        self.selected = set()
+        self.grid = {}  # (row, col) of the cell -> indices of the ROIs whose bounding rect overlaps the cell
+        self.batches = {}  # (row, col) of the cell -> indices of the ROIs whose top left corner is in the cell
+        self.paths = {}  # (row, col) of the cell -> batched path of the ROIs in self.batches, built when painted
+        self.rect = QRectF()
+        self.extent = QSizeF()  # max size of the ROIs
+
+    def __cell(self, point: QPointF):
+        return math.floor(point.y() / self.cellSize), math.floor(point.x() / self.cellSize)
+
+    def __cells(self, rect: QRectF):
+        top, left = self.__cell(rect.topLeft())
+        bottom, right = self.__cell(rect.bottomRight())
+        for row in range(top, bottom + 1):
+            for col in range(left, right + 1):
+                yield row, col
+
+    def __index(self, index):
+        rect = self.rects[index]
+        for cell in self.__cells(rect):
+            self.grid.setdefault(cell, []).append(index)
+        cell = self.__cell(rect.topLeft())
+        self.batches.setdefault(cell, []).append(index)
+        self.paths.pop(cell, None)
+        self.rect = self.rect.united(rect)
+        self.extent = self.extent.expandedTo(rect.size())
+
+    def setStyle(self, pen: QPen, brush: QColor):
+        self.prepareGeometryChange()
+        self.pen = pen
+        self.brush = brush
+        self.update()
+
+    def addPolygon(self, polygon: QPolygonF):
+        self.prepareGeometryChange()
+        self.polygons.append(QPolygonF(polygon))
+        self.rects.append(polygon.boundingRect())
+        self.__index(len(self.polygons) - 1)
+        self.update()
+        return len(self.polygons) - 1
+
+    def removePolygons(self, indices):
+        self.prepareGeometryChange()
+        removed = set(indices)
+        # the new indices of the ROIs kept, the cells are updated without computing again
+        newIndices, count = {}, 0
+        for i in range(len(self.polygons)):
+            if i not in removed:
+                newIndices[i] = count
+                count += 1
+        for cells in (self.grid, self.batches):
+            for cell in list(cells.keys()):
+                if cells is self.batches and any(i in removed for i in cells[cell]):
+                    self.paths.pop(cell, None)
+                cells[cell] = [newIndices[i] for i in cells[cell] if i not in removed]
+                if not len(cells[cell]):
+                    del cells[cell]
+        self.polygons = [polygon for i, polygon in enumerate(self.polygons) if i not in removed]
+        self.rects = [rect for i, rect in enumerate(self.rects) if i not in removed]
+        self.selected = set()
+        # the bounding rect and the max size are kept, they are only the bounds for painting
+        if not len(self.polygons):
+            self.rect, self.extent = QRectF(), QSizeF()
+        self.update()
+
+    def pick(self, point: QPointF):
+        '''
+        :return: index of the ROI at the point, the last added if overlapped, None if not found
+        '''
+        for i in reversed(self.grid.get(self.__cell(point), [])):
+            if self.rects[i].contains(point) and self.polygons[i].containsPoint(point, Qt.OddEvenFill):
+                return i
+        return None
+
+    def setSelected(self, indices):
+        self.selected = set(indices)
+        self.update()
+
+    def boundingRect(self) -> QRectF:
+        margin = self.pen.widthF() / 2 + 1
+        return self.rect.adjusted(-margin, -margin, margin, margin)
+
+    def paint(self, painter: QPainter, option: QStyleOptionGraphicsItem, widget=None):
+        # the ROIs overlapping the exposed rect have the top left corner in the expanded rect
+        margin = self.pen.widthF() / 2 + 1
+        exposedRect = option.exposedRect.adjusted(-self.extent.width() - margin, -self.extent.height() - margin,
+                                                  margin, margin).intersected(self.rect)
+        for cell in self.__cells(exposedRect):
+            if cell not in self.batches:
+                continue
+            if cell not in self.paths:
+                path = QPainterPath()
+                for i in self.batches[cell]:
+                    path.addPolygon(self.polygons[i])
+                    path.closeSubpath()
+                self.paths[cell] = path
+            # filling the polygons one by one is much faster than filling the path of the overlapped polygons,
+            # and the overlaps are darker as before
+            painter.setPen(Qt.NoPen)
+            painter.setBrush(self.brush)
+            for i in self.batches[cell]:
+                painter.drawPolygon(self.polygons[i])
+            painter.setPen(self.pen)
+            painter.setBrush(Qt.NoBrush)
+            painter.drawPath(self.paths[cell])
+        if len(self.selected):
+            # the dashed bounding rects as the selected QGraphicsItem
+            painter.setPen(QPen(Qt.black, 0, Qt.DashLine))
+            painter.setBrush(Qt.NoBrush)
+            for i in self.selected:
+                painter.drawRect(self.rects[i])
+
+
 class View(QGraphicsView):
     MousePosChanged = pyqtSignal([float, float], name='position of mouse has changed.')
 
@@ -40,6 +277,12 @@ class View(QGraphicsView):
 
         self.initUi()
 
+        # smooth filtering of the image after zooming or panning is stopped for 150 ms
+        self.interactionTimer = QTimer(self)
+        self.interactionTimer.setSingleShot(True)
+        self.interactionTimer.setInterval(150)
+        self.interactionTimer.timeout.connect(self.__stopInteraction)
+
         # button
         self.scene = QGraphicsScene(self)
         self.setScene(self.scene)
@@ -71,6 +314,7 @@ class View(QGraphicsView):
 
         self.imageItem = None
         self.originImage = None
+        self.imageSize = None  # size of the image in the scene, the full size for the preview
         self.imageGateType = ImageGateType.RGB
 
         self.setMouseTracking(True)
@@ -93,8 +337,22 @@ class View(QGraphicsView):
                 self.currentScale * scale) < 1 / self.maxScaleTimes:
             return
         self.currentScale *= scale
+        self.__startInteraction()
         self.scale(scale, scale)
 
+    def __startInteraction(self):
+        if isinstance(self.imageItem, TiledImageItem):
+            self.imageItem.setSmooth(False)
+        self.interactionTimer.start()
+
+    def __stopInteraction(self):
+        if isinstance(self.imageItem, TiledImageItem):
+            self.imageItem.setSmooth(True)
+
+    def scrollContentsBy(self, dx: int, dy: int) -> None:
+        self.__startInteraction()
+        QGraphicsView.scrollContentsBy(self, dx, dy)
+
     def zoomIn(self):
         self.__scale(1)
 
@@ -114,16 +372,32 @@ class View(QGraphicsView):
     def setImage(self, image: QImage):
         """
         set the image
-        :param imagePath:
+        :param image: QImage, or QPixmap shown without converting
         """
         if self.imageItem:
             self.scene.removeItem(self.imageItem)
             self.imageItem = None
-        self.originImage = QPixmap.fromImage(image)
-        self.imageItem = self.scene.addPixmap(self.originImage)
+        self.originImage = image if isinstance(image, QPixmap) else QPixmap.fromImage(image)
+        self.imageSize = self.originImage.size()
+        self.imageItem = TiledImageItem(self.originImage)
+        self.scene.addItem(self.imageItem)
         self.imageItem.setZValue(0)
         self.centerOn(self.imageItem)
 
+    def setPreview(self, image: QImage, size: QSize):
+        """
+        show the preview downscaled from the image, scaled to the size of the image in the scene, so the polygons
+        are in the coordinates of the image. replaced by setImage when the image is loaded
+        :param size: size of the image
+        """
+        View.setImage(self, image)
+        self.imageSize = size
+        self.imageItem.setTransform(QTransform.fromScale(size.width() / image.width(), size.height() / image.height()))
+        self.centerOn(self.imageItem)
+
+    def imageRect(self):
+        return QRectF(QPointF(0, 0), QSizeF(self.imageSize))
+
     def getImage(self):
         if not self.imageItem:
             return False
@@ -155,18 +429,28 @@ class View(QGraphicsView):
 class PolygonView(View):
     PolygonDrawFinishedSignal = pyqtSignal([DrawType, QPolygonF], name='Polygon drawing finished')
     RealScaleChangedSignal = pyqtSignal([float, float], name='new real scale and old real scale')
+    ROIsDeletedSignal = pyqtSignal([list], name='indices of the deleted ROIs')
+    ROIsSelectedSignal = pyqtSignal([list], name='indices of the selected ROIs')
 
     def __init__(self):
         View.__init__(self)
         self.initUi()
+        # the polygon drawing follows the mouse at most once a frame of the screen
+        screen = QApplication.primaryScreen()
+        refreshRate = screen.refreshRate() if screen is not None and screen.refreshRate() > 0 else 60
+        self.drawingTimer = QTimer(self)
+        self.drawingTimer.setSingleShot(True)
+        self.drawingTimer.setInterval(max(1, int(1000 / refreshRate)))
+        self.drawingTimer.timeout.connect(self.__tmpPolygonRender)
 
     def initUi(self):
         View.initUi(self)
         self.isDrawing = False  # 是否正在绘制多边形
         self.pointsCache = []
+        self.tempPolygonItem = None  # the polygon being drawn, updated in place
         self.cropPolygon = QPolygonF()
         # self.cropPolygonItem = None
-        self.ROIPolygonsItems = []
+        self.roiLayer = None  # ROILayerItem of the ROIs, added to the scene with the first ROI
         self.realScale = None
 
         # draw type
@@ -178,7 +462,7 @@ class PolygonView(View):
             scale = 6
             dashScale = 2
         else:
-            scale = self.originImage.width() / 500
+            scale = self.imageSize.width() / 500
             dashScale = 1
         self.tmpRoiPolygonPen = QPen(Qt.red, scale * 0.5)
         self.tmpRoiPolygonPen.setDashOffset(10)
@@ -191,6 +475,8 @@ class PolygonView(View):
         self.penCropPolygon = QPen(Qt.green, scale)
         self.penROIsPolygon = QPen(Qt.red, scale * 0.5)
         self.penROIsPolygonFillColor = QColor(200, 0, 0, 35)
+        if self.roiLayer is not None:
+            self.roiLayer.setStyle(self.penROIsPolygon, self.penROIsPolygonFillColor)
 
     # ACTION
     def startDrawCropPolygon(self):
@@ -207,6 +493,13 @@ class PolygonView(View):
 
     def setImage(self, image: QImage):
         View.setImage(self, image)
+        self.__updateImage()
+
+    def setPreview(self, image: QImage, size: QSize):
+        View.setPreview(self, image, size)
+        self.__updateImage()
+
+    def __updateImage(self):
         if len(self.cropPolygon) > 2:
             self.setCropPolygon(self.cropPolygon)
         else:
@@ -221,21 +514,47 @@ class PolygonView(View):
         return QPolygonF(image.rect())
 
     def getROIsPolygon(self):
-        ROIsPolygon = []
-        for item in self.ROIPolygonsItems:
-            ROIsPolygon.append(item.polygon())
-        return ROIsPolygon
+        if self.roiLayer is None:
+            return []
+        return [QPolygonF(polygon) for polygon in self.roiLayer.polygons]
 
     def addRoiPolygon(self, polygon: QPolygonF):
-        item = self.scene.addPolygon(polygon, self.penROIsPolygon, self.penROIsPolygonFillColor)
-        item.setFlag(QGraphicsItem.ItemIsSelectable, True)
-        item.setZValue(100)
-        self.ROIPolygonsItems.append(item)
+        if self.roiLayer is None:
+            self.roiLayer = ROILayerItem(self.penROIsPolygon, self.penROIsPolygonFillColor)
+            self.roiLayer.setZValue(100)
+            self.scene.addItem(self.roiLayer)
+        self.roiLayer.addPolygon(polygon)
+
+    def getSelectedROIs(self):
+        '''
+        :return: indices of the selected ROIs
+        '''
+        return [] if self.roiLayer is None else sorted(self.roiLayer.selected)
+
+    def selectROIs(self, indices):
+        if self.roiLayer is None:
+            return
+        self.roiLayer.setSelected(indices)
+        self.ROIsSelectedSignal.emit(self.getSelectedROIs())
 
     def deleteSelectedROIs(self):
-        for item in self.scene.selectedItems():
-            self.scene.removeItem(item)
-            self.ROIPolygonsItems.remove(item)
+        indices = self.getSelectedROIs()
+        if len(indices):
+            self.roiLayer.removePolygons(indices)
+            self.ROIsDeletedSignal.emit(indices)
+            self.ROIsSelectedSignal.emit([])
+
+    def __pickROI(self, event: QMouseEvent):
+        # select the ROI clicked, toggled with ctrl as QGraphicsScene
+        index = self.roiLayer.pick(self.mapToScene(event.pos()))
+        selected = set(self.roiLayer.selected)
+        if event.modifiers() & Qt.ControlModifier:
+            if index is not None:
+                selected ^= {index}
+        else:
+            selected = set() if index is None else {index}
+        if selected != self.roiLayer.selected:
+            self.selectROIs(selected)
 
     def clear(self):
         View.clear(self)
@@ -288,7 +607,7 @@ class PolygonView(View):
 
     def setCropPolygon(self, cropPolygon=None):
         if not cropPolygon or not len(cropPolygon):
-            self.cropPolygon = QPolygonF(QRectF(self.getImage().rect()))
+            self.cropPolygon = QPolygonF(self.imageRect())
         else:
             self.cropPolygon = cropPolygon
         if not self.imageItem:
@@ -298,6 +617,8 @@ class PolygonView(View):
         newImage.fill(Qt.transparent)
         path = QPainterPath()
         path.addPolygon(self.cropPolygon)
+        # in the coordinates of the pixmap, scaled for the preview
+        path = self.imageItem.transform().inverted()[0].map(path)
         painter = QPainter(newImage)
         painter.setClipPath(path)
         painter.drawPixmap(QPointF(), originImage)
@@ -306,29 +627,36 @@ class PolygonView(View):
         self.imageItem.update()
 
     def __tmpPolygonRender(self):
-        if hasattr(self, 'tempPolygonItem') and self.tempPolygonItem is not None:
-            self.scene.removeItem(self.tempPolygonItem)
-            self.tempPolygonItem = None
-        if len(self.pointsCache) and self.isDrawing:
-            polygon = QPolygonF()
-            for point in self.pointsCache:
-                polygon.append(point)
-            if self.mousePos:
-                polygon.append(QPointF(self.mapToScene(self.mousePos)))
+        # the scene repaints the old and new bounding rects of the item only
+        self.drawingTimer.stop()
+        if not (len(self.pointsCache) and self.isDrawing):
+            if self.tempPolygonItem is not None:
+                self.tempPolygonItem.setVisible(False)
+            return
+        polygon = QPolygonF()
+        for point in self.pointsCache:
+            polygon.append(point)
+        if self.mousePos:
+            polygon.append(QPointF(self.mapToScene(self.mousePos)))
+        pen = self.tmpCropPolygonPen
+        if self.DrawType == DrawType.SCALELINE:
+            pen = self.tmpScaleLinePolygonPen
+        elif self.DrawType == DrawType.CROPPOLYGON:
             pen = self.tmpCropPolygonPen
-            if self.DrawType == DrawType.SCALELINE:
-                pen = self.tmpScaleLinePolygonPen
-            elif self.DrawType == DrawType.CROPPOLYGON:
-                pen = self.tmpCropPolygonPen
-            elif self.DrawType == DrawType.ROIPOLYGON:
-                pen = self.tmpRoiPolygonPen
+        elif self.DrawType == DrawType.ROIPOLYGON:
+            pen = self.tmpRoiPolygonPen
+        if self.tempPolygonItem is None:
             self.tempPolygonItem = self.scene.addPolygon(polygon, pen)
-
-        self.update()
-        self.viewport().update()
+            self.tempPolygonItem.setZValue(200)
+            return
+        self.tempPolygonItem.setPen(pen)
+        self.tempPolygonItem.setPolygon(polygon)
+        self.tempPolygonItem.setVisible(True)
 
     def mousePressEvent(self, event: QMouseEvent) -> None:
         View.mousePressEvent(self, event)
+        if event.button() == Qt.LeftButton and not self.isDrawing and self.roiLayer is not None:
+            self.__pickROI(event)
         if event.button() == Qt.LeftButton and self.isDrawing:
             # point = QPoint(event.pos().x(), event.pos().y())
             point = self.mapToScene(event.pos())
@@ -345,7 +673,9 @@ class PolygonView(View):
         self.mousePos = event.pos()
         if self.isDrawing:
             self.setCursor(Qt.CrossCursor)
-            self.__tmpPolygonRender()
+            # coalesced, the mouse moves faster than the screen refreshes
+            if not self.drawingTimer.isActive():
+                self.drawingTimer.start()
         else:
             self.setCursor(Qt.ArrowCursor)
 
@@ -383,14 +713,22 @@ class LabelImageView(View):
         self.cropPolygon = QPolygonF()
         self.binaryImage = np.zeros([], dtype=bool)
         self.realScale = None
+        self.regions = None  # RegionAnalysis of the binary image, shared with the table
+        self.renderImage = None  # kept for updating the changed regions only
+        self.renderBuffer = None  # ARGB32 pixels of the render image, the view of its buffer
+        self.labelColors = None  # ARGB32 color of each label, white for the background
 
     def setCropPolygon(self, cropPolygon: np.ndarray):
         self.cropPolygon = cropPolygon
         self.__updateDrawnItems()
 
     # 重载, 设置标签图像, 用于展示结果
-    def setImage(self, binaryImage: np.array):
+    def setImage(self, binaryImage: np.array, regions=None):
+        '''
+        :param regions: RegionAnalysis of the binary image if labeled before, e.g. when the project is loaded
+        '''
         self.binaryImage = binaryImage
+        self.regions = regions
         self.__updateDrawnItems()
 
     def filterSmallZones(self):
@@ -402,10 +740,9 @@ class LabelImageView(View):
                                                       'Miniumn size of block(mm^2)', 0.5, 0, 100, 4)
         if not ok:
             return
-        # filter the small blocks
-        self.binaryImage = morphology.remove_small_objects(self.binaryImage,
-                                                           minBlockSizeVlue / self.realScale / self.realScale,
-                                                           connectivity=2)
+        # filter the small blocks by the areas of the labels, without labeling again
+        self.regions = self.__getRegions().filterSmallRegions(minBlockSizeVlue / self.realScale / self.realScale)
+        self.binaryImage = self.regions.binaryImage
         self.__updateDrawnItems()
 
     def filterSmallHoles(self):
@@ -425,46 +762,78 @@ class LabelImageView(View):
     def getBinaryImage(self):
         return NArray2QImage(self.binaryImage * 255)
 
+    def updateRegion(self, binaryImage: np.array, window: tuple):
+        '''
+        relabel and render only the regions touching the changed window of the binary image
+        :param binaryImage: the binary image changed in the window only
+        :param window: slices of the changed region, see QPolygon2LocalMask
+        :return: see RegionAnalysis.updateRegion, None if the whole image is rendered again
+        '''
+        if self.regions is None or self.regions.labelImage.shape != binaryImage.shape:
+            self.binaryImage = binaryImage
+            self.__updateDrawnItems()
+            return None
+        self.binaryImage = binaryImage
+        removedLabels, localLabelImage, offset = self.regions.updateRegion(binaryImage, window)
+        region = tuple(slice(o, o + size) for o, size in zip(offset, localLabelImage.shape))
+        # colors of the new labels, then render the region through the lookup table
+        self.labelColors = np.concatenate([self.labelColors, self.__labelColors(len(self.labelColors))])
+        self.renderBuffer[region] = self.labelColors[self.regions.labelImage[region]]
+        self.__updatePixmap(QRect(offset[1], offset[0], localLabelImage.shape[1], localLabelImage.shape[0]))
+        return removedLabels, localLabelImage, offset
+
+    def __getRegions(self):
+        # labeled once for each binary image
+        if self.regions is None or self.regions.binaryImage is not self.binaryImage:
+            self.regions = RegionAnalysis(self.binaryImage)
+        return self.regions
+
     def __updateDrawnItems(self):
         if np.sum(self.binaryImage) <= 0:
+            self.regions = None
             return
         if self.imageItem:
             self.scene.removeItem(self.imageItem)
-        from skimage import measure
-        labelImage = measure.label(self.binaryImage)
-        # 分析 property, 计算角度
-        renderImage = QImage(labelImage.shape[0], labelImage.shape[1], QImage.Format_ARGB32)
-        renderImage.fill(Qt.white)
-        painter = QPainter(renderImage)
-        from skimage import measure
-        data = measure.regionprops(labelImage)
-        for labelData in data:
-            # generate the color for each label according to the orientation and axis_length
-            orientation = labelData.orientation
-            if not labelData.major_axis_length or not labelData.minor_axis_length:
-                ratioOfMainAxisAndSecondaryAxis = 0
-            else:
-                ratioOfMainAxisAndSecondaryAxis = 1 - labelData.minor_axis_length / labelData.major_axis_length / 5
-            labelColor = self.colorBar.getColorByAngleAndRP(orientation,
-                                                            ratioOfMainAxisAndSecondaryAxis)
-            painter.setPen(labelColor)
-            points = QPolygon()
-            for point in labelData.coords:
-                points.append(QPoint(point[0], point[1]))
-            painter.drawPoints(points)
-        painter.end()
-        cropPixmap = QPixmap(renderImage.size())
-        cropPixmap.fill(Qt.transparent)
+        regions = self.__getRegions()
+        # 分析 property, 计算角度, 每个标签一个颜色, 再按标签查表
+        self.labelColors = self.__labelColors()
+        height, width = regions.labelImage.shape
+        self.renderImage, self.renderBuffer = NewQImage(height, width, QImage.Format_ARGB32)
+        np.take(self.labelColors, regions.labelImage, out=self.renderBuffer)
+        self.imageItem = TiledImageItem(QPixmap(self.renderImage.size()))
+        self.scene.addItem(self.imageItem)
+        self.__updatePixmap()
+        self.centerOn(self.imageItem)
+
+    def __labelColors(self, start=0):
+        '''
+        ARGB32 color of the labels from start, according to the orientation and the axis ratio
+        '''
+        orientation, axisRatio = (shape[start:] for shape in self.regions.shapes)
+        # 0 if the major or minor axis is 0
+        ratioOfMainAxisAndSecondaryAxis = np.where(axisRatio > 0, 1 - axisRatio / 5, 0)
+        labelColors = self.colorBar.getColorsByAngleAndRP(orientation, ratioOfMainAxisAndSecondaryAxis)
+        if start == 0:
+            labelColors[0] = QColor(Qt.white).rgba()
+        return labelColors
+
+    def __updatePixmap(self, rect: QRect = None):
+        # copy the rendered image in the rect into the pixmap shown, clipped by the crop polygon
+        cropPixmap = self.imageItem.takePixmap()
+        if rect is None:
+            rect = cropPixmap.rect()
         cropPixmapPainter = QPainter(cropPixmap)
+        cropPixmapPainter.setCompositionMode(QPainter.CompositionMode_Source)
+        cropPixmapPainter.fillRect(rect, Qt.transparent)
+        cropPixmapPainter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+        cropPixmapPainter.setClipRect(rect)
         if len(self.cropPolygon) > 2:
             path = QPainterPath()
             path.addPolygon(self.cropPolygon)
-            cropPixmapPainter.setClipPath(path)
-        cropPixmapPainter.drawPixmap(QPoint(), QPixmap.fromImage(renderImage))
+            cropPixmapPainter.setClipPath(path, Qt.IntersectClip)
+        cropPixmapPainter.drawImage(rect, self.renderImage, rect)
         cropPixmapPainter.end()
-        # renderImage = QPixmap.fromImage(renderImage)
-        self.imageItem = self.scene.addPixmap(cropPixmap)
-        self.centerOn(self.imageItem)
+        self.imageItem.updatePixmap(cropPixmap, rect)
 
     def clear(self):
         View.clear(self)
@@ -478,17 +847,32 @@ class ColorCircle(QWidget):
         self.setFixedSize(radius * 2, radius * 2)
         self.setWindowFlags(Qt.FramelessWindowHint)
         self.setAttribute(Qt.WA_TranslucentBackground)
+        self.pixmap = None  # the wheel rendered once, for the radius and the device pixel ratio of pixmapKey
+        self.pixmapKey = None
 
     def paintEvent(self, ev):
         QWidget.paintEvent(self, ev)
+        devicePixelRatio = self.devicePixelRatioF()
+        if self.pixmapKey != (self.radius, devicePixelRatio):
+            self.pixmap = self.__wheelPixmap(devicePixelRatio)
+            self.pixmapKey = (self.radius, devicePixelRatio)
         p = QPainter(self)
-        for i in range(self.width()):
-            for j in range(self.height()):
-                angle = np.arctan2(j - self.radius, i - self.radius)
-                r = np.sqrt(np.power(i - self.radius, 2) + np.power(j - self.radius, 2))
-                color = self.getColorByAngleAndRP(angle, r / self.radius)
-                p.setPen(color)
-                p.drawPoint(i, j)
+        p.drawPixmap(0, 0, self.pixmap)
+        p.end()
+
+    def __wheelPixmap(self, devicePixelRatio=1.0):
+        '''
+        render the wheel in the device pixels
+        '''
+        size = int(round(self.radius * 2 * devicePixelRatio))
+        # coordinates of the device pixels in the widget
+        j, i = (coordinates / devicePixelRatio for coordinates in np.ogrid[0:size, 0:size])
+        angles = np.arctan2(j - self.radius, i - self.radius)
+        radiusPercentages = np.sqrt(np.power(i - self.radius, 2) + np.power(j - self.radius, 2)) / self.radius
+        colors = self.getColorsByAngleAndRP(angles, radiusPercentages)
+        pixmap = QPixmap.fromImage(NArray2QImage(colors))
+        pixmap.setDevicePixelRatio(devicePixelRatio)
+        return pixmap
 
     def getColorByAngleAndRP(self, angle, radiusPercentage):
         color = QColor(255, 255, 255, 0)
@@ -500,6 +884,29 @@ class ColorCircle(QWidget):
             color.setHsvF(h, s, v, 1.0)
         return color
 
+    def getColorsByAngleAndRP(self, angles, radiusPercentages):
+        '''
+        vectorized getColorByAngleAndRP, the HSV is converted in the same way as QColor
+        :return: ARGB32 colors as uint32 in the shape of angles, e.g. the lookup table of the labels
+        '''
+        angles, v = np.broadcast_arrays(np.asarray(angles, dtype=float), np.asarray(radiusPercentages, dtype=float))
+        h = np.mod(angles + 2 * np.pi, 2 * np.pi) / np.pi % 1
+        # QColor keeps the hue in 1/100 degree and the value in 16 bits, the saturation is 1
+        hue = np.floor(h * 36000 + 0.5)
+        h = np.where(hue == 36000, 0, hue / 6000)
+        value = np.floor(np.clip(v, 0, 1) * 65535 + 0.5) / 65535
+        sector = h.astype(int)
+        f = h - sector
+        q, t = value * (1 - f), value * (1 - (1 - f))
+        zero = np.zeros_like(value)
+        rgb = np.choose(sector[..., None] % 6, [
+            np.stack(channels, axis=-1) for channels in [(value, t, zero), (q, value, zero), (zero, value, t),
+                                                         (zero, q, value), (t, zero, value), (value, zero, q)]])
+        # 16 bits to 8 bits as QColor.rgba
+        rgb = np.floor(np.floor(rgb * 65535 + 0.5) / 257 + 0.5).astype(np.uint32)
+        colors = 0xFF000000 | (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+        return np.where(v <= 1.0, colors, QColor(255, 255, 255, 0).rgba()).astype(np.uint32)
+
 
 if __name__ == '__main__':
     import sys